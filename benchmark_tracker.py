@@ -0,0 +1,219 @@
+"""
+Benchmark of the tracking pipeline of tracker.py: decoding, preprocessing, model forward,
+tracker.update, saving the results, plotting and writing the video. Copy it to
+PaddleDetection/tools/ next to infer_mot_batch.py, e.g.
+
+    # stub detector taking 30ms per frame, on a synthetic video of 1500 frames
+    python tools/benchmark_tracker.py -c configs/mot/fairmot/fairmot_dla34_30e_1088x608.yml \
+        --num_frames 1500 --stub_latency 0.03 --save_videos --output bench/stub.json
+    # the real model on CPU
+    python tools/benchmark_tracker.py -c configs/mot/fairmot/fairmot_dla34_30e_1088x608.yml \
+        -o weights=https://paddledet.bj.bcebos.com/models/mot/fairmot_dla34_30e_1088x608.pdparams \
+        --num_frames 200 --real_model --output bench/cpu.json
+
+A video of pedestrian-like boxes moving over a textured background is generated once in
+--work_dir. The stub detector returns the boxes drawn in every frame, with an embedding per
+box so the tracker keeps the ids, after sleeping --stub_latency seconds. The report has the
+latency percentiles of every stage, the occupancy of every queue and the end to end fps, as
+json; the pipeline options of the config (capture_queue_depth, capture_num_workers,
+render_policy, render_every, mot_flush_every...) can be changed with -o to compare runs.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+
+# add python path of PadleDetection to sys.path
+parent_path = os.path.abspath(os.path.join(__file__, *(['..'] * 2)))
+if parent_path not in sys.path:
+    sys.path.append(parent_path)
+
+import json
+import time
+
+import cv2
+import numpy as np
+
+
+def parse_args():
+    from ppdet.utils.cli import ArgsParser
+    parser = ArgsParser()
+    parser.add_argument("--work_dir", type=str, default="output/benchmark",
+                        help="Directory of the synthetic video and of the tracking outputs.")
+    parser.add_argument("--output", type=str, default=None, help="Json report, printed only if empty.")
+    parser.add_argument("--num_frames", type=int, default=1500, help="Length of the synthetic video.")
+    parser.add_argument("--width", type=int, default=1920, help="Width of the synthetic video.")
+    parser.add_argument("--height", type=int, default=1080, help="Height of the synthetic video.")
+    parser.add_argument("--num_objects", type=int, default=12, help="Number of moving boxes.")
+    parser.add_argument("--frame_rate", type=float, default=25, help="Frame rate of the synthetic video.")
+    parser.add_argument("--real_model", action='store_true', help="Run the model of the config instead of the stub.")
+    parser.add_argument("--stub_latency", type=float, default=0.03, help="Seconds the stub detector takes per frame.")
+    parser.add_argument("--device", type=str, default="cpu", help="Device of the model, e.g. cpu or gpu:0.")
+    parser.add_argument("--batch_size", type=int, default=None, help="Frames per forward, see Tracker.mot_predict.")
+    parser.add_argument("--save_videos", action='store_true', help="Render and write the result video.")
+    parser.add_argument("--draw_threshold", type=float, default=0.5, help="Threshold to reserve the result.")
+    return parser.parse_args()
+
+
+class SyntheticScene(object):
+    """
+    Boxes of pedestrian size bouncing off the borders at constant speed. The boxes of a frame
+    only depend on the seed, so the video and the stub detector agree without sharing state.
+    """
+
+    def __init__(self, width=1920, height=1080, num_objects=12, seed=0):
+        rng = np.random.RandomState(seed)
+        self.width, self.height = width, height
+        w = rng.uniform(0.03, 0.06, num_objects) * width
+        self.size = np.stack([w, w * rng.uniform(2.2, 2.8, num_objects)], axis=1)
+        self.origin = rng.uniform(0, 1, (num_objects, 2)) * (np.array([width, height]) - self.size)
+        self.speed = rng.uniform(-6, 6, (num_objects, 2))
+        self.colors = rng.randint(0, 255, (num_objects, 3))
+        self.embeddings = rng.normal(size=(num_objects, 128)).astype(np.float32)
+        self.background = cv2.GaussianBlur(rng.randint(0, 255, (height, width, 3), dtype=np.uint8), (0, 0), 3)
+
+    def boxes(self, frame):
+        """[x0, y0, x1, y1] of every box in frame `frame` (from 0)."""
+        span = np.array([self.width, self.height]) - self.size
+        # reflect the straight motion into [0, span]
+        pos = np.abs((self.origin + self.speed * frame) % (2 * span) - span)
+        pos = span - pos
+        return np.concatenate([pos, pos + self.size], axis=1)
+
+    def render(self, frame):
+        img = self.background.copy()
+        for (x0, y0, x1, y1), color in zip(self.boxes(frame).astype(int), self.colors):
+            cv2.rectangle(img, (x0, y0), (x1, y1), tuple(int(c) for c in color), -1)
+        return img
+
+
+def make_video(path, scene, num_frames, frame_rate=25):
+    if os.path.exists(path):
+        return path
+    tmp_path = path + '.tmp.mp4'
+    writer = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*'mp4v'), frame_rate, (scene.width, scene.height))
+    assert writer.isOpened(), "Cannot write {}".format(tmp_path)
+    for frame in range(num_frames):
+        writer.write(scene.render(frame))
+    writer.release()
+    os.replace(tmp_path, path)
+    return path
+
+
+class StubDetector(object):
+    """
+    Stands in for the model in Tracker: returns the boxes of the synthetic scene, frame after
+    frame, and keeps the tracker of the real model.
+    """
+
+    def __init__(self, tracker, scene, latency=0.03, score=0.9, noise=0.05, seed=0):
+        self.tracker = tracker
+        self.scene = scene
+        self.latency = latency
+        self.score = score
+        self.noise = noise
+        self.rng = np.random.RandomState(seed)
+        self.frame = 0
+
+    def eval(self):
+        pass
+
+    def __call__(self, data):
+        import paddle
+        tic = time.perf_counter()
+        boxes = self.scene.boxes(self.frame)
+        self.frame += 1
+        dets = np.concatenate([boxes, np.full((len(boxes), 1), self.score)], axis=1).astype(np.float32)
+        embs = self.scene.embeddings + self.noise * self.rng.normal(size=self.scene.embeddings.shape)
+        embs = (embs / np.linalg.norm(embs, axis=1, keepdims=True)).astype(np.float32)
+        rest = self.latency - (time.perf_counter() - tic)
+        if rest > 0:
+            time.sleep(rest)
+        return paddle.to_tensor(dets), paddle.to_tensor(embs)
+
+
+def main():
+    FLAGS = parse_args()
+    import paddle
+    from ppdet.core.workspace import load_config, merge_config
+    from ppdet.engine import Tracker
+    from ppdet.engine.tracker import MOTResultWriter, StageProfiler
+    from ppdet.modeling.mot.tracker.base_jde_tracker import BaseTrack
+
+    cfg = load_config(FLAGS.config)
+    merge_config(FLAGS.opt)
+    paddle.set_device(FLAGS.device)
+    assert cfg.architecture in ['JDE', 'FairMOT'], "Only JDE and FairMOT are benchmarked"
+
+    if not os.path.exists(FLAGS.work_dir):
+        os.makedirs(FLAGS.work_dir)
+    scene = SyntheticScene(FLAGS.width, FLAGS.height, FLAGS.num_objects)
+    video_file = make_video(
+        os.path.join(FLAGS.work_dir, 'synthetic_{}x{}_{}_{}.mp4'.format(
+            FLAGS.width, FLAGS.height, FLAGS.num_objects, FLAGS.num_frames)),
+        scene, FLAGS.num_frames, FLAGS.frame_rate)
+
+    tracker = Tracker(cfg, mode='test')
+    if FLAGS.real_model:
+        tracker.load_weights_jde(cfg.weights)
+    else:
+        tracker.model = StubDetector(tracker.model.tracker, scene, FLAGS.stub_latency)
+    BaseTrack._count = 0
+
+    capture = cv2.VideoCapture(video_file)
+    video_writer = None
+    if FLAGS.save_videos:
+        video_writer = cv2.VideoWriter(os.path.join(FLAGS.work_dir, 'benchmark_vis.mp4'),
+                                       cv2.VideoWriter_fourcc(*'mp4v'), FLAGS.frame_rate,
+                                       (FLAGS.width, FLAGS.height))
+    result_writer = MOTResultWriter(os.path.join(FLAGS.work_dir, 'benchmark.txt'), 'mot',
+                                    flush_every=cfg.get('mot_flush_every', 100))
+    checkpoint_file = os.path.join(FLAGS.work_dir, 'benchmark.txt.ckpt')
+    profiler = StageProfiler()
+
+    start = time.perf_counter()
+    with paddle.no_grad():
+        _, num_frames, _, _ = tracker._eval_seq_jde(
+            None,
+            frame_rate=FLAGS.frame_rate,
+            draw_threshold=FLAGS.draw_threshold,
+            capture=capture,
+            writer=video_writer,
+            batch_size=FLAGS.batch_size or cfg.get('mot_batch_size', 1),
+            result_writer=result_writer,
+            checkpoint_file=checkpoint_file,
+            profiler=profiler)
+    result_writer.close()
+    if video_writer is not None:
+        video_writer.release()
+    elapsed = time.perf_counter() - start
+    capture.release()
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
+    report = profiler.summary(num_frames, elapsed)
+    report['settings'] = {
+        'video': video_file,
+        'width': FLAGS.width,
+        'height': FLAGS.height,
+        'num_objects': FLAGS.num_objects,
+        'model': cfg.architecture if FLAGS.real_model else 'stub',
+        'stub_latency': None if FLAGS.real_model else FLAGS.stub_latency,
+        'device': FLAGS.device,
+        'save_videos': FLAGS.save_videos,
+        'opt': FLAGS.opt,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if FLAGS.output:
+        if os.path.dirname(FLAGS.output) and not os.path.exists(os.path.dirname(FLAGS.output)):
+            os.makedirs(os.path.dirname(FLAGS.output))
+        with open(FLAGS.output, 'w') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,7 @@ import glob
 import os
 import sys
 
+import torch
 import torch.nn.functional as F
 import cv2
 import numpy as np
@@ -21,6 +22,7 @@ from fastreid.config import get_cfg
 from fastreid.utils.logger import setup_logger
 from fastreid.utils.file_io import PathManager
 
+from feature_store import FeatureStore
 from predictor import FeatureExtractionDemo
 
 # import some modules added in project like this below
@@ -64,6 +66,11 @@ def get_parser():
         default='demo_output',
         help='path to save features'
     )
+    parser.add_argument(
+        "--feature-cache",
+        default="",
+        help="directory to cache extracted features, defaults to <output>/feature_cache",
+    )
     parser.add_argument(
         "--opts",
         help="Modify config options using the command-line 'KEY VALUE' pairs",
@@ -83,15 +90,25 @@ def postprocess(features):
 if __name__ == '__main__':
     args = get_parser().parse_args()
     cfg = setup_cfg(args)
-    demo = FeatureExtractionDemo(cfg, parallel=args.parallel)
+    demo = None
+    store = FeatureStore(args.feature_cache or os.path.join(args.output, "feature_cache"), cfg, tag="image")
 
     PathManager.mkdirs(args.output)
     if args.input:
         if PathManager.isdir(args.input[0]):
             args.input = glob.glob(os.path.expanduser(args.input[0]))
             assert args.input, "The input path(s) was not found"
-        for path in tqdm.tqdm(args.input):
-            img = cv2.imread(path)
-            feat = demo.run_on_image(img)
+        rows = store.lookup(args.input)
+        for path, row in zip(tqdm.tqdm(args.input), rows):
+            if row >= 0:
+                feat = torch.from_numpy(store.get([row]))
+            else:
+                # only build the model once an image is not in the cache
+                if demo is None:
+                    demo = FeatureExtractionDemo(cfg, parallel=args.parallel)
+                img = cv2.imread(path)
+                feat = demo.run_on_image(img)
+                store.put([path], feat.numpy())
             feat = postprocess(feat)
             np.save(os.path.join(args.output, os.path.basename(path).split('.')[0] + '.npy'), feat)
+        store.flush()
@@ -0,0 +1,126 @@
+# encoding: utf-8
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from fastreid.utils.crop_shards import SHARD_PREFIX, ShardPathHandler
+from fastreid.utils.file_io import PathManager
+
+
+class FeatureStore(object):
+    """
+    On-disk cache of image features, so that re-runs only extract features for new or changed images.
+    Features of one model setting (weights file content, INPUT.SIZE_TEST, TEST.FLIP and a
+    preprocessing `tag`) live in their own directory as a single memory-mapped ``feats.npy``
+    of shape (num_rows, dim), plus an ``index.json`` mapping each image path to its row,
+    mtime and size. An image whose mtime or size changed is extracted again into the same row.
+    """
+
+    def __init__(self, root, cfg, tag=""):
+        """
+        Args:
+            root (str): directory holding the caches of all model settings.
+            cfg (CfgNode): config of the model the features come from.
+            tag (str): name of the preprocessing pipeline, features of different tags never mix.
+        """
+        self.root = os.path.join(root, self.namespace(cfg, tag))
+        PathManager.mkdirs(self.root)
+        self._index_file = os.path.join(self.root, "index.json")
+        self._feat_file = os.path.join(self.root, "feats.npy")
+
+        self.items = {}
+        self.num_rows = 0
+        self._feats = None
+        if os.path.exists(self._index_file) and os.path.exists(self._feat_file):
+            with open(self._index_file, "r") as f:
+                index = json.load(f)
+            self.items = index["items"]
+            self.num_rows = index["num_rows"]
+            self._feats = np.load(self._feat_file, mmap_mode="r+")
+
+    @staticmethod
+    def namespace(cfg, tag=""):
+        sha1 = hashlib.sha1()
+        if cfg.MODEL.WEIGHTS and os.path.isfile(cfg.MODEL.WEIGHTS):
+            with open(cfg.MODEL.WEIGHTS, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    sha1.update(chunk)
+        setting = [list(cfg.INPUT.SIZE_TEST), bool(cfg.TEST.FLIP.ENABLED), tag]
+        sha1.update(json.dumps(setting).encode())
+        return sha1.hexdigest()[:16]
+
+    @staticmethod
+    def _stat(path):
+        if path.startswith(SHARD_PREFIX):
+            # crops in shards are never modified in place, a new version has a new offset
+            shards, name = ShardPathHandler.split(path)
+            offset, length = shards.stat(name)
+            return path, offset, length
+        st = os.stat(path)
+        return os.path.abspath(path), st.st_mtime_ns, st.st_size
+
+    def lookup(self, paths):
+        """
+        Returns:
+            np.ndarray: row of every path in the store, -1 for new or changed images.
+        """
+        rows = np.full(len(paths), -1, dtype=np.int64)
+        for i, path in enumerate(paths):
+            key, mtime, size = self._stat(path)
+            item = self.items.get(key)
+            if item is not None and item[0] == mtime and item[1] == size:
+                rows[i] = item[2]
+        return rows
+
+    def get(self, rows):
+        return np.asarray(self._feats[rows])
+
+    def put(self, paths, feats):
+        """
+        Write the features of `paths`, reusing the rows of images that were already cached.
+        """
+        feats = np.asarray(feats, dtype=np.float32)
+        rows = np.empty(len(paths), dtype=np.int64)
+        for i, path in enumerate(paths):
+            key, mtime, size = self._stat(path)
+            item = self.items.get(key)
+            if item is None:
+                row = self.num_rows
+                self.num_rows += 1
+            else:
+                row = item[2]
+            self.items[key] = [mtime, size, row]
+            rows[i] = row
+
+        self._reserve(self.num_rows, feats.shape[1])
+        self._feats[rows] = feats
+        return rows
+
+    def _reserve(self, num_rows, dim):
+        if self._feats is not None:
+            assert self._feats.shape[1] == dim, \
+                "Feature dim {} does not match the cache {}".format(dim, self._feats.shape[1])
+            if num_rows <= self._feats.shape[0]:
+                return
+        # grow geometrically, copying the cached rows into a new file
+        capacity = max(num_rows, 1024 if self._feats is None else 2 * self._feats.shape[0])
+        tmp_file = self._feat_file + ".tmp"
+        feats = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=np.float32, shape=(capacity, dim))
+        if self._feats is not None:
+            feats[:self._feats.shape[0]] = self._feats
+            del self._feats
+        feats.flush()
+        del feats
+        os.replace(tmp_file, self._feat_file)
+        self._feats = np.load(self._feat_file, mmap_mode="r+")
+
+    def flush(self):
+        if self._feats is not None:
+            self._feats.flush()
+        tmp_file = self._index_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"num_rows": self.num_rows, "items": self.items}, f)
+        os.replace(tmp_file, self._index_file)
@@ -0,0 +1,302 @@
+# encoding: utf-8
+
+import argparse
+import datetime
+import glob
+import logging
+import os
+import re
+import sys
+
+import cv2
+import numpy as np
+import openpyxl
+import torch
+import torch.nn.functional as F
+import tqdm
+from PIL import Image
+from torch.backends import cudnn
+
+sys.path.append('.')
+
+from fastreid.config import get_cfg
+from fastreid.utils.logger import setup_logger
+from feature_store import FeatureStore
+from predictor import FeatureExtractionDemo
+
+cudnn.benchmark = True
+setup_logger(name="fastreid")
+
+logger = logging.getLogger('fastreid.merge_suggestions')
+
+# crop names written by generate.ipynb: pid, camera, video segment, frame and date time
+CROP_PATTERN = re.compile(r'(\d*)_c(\d*)s(\d*)_(\d*)_(\d*)\.jpg')
+
+
+def setup_cfg(args):
+    # load config from file and command-line arguments
+    cfg = get_cfg()
+    cfg.merge_from_file(args.config_file)
+    cfg.merge_from_list(args.opts)
+    cfg.freeze()
+    return cfg
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Suggest cross-camera id merges for merge.ipynb")
+    parser.add_argument(
+        "--config-file",
+        metavar="FILE",
+        help="path to config file",
+    )
+    parser.add_argument(
+        "--input",
+        help="directory of the crops of all cameras, named as generate.ipynb does",
+    )
+    parser.add_argument(
+        "--cam-ids",
+        nargs="+",
+        default=None,
+        help="camera ids of every column of the merge sheet, e.g. '1,3 2' puts cameras 1 and 3 "
+             "in the first column, as cam_ids in merge.ipynb. Default is one column per camera",
+    )
+    parser.add_argument(
+        "--output",
+        default="merge_suggestions.xlsx",
+        help="merge sheet to write",
+    )
+    parser.add_argument(
+        "--aggregate",
+        default="quality",
+        choices=["mean", "quality"],
+        help="average the crop features of a track, or weight them by crop area",
+    )
+    parser.add_argument(
+        "--threshold",
+        default=0.5,
+        type=float,
+        help="minimum cosine similarity of two tracks to suggest merging them",
+    )
+    parser.add_argument(
+        "--topk",
+        default=5,
+        type=int,
+        help="number of candidate tracks kept per track in every other column",
+    )
+    parser.add_argument(
+        "--max-gap",
+        default=600,
+        type=float,
+        help="maximum number of seconds between two tracks, negative to disable",
+    )
+    parser.add_argument(
+        "--no-overlap",
+        action='store_true',
+        help="do not merge tracks that are visible at the same time",
+    )
+    parser.add_argument(
+        "--batch-size",
+        default=64,
+        type=int,
+        help="number of crops per forward pass",
+    )
+    parser.add_argument(
+        "--feature-cache",
+        default="feature_cache",
+        help="directory to cache extracted features",
+    )
+    parser.add_argument(
+        "--opts",
+        help="Modify config options using the command-line 'KEY VALUE' pairs",
+        default=[],
+        nargs=argparse.REMAINDER,
+    )
+    return parser
+
+
+def load_crops(input_dir, cam_ids=None):
+    """
+    Returns:
+        paths (list[str]), and for every crop its column, pid and time in seconds (np.ndarray),
+        plus the camera ids of every column.
+    """
+    paths, cams, pids, times = [], [], [], []
+    for path in sorted(glob.glob(os.path.join(input_dir, "**", "*.jpg"), recursive=True)):
+        match = CROP_PATTERN.match(os.path.basename(path))
+        if match is None:
+            continue
+        pid, cam, seq, frame, vdate = match.groups()
+        paths.append(path)
+        cams.append(int(cam))
+        pids.append(int(pid))
+        times.append(datetime.datetime.strptime(vdate, "%Y%m%d%H%M%S").timestamp())
+    assert paths, "No crop found in {}".format(input_dir)
+
+    if cam_ids is None:
+        cam_ids = [[cam] for cam in sorted(set(cams))]
+    column_of = {cam: i for i, column in enumerate(cam_ids) for cam in column}
+    keep = [i for i, cam in enumerate(cams) if cam in column_of]
+    columns = np.asarray([column_of[cams[i]] for i in keep], dtype=np.int64)
+    return ([paths[i] for i in keep], columns, np.asarray(pids, dtype=np.int64)[keep],
+            np.asarray(times, dtype=np.float64)[keep], cam_ids)
+
+
+def extract_features(cfg, args, paths):
+    """Model features and area of every crop, only new or changed crops run through the model."""
+    store = FeatureStore(args.feature_cache, cfg, tag="image")
+    rows = store.lookup(paths)
+    missing = np.flatnonzero(rows < 0)
+    logger.info("Extracting features of {} crops ({} cached)".format(len(missing), len(paths) - len(missing)))
+
+    if len(missing):
+        demo = FeatureExtractionDemo(cfg)
+        for start in tqdm.tqdm(range(0, len(missing), args.batch_size)):
+            index = missing[start: start + args.batch_size]
+            images = [cv2.imread(paths[i]) for i in index]
+            feats = demo.run_on_images(images)
+            rows[index] = store.put([paths[i] for i in index], feats.numpy())
+        store.flush()
+
+    areas = np.empty(len(paths), dtype=np.float32)
+    if args.aggregate == "quality":
+        for i, path in enumerate(paths):
+            # PIL only reads the header for the size
+            w, h = Image.open(path).size
+            areas[i] = w * h
+    else:
+        areas[:] = 1
+    return torch.from_numpy(store.get(rows)), torch.from_numpy(areas)
+
+
+def aggregate_tracks(feats, weights, columns, pids, times):
+    """
+    Weighted mean of the normalised crop features of every (column, pid) track.
+    Returns:
+        dict of np.ndarray: "feats" (normalised), "columns", "pids", "start", "end" and "num_crops".
+    """
+    keys, track_idx = np.unique(np.stack((columns, pids), axis=1), axis=0, return_inverse=True)
+    track_idx = track_idx.reshape(-1)
+    num_tracks = len(keys)
+    index = torch.from_numpy(track_idx)
+
+    feats = F.normalize(feats.float(), dim=1) * weights[:, None]
+    track_feats = torch.zeros((num_tracks, feats.shape[1])).index_add_(0, index, feats)
+
+    start = np.full(num_tracks, np.inf)
+    end = np.full(num_tracks, -np.inf)
+    np.minimum.at(start, track_idx, times)
+    np.maximum.at(end, track_idx, times)
+    return {
+        "feats": F.normalize(track_feats, dim=1).numpy(),
+        "columns": keys[:, 0],
+        "pids": keys[:, 1],
+        "start": start,
+        "end": end,
+        "num_crops": np.bincount(track_idx, minlength=num_tracks),
+    }
+
+
+def suggest_merges(tracks, threshold=0.5, topk=5, max_gap=600, no_overlap=False):
+    """
+    Rank track pairs of different columns by cosine similarity. Every track keeps its `topk`
+    most similar tracks of each other column that satisfy the time constraints, then pairs are
+    accepted greedily from the most similar, at most one per track and column.
+    Returns:
+        list[tuple]: (score, track_a, track_b) sorted by decreasing score.
+    """
+    candidates = []
+    num_columns = tracks["columns"].max() + 1
+    for col_a in range(num_columns):
+        for col_b in range(col_a + 1, num_columns):
+            idx_a = np.flatnonzero(tracks["columns"] == col_a)
+            idx_b = np.flatnonzero(tracks["columns"] == col_b)
+            if len(idx_a) == 0 or len(idx_b) == 0:
+                continue
+            sim = tracks["feats"][idx_a] @ tracks["feats"][idx_b].T
+
+            # time constraints between the [start, end] intervals of the tracks
+            start_a, end_a = tracks["start"][idx_a, None], tracks["end"][idx_a, None]
+            start_b, end_b = tracks["start"][None, idx_b], tracks["end"][None, idx_b]
+            gap = np.maximum(start_b - end_a, start_a - end_b)
+            valid = sim >= threshold
+            if max_gap >= 0:
+                valid &= gap <= max_gap
+            if no_overlap:
+                valid &= gap > 0
+            sim = np.where(valid, sim, -np.inf)
+
+            # top-k in both directions
+            keep = np.zeros_like(valid)
+            k_b = min(topk, len(idx_b))
+            rows = np.argpartition(-sim, k_b - 1, axis=1)[:, :k_b]
+            keep[np.arange(len(idx_a))[:, None], rows] = True
+            k_a = min(topk, len(idx_a))
+            cols = np.argpartition(-sim, k_a - 1, axis=0)[:k_a]
+            keep[cols, np.arange(len(idx_b))[None]] = True
+            keep &= valid
+
+            a, b = np.nonzero(keep)
+            candidates.append(np.stack((sim[a, b], idx_a[a], idx_b[b]), axis=1))
+
+    if not candidates:
+        return []
+    candidates = np.concatenate(candidates, axis=0)
+    candidates = candidates[np.argsort(-candidates[:, 0], kind="stable")]
+
+    # greedy one-to-one matching per pair of columns
+    matched = set()
+    merges = []
+    for score, a, b in candidates:
+        a, b = int(a), int(b)
+        col_a, col_b = tracks["columns"][a], tracks["columns"][b]
+        if (a, col_b) in matched or (b, col_a) in matched:
+            continue
+        matched.add((a, col_b))
+        matched.add((b, col_a))
+        merges.append((float(score), a, b))
+    return merges
+
+
+def save_merge_sheet(path, merges, tracks, cam_ids):
+    """
+    "Sheet1" has the layout merge.ipynb reads: one row per merge, one column per entry of
+    cam_ids holding the pid of that column, followed by the score. "candidates" repeats the
+    merges with their cameras and time windows to help reviewing them.
+    """
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Sheet1"
+    details = wb.create_sheet("candidates")
+    details.append(["score", "column_a", "pid_a", "start_a", "end_a", "crops_a",
+                    "column_b", "pid_b", "start_b", "end_b", "crops_b"])
+
+    def fmt(t):
+        return datetime.datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S")
+
+    for score, a, b in merges:
+        row = [None] * len(cam_ids)
+        row[tracks["columns"][a]] = str(tracks["pids"][a])
+        row[tracks["columns"][b]] = str(tracks["pids"][b])
+        ws.append(row + [round(score, 4)])
+        details.append([round(score, 4)] + [
+            v for t in (a, b) for v in (",".join(map(str, cam_ids[tracks["columns"][t]])), int(tracks["pids"][t]),
+                                        fmt(tracks["start"][t]), fmt(tracks["end"][t]), int(tracks["num_crops"][t]))
+        ])
+    wb.save(path)
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    cfg = setup_cfg(args)
+
+    cam_ids = [[int(cam) for cam in column.split(",")] for column in args.cam_ids] if args.cam_ids else None
+    paths, columns, pids, times, cam_ids = load_crops(args.input, cam_ids)
+    logger.info("Found {} crops in {} columns".format(len(paths), len(cam_ids)))
+
+    feats, weights = extract_features(cfg, args, paths)
+    tracks = aggregate_tracks(feats, weights, columns, pids, times)
+    merges = suggest_merges(tracks, args.threshold, args.topk, args.max_gap, args.no_overlap)
+    logger.info("{} tracks, {} merge suggestions".format(len(tracks["pids"]), len(merges)))
+
+    save_merge_sheet(args.output, merges, tracks, cam_ids)
+    logger.info("Merge suggestions saved to {}".format(args.output))
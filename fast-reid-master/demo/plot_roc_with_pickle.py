@@ -8,8 +8,17 @@ import matplotlib.pyplot as plt
 import sys
 
 sys.path.append('.')
+from fastreid.evaluation.roc import RocAccumulator
 from fastreid.utils.visualizer import Visualizer
 
+
+def plot_distribution(res, name, fig=None):
+    if "roc" in res:
+        edges, pos, neg = RocAccumulator.from_state_dict(res["roc"]).histogram()
+        return Visualizer.plot_distribution(pos, neg, name=name, fig=fig, bins=edges)
+    return Visualizer.plot_distribution(res['pos'], res['neg'], name=name, fig=fig)
+
+
 if __name__ == "__main__":
     baseline_res = Visualizer.load_roc_info("logs/duke_vis/roc_info.pickle")
     mgn_res = Visualizer.load_roc_info("logs/mgn_duke_vis/roc_info.pickle")
@@ -18,6 +27,6 @@ if __name__ == "__main__":
     Visualizer.plot_roc_curve(mgn_res['fpr'], mgn_res['tpr'], name='mgn', fig=fig)
     plt.savefig('roc.jpg')
 
-    fig = Visualizer.plot_distribution(baseline_res['pos'], baseline_res['neg'], name='baseline')
-    Visualizer.plot_distribution(mgn_res['pos'], mgn_res['neg'], name='mgn', fig=fig)
+    fig = plot_distribution(baseline_res, name='baseline')
+    plot_distribution(mgn_res, name='mgn', fig=fig)
     plt.savefig('dist.jpg')
@@ -9,6 +9,7 @@ import bisect
 from collections import deque
 
 import cv2
+import numpy as np
 import torch
 import torch.multiprocessing as mp
 
@@ -52,11 +53,26 @@ class FeatureExtractionDemo(object):
         # Apply pre-processing to image.
         image = cv2.resize(original_image, tuple(self.cfg.INPUT.SIZE_TEST[::-1]), interpolation=cv2.INTER_CUBIC)
         # Make shape with a new batch dimension which is adapted for
-        # network input
-        image = torch.as_tensor(image.astype("float32").transpose(2, 0, 1))[None]
+        # network input, uint8 images are converted by the model
+        image = image.transpose(2, 0, 1) if self.cfg.INPUT.UINT8 else image.astype("float32").transpose(2, 0, 1)
+        image = torch.as_tensor(image)[None]
         predictions = self.predictor(image)
         return predictions
 
+    def run_on_images(self, original_images):
+        """
+        Same as :meth:`run_on_image` on a batch of images of any size.
+
+        Returns:
+            predictions (np.ndarray): features of the model, one row per image.
+        """
+        images = [cv2.resize(img[:, :, ::-1], tuple(self.cfg.INPUT.SIZE_TEST[::-1]), interpolation=cv2.INTER_CUBIC)
+                  for img in original_images]
+        images = np.stack(images).transpose(0, 3, 1, 2)
+        images = torch.as_tensor(images if self.cfg.INPUT.UINT8 else images.astype("float32"))
+        predictions = self.predictor(images)
+        return predictions
+
     def run_on_loader(self, data_loader):
         if self.parallel:
             buffer_size = self.predictor.default_buffer_size
@@ -6,10 +6,12 @@
 
 import argparse
 import logging
+import os
 import sys
 
 import numpy as np
 import torch
+import torch.nn.functional as F
 import tqdm
 from torch.backends import cudnn
 
@@ -17,8 +19,12 @@ sys.path.append('.')
 
 from fastreid.evaluation import evaluate_rank
 from fastreid.config import get_cfg
+from fastreid.utils.faiss_utils import GalleryIndex, evaluate_recall
+from fastreid.utils.file_io import PathManager
 from fastreid.utils.logger import setup_logger
 from fastreid.data import build_reid_test_loader
+from fastreid.data.common import CommDataset
+from feature_store import FeatureStore
 from predictor import FeatureExtractionDemo
 from fastreid.utils.visualizer import Visualizer
 
@@ -90,6 +96,28 @@ def get_parser():
         default=10,
         help="maximum number of rank list to be visualized",
     )
+    parser.add_argument(
+        "--feature-cache",
+        default="",
+        help="directory to cache extracted features, defaults to <output>/feature_cache",
+    )
+    parser.add_argument(
+        "--ann-index",
+        default="",
+        help="file of a gallery index (type set by TEST.ANN) to search instead of the full distance matrix, "
+             "created if missing and extended with new gallery images",
+    )
+    parser.add_argument(
+        "--ann-topk",
+        default=100,
+        type=int,
+        help="number of gallery images retrieved per query from the gallery index",
+    )
+    parser.add_argument(
+        "--ann-recall",
+        action='store_true',
+        help="report recall of the gallery index against exact search",
+    )
     parser.add_argument(
         "--opts",
         help="Modify config options using the command-line 'KEY VALUE' pairs",
@@ -98,6 +126,59 @@ def get_parser():
     )
     return parser
 
+
+def search_gallery_index(cfg, args, q_feat, g_feat, g_pids, g_camids, g_paths):
+    """Top-k search of the queries in a persisted gallery index, returns an (indices, distances)
+    pair over the current gallery that evaluate_rank and Visualizer accept in place of distmat.
+    Queries the index returns fewer than top-k items for are searched exactly instead."""
+    # features of other model weights must not be served from the index
+    model_key = FeatureStore.namespace(cfg, tag="loader")
+    index = None
+    if PathManager.exists(args.ann_index):
+        index = GalleryIndex.load(args.ann_index)
+        if index.model_key != model_key:
+            logger.info("Gallery index {} was built with other model weights, building it again".format(
+                args.ann_index))
+            index = None
+    if index is None:
+        index = GalleryIndex.from_config(cfg, g_feat.shape[1], model_key=model_key)
+
+    known = set(index.paths)
+    new = [i for i, path in enumerate(g_paths) if path not in known]
+    if new:
+        logger.info("Adding {} new gallery images to the index ({} already in it)".format(len(new), len(index)))
+        index.add(g_feat[new], g_pids[new], g_camids[new], [g_paths[i] for i in new])
+        index.save(args.ann_index)
+
+    # the index may also hold images of other runs, only search the current gallery
+    row_of = {path: row for row, path in enumerate(index.paths)}
+    rows = np.asarray([row_of[path] for path in g_paths])
+    mask = np.zeros(len(index), dtype=bool)
+    mask[rows] = True
+    to_gallery = np.full(len(index), -1, dtype=np.int64)
+    to_gallery[rows] = np.arange(len(rows))
+
+    topk = min(args.ann_topk, len(rows))
+    if args.ann_recall:
+        res = evaluate_recall(index, g_feat, q_feat, k=topk, rows=rows)
+        logger.info("{} index recall@{}: {:.4f}, search {:.3f}s vs exact {:.3f}s".format(
+            index.index_type, topk, res["recall"], res["ann_time"], res["exact_time"]))
+
+    indices, dists = index.search(q_feat, topk, mask=mask)
+    indices = np.where(indices >= 0, to_gallery[indices], -1)
+
+    # missing results (row -1, distance inf) would be read as the last gallery image downstream
+    short = np.flatnonzero((indices < 0).any(axis=1))
+    if len(short):
+        logger.warning("{} queries got fewer than {} results from the index and are searched exactly, "
+                       "consider raising TEST.ANN.NPROBE or TEST.ANN.EF_SEARCH".format(len(short), topk))
+        sims = torch.mm(F.normalize(q_feat[short].float()), F.normalize(g_feat.float()).t())
+        sims, exact = sims.topk(topk, dim=1)
+        indices[short] = exact.numpy()
+        dists[short] = 1 - sims.numpy()
+    return indices, dists
+
+
 # 运行示例
 # python ./demo/visualize_result.py --num-vis query图像数量 --config-file ./configs/DukeMTMC/AGW_R101-ibn.yml --vis-label --dataset-name DukeMTMC --output logs/duke/agw_R101-ibn/agw_DukeMTMC_vis --opts MODEL.WEIGHTS "./logs/
 # DukeMTMC/agw_R101-ibn/duke_bot_R101-ibn.pth"
@@ -107,18 +188,33 @@ if __name__ == '__main__':
     args = get_parser().parse_args()
     cfg = setup_cfg(args)
     test_loader, num_query = build_reid_test_loader(cfg, dataset_name=args.dataset_name)
-    demo = FeatureExtractionDemo(cfg, parallel=args.parallel)
-
-    logger.info("Start extracting image features")
-    feats = []
-    pids = []
-    camids = []
-    for (feat, pid, camid) in tqdm.tqdm(demo.run_on_loader(test_loader), total=len(test_loader)):
-        feats.append(feat)
-        pids.extend(pid)
-        camids.extend(camid)
-
-    feats = torch.cat(feats, dim=0)
+    img_items = test_loader.dataset.img_items
+    img_paths = [item[0] for item in img_items]
+
+    store = FeatureStore(args.feature_cache or os.path.join(args.output, "feature_cache"), cfg, tag="loader")
+    rows = store.lookup(img_paths)
+    missing = np.flatnonzero(rows < 0)
+
+    if len(missing):
+        logger.info("Start extracting features of {} new images ({} cached)".format(
+            len(missing), len(img_paths) - len(missing)))
+        demo = FeatureExtractionDemo(cfg, parallel=args.parallel)
+        missing_set = CommDataset([img_items[i] for i in missing], test_loader.dataset.transform, relabel=False)
+        missing_loader, _ = build_reid_test_loader(cfg, test_set=missing_set)
+
+        start = 0
+        for (feat, _, _) in tqdm.tqdm(demo.run_on_loader(missing_loader), total=len(missing_loader)):
+            index = missing[start: start + len(feat)]
+            rows[index] = store.put([img_paths[i] for i in index], feat.numpy())
+            start += len(feat)
+        store.flush()
+    else:
+        logger.info("All {} image features found in the cache".format(len(img_paths)))
+
+    feats = torch.from_numpy(store.get(rows))
+    pids = [item[1] for item in img_items]
+    camids = [item[2] for item in img_items]
+
     q_feat = feats[:num_query]
     g_feat = feats[num_query:]
     q_pids = np.asarray(pids[:num_query])
@@ -126,10 +222,13 @@ if __name__ == '__main__':
     q_camids = np.asarray(camids[:num_query])
     g_camids = np.asarray(camids[num_query:])
 
-    # compute cosine distance
-    distmat = 1 - torch.mm(q_feat, g_feat.t())
-    # print(distmat)
-    distmat = distmat.numpy()
+    if args.ann_index:
+        distmat = search_gallery_index(cfg, args, q_feat, g_feat, g_pids, g_camids, img_paths[num_query:])
+    else:
+        # compute cosine distance
+        distmat = 1 - torch.mm(q_feat, g_feat.t())
+        # print(distmat)
+        distmat = distmat.numpy()
 
     logger.info("Computing APs for all query images ...")
     cmc, all_ap, all_inp = evaluate_rank(distmat, q_pids, g_pids, q_camids, g_camids)
@@ -139,8 +238,8 @@ if __name__ == '__main__':
     visualizer.get_model_output(all_ap, distmat, q_pids, g_pids, q_camids, g_camids)
 
     logger.info("Start saving ROC curve ...")
-    fpr, tpr, pos, neg = visualizer.vis_roc_curve(args.output)
-    visualizer.save_roc_info(args.output, fpr, tpr, pos, neg)
+    fpr, tpr, roc = visualizer.vis_roc_curve(args.output)
+    visualizer.save_roc_info(args.output, fpr, tpr, roc=roc)
     logger.info("Finish saving ROC curve!")
 
     logger.info("Saving rank list result ...")
@@ -148,6 +148,10 @@ _C.INPUT.SIZE_TRAIN = [256, 128]
 # Size of the image during test
 _C.INPUT.SIZE_TEST = [256, 128]
 
+# Keep the images uint8 from the data loader to the model,
+# which converts and normalizes them in preprocess_image
+_C.INPUT.UINT8 = False
+
 # `True` if cropping is used for data augmentation during training
 _C.INPUT.CROP = CN({"ENABLED": False})
 # Size of the image cropped
@@ -193,6 +197,11 @@ _C.INPUT.REA.VALUE = [0.485*255, 0.456*255, 0.406*255]
 _C.INPUT.RPT = CN({"ENABLED": False})
 _C.INPUT.RPT.PROB = 0.5
 
+# Apply the augmentations at the end of the train pipeline to whole collated batches in the
+# data loader workers instead of one image at a time: REA and RPT, and padding and flip
+# when no color jitter, affine or augmix comes after them
+_C.INPUT.BATCH_AUG = CN({"ENABLED": False})
+
 # -----------------------------------------------------------------------------
 # Dataset
 # -----------------------------------------------------------------------------
@@ -213,6 +222,8 @@ _C.DATALOADER.SAMPLER_TRAIN = "TrainingSampler"
 # Number of instance for each person
 _C.DATALOADER.NUM_INSTANCE = 4
 _C.DATALOADER.NUM_WORKERS = 8
+# Number of batches loaded ahead of the model by a background thread, on GPU and CPU
+_C.DATALOADER.PREFETCH_DEPTH = 10
 
 # For set re-weight
 _C.DATALOADER.SET_WEIGHT = []
@@ -297,9 +308,28 @@ _C.TEST.EVAL_PERIOD = 20
 # Number of images per batch across all machines.
 _C.TEST.IMS_PER_BATCH = 64
 _C.TEST.METRIC = "cosine"
+# Blocked top-k distance, keeps only the TOPK nearest gallery items of each query
+# instead of the full query x gallery distance matrix
+_C.TEST.TOPK = CN({"ENABLED": False})
+_C.TEST.TOPK.K = 100
+_C.TEST.TOPK.BLOCK_SIZE = 8192
+# ROC curve from histograms of NUM_BINS bins over the range of the distances
 _C.TEST.ROC = CN({"ENABLED": False})
+_C.TEST.ROC.NUM_BINS = 20000
 _C.TEST.FLIP = CN({"ENABLED": False})
 
+# Keep the transformed test images in a memory-mapped uint8 array under DIR
+# (OUTPUT_DIR/test_cache if empty, /dev/shm for shared memory), so later
+# evaluations do not decode and resize them again
+_C.TEST.CACHE = CN({"ENABLED": False})
+_C.TEST.CACHE.DIR = ""
+
+# Buffer the evaluator writes test features into, FP16 halves its size and
+# MMAP_DIR backs it with a temporary file in that directory instead of RAM
+_C.TEST.FEAT_BUFFER = CN()
+_C.TEST.FEAT_BUFFER.FP16 = False
+_C.TEST.FEAT_BUFFER.MMAP_DIR = ""
+
 # Average query expansion
 _C.TEST.AQE = CN({"ENABLED": False})
 _C.TEST.AQE.ALPHA = 3.0
@@ -311,6 +341,22 @@ _C.TEST.RERANK = CN({"ENABLED": False})
 _C.TEST.RERANK.K1 = 20
 _C.TEST.RERANK.K2 = 6
 _C.TEST.RERANK.LAMBDA = 0.3
+# "dense" runs the original CUDA implementation, "sparse" the CPU engine with
+# a sparse k-reciprocal encoding parallelised over NUM_WORKERS threads, "query"
+# only re-ranks the queries against gallery structures built once
+_C.TEST.RERANK.ENGINE = "dense"
+_C.TEST.RERANK.NUM_WORKERS = 4
+# File to persist the gallery structures of the "query" engine, rebuilt if the gallery changes
+_C.TEST.RERANK.GALLERY_CACHE = ""
+
+# Approximate nearest neighbour gallery index, TYPE is "flat", "ivfpq" or "hnsw"
+_C.TEST.ANN = CN()
+_C.TEST.ANN.TYPE = "flat"
+_C.TEST.ANN.NLIST = 1024
+_C.TEST.ANN.PQ_M = 16
+_C.TEST.ANN.NPROBE = 16
+_C.TEST.ANN.HNSW_M = 32
+_C.TEST.ANN.EF_SEARCH = 128
 
 # Precise batchnorm
 _C.TEST.PRECISE_BN = CN({"ENABLED": False})
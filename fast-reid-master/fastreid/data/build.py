@@ -6,6 +6,7 @@
 
 import logging
 import os
+import re
 
 import torch
 from torch._six import string_classes
@@ -13,11 +14,12 @@ from collections import Mapping
 
 from fastreid.config import configurable
 from fastreid.utils import comm
+from fastreid.utils.crop_shards import is_shard_dir
 from . import samplers
-from .common import CommDataset
+from .common import CachedCommDataset, CommDataset
 from .data_utils import DataLoaderX
 from .datasets import DATASET_REGISTRY
-from .transforms import build_transforms
+from .transforms import batch_train_ops, build_batch_transforms, build_transforms
 
 __all__ = [
     "build_reid_train_loader",
@@ -27,14 +29,29 @@ __all__ = [
 _root = os.getenv("FASTREID_DATASETS", "datasets")
 
 
+def _build_dataset(name, **kwargs):
+    # a directory of crop shards can be used as a dataset name directly
+    if any(is_shard_dir(os.path.join(name, split)) for split in ["", "train", "query", "gallery"]):
+        return DATASET_REGISTRY.get("CropShards")(root=_root, shard_dir=name, **kwargs)
+    return DATASET_REGISTRY.get(name)(root=_root, **kwargs)
+
+
 def _train_loader_from_config(cfg, *, train_set=None, transforms=None, sampler=None, **kwargs):
+    # the batch augmentations replace some of the augmentations of build_transforms,
+    # so they only go with the transforms built here
+    batch_ops = set()
+    if transforms is None and train_set is None:
+        batch_ops = batch_train_ops(cfg)
+    elif cfg.INPUT.BATCH_AUG.ENABLED:
+        logging.getLogger(__name__).warning(
+            "INPUT.BATCH_AUG is ignored, the train set or its transforms are given")
     if transforms is None:
-        transforms = build_transforms(cfg, is_train=True)
+        transforms = build_transforms(cfg, is_train=True, batch_ops=batch_ops)
 
     if train_set is None:
         train_items = list()
         for d in cfg.DATASETS.NAMES:
-            data = DATASET_REGISTRY.get(d)(root=_root, **kwargs)
+            data = _build_dataset(d, **kwargs)
             if comm.is_main_process():
                 data.show_train()
             train_items.extend(data.train)
@@ -65,19 +82,27 @@ def _train_loader_from_config(cfg, *, train_set=None, transforms=None, sampler=N
     return {
         "train_set": train_set,
         "sampler": sampler,
+        "batch_transforms": build_batch_transforms(cfg, batch_ops),
         "total_batch_size": cfg.SOLVER.IMS_PER_BATCH,
         "num_workers": cfg.DATALOADER.NUM_WORKERS,
+        "prefetch_depth": cfg.DATALOADER.PREFETCH_DEPTH,
+        "device": cfg.MODEL.DEVICE,
     }
 
 
 @configurable(from_config=_train_loader_from_config)
 def build_reid_train_loader(
-        train_set, *, sampler=None, total_batch_size, num_workers=0,
+        train_set, *, sampler=None, batch_transforms=None, total_batch_size, num_workers=0, prefetch_depth=10,
+        device="cuda",
 ):
     """
     Build a dataloader for object re-identification with some default features.
     This interface is experimental.
 
+    Args:
+        batch_transforms (callable): augmentations of the collated batch of images,
+            applied in the workers. See :func:`build_batch_transforms`.
+
     Returns:
         torch.utils.data.DataLoader: a dataloader.
     """
@@ -88,10 +113,12 @@ def build_reid_train_loader(
 
     train_loader = DataLoaderX(
         comm.get_local_rank(),
+        prefetch_depth=prefetch_depth,
+        use_cuda=_use_cuda(device),
         dataset=train_set,
         num_workers=num_workers,
         batch_sampler=batch_sampler,
-        collate_fn=fast_batch_collator,
+        collate_fn=fast_batch_collator if batch_transforms is None else BatchTransformCollator(batch_transforms),
         pin_memory=True,
     )
 
@@ -104,11 +131,17 @@ def _test_loader_from_config(cfg, *, dataset_name=None, test_set=None, num_query
 
     if test_set is None:
         assert dataset_name is not None, "dataset_name must be explicitly passed in when test_set is not provided"
-        data = DATASET_REGISTRY.get(dataset_name)(root=_root, **kwargs)
+        data = _build_dataset(dataset_name, **kwargs)
         if comm.is_main_process():
             data.show_test()
         test_items = data.query + data.gallery
-        test_set = CommDataset(test_items, transforms, relabel=False)
+        if cfg.TEST.CACHE.ENABLED:
+            cache_dir = cfg.TEST.CACHE.DIR or os.path.join(cfg.OUTPUT_DIR, "test_cache")
+            # dataset names can be shard directories
+            name = re.sub(r"[^\w.-]", "_", dataset_name.strip("/"))
+            test_set = CachedCommDataset(test_items, transforms, cache_dir, name, relabel=False)
+        else:
+            test_set = CommDataset(test_items, transforms, relabel=False)
 
         # Update query number
         num_query = len(data.query)
@@ -117,11 +150,14 @@ def _test_loader_from_config(cfg, *, dataset_name=None, test_set=None, num_query
         "test_set": test_set,
         "test_batch_size": cfg.TEST.IMS_PER_BATCH,
         "num_query": num_query,
+        "prefetch_depth": cfg.DATALOADER.PREFETCH_DEPTH,
+        "device": cfg.MODEL.DEVICE,
     }
 
 
 @configurable(from_config=_test_loader_from_config)
-def build_reid_test_loader(test_set, test_batch_size, num_query, num_workers=4):
+def build_reid_test_loader(test_set, test_batch_size, num_query, num_workers=4, prefetch_depth=10,
+                           device="cuda"):
     """
     Similar to `build_reid_train_loader`. This sampler coordinates all workers to produce
     the exact set of all samples
@@ -132,6 +168,8 @@ def build_reid_test_loader(test_set, test_batch_size, num_query, num_workers=4):
         test_batch_size:
         num_query:
         num_workers:
+        prefetch_depth: number of batches loaded ahead of the model.
+        device: batches are copied to the gpu ahead of the model if it is a cuda device.
 
     Returns:
         DataLoader: a torch DataLoader, that loads the given reid dataset, with
@@ -149,6 +187,8 @@ def build_reid_test_loader(test_set, test_batch_size, num_query, num_workers=4):
     batch_sampler = torch.utils.data.BatchSampler(data_sampler, mini_batch_size, False)
     test_loader = DataLoaderX(
         comm.get_local_rank(),
+        prefetch_depth=prefetch_depth,
+        use_cuda=_use_cuda(device),
         dataset=test_set,
         batch_sampler=batch_sampler,
         num_workers=num_workers,  # save some memory
@@ -158,6 +198,10 @@ def build_reid_test_loader(test_set, test_batch_size, num_query, num_workers=4):
     return test_loader, num_query
 
 
+def _use_cuda(device):
+    return str(device).startswith("cuda") and torch.cuda.is_available()
+
+
 def trivial_batch_collator(batch):
     """
     A batch collator that does nothing.
@@ -165,16 +209,28 @@ def trivial_batch_collator(batch):
     return batch
 
 
+class BatchTransformCollator(object):
+    """
+    fast_batch_collator followed by augmentations of the batch of images.
+    """
+
+    def __init__(self, batch_transforms):
+        self.batch_transforms = batch_transforms
+
+    def __call__(self, batched_inputs):
+        batch = fast_batch_collator(batched_inputs)
+        batch["images"] = self.batch_transforms(batch["images"])
+        return batch
+
+
 def fast_batch_collator(batched_inputs):
     """
     A simple batch collator for most common reid tasks
     """
     elem = batched_inputs[0]
     if isinstance(elem, torch.Tensor):
-        out = torch.zeros((len(batched_inputs), *elem.size()), dtype=elem.dtype)
-        for i, tensor in enumerate(batched_inputs):
-            out[i] += tensor
-        return out
+        # one copy into the batch, in the dtype of the samples (uint8 images stay uint8)
+        return torch.stack(batched_inputs, 0)
 
     elif isinstance(elem, Mapping):
         return {key: fast_batch_collator([d[key] for d in batched_inputs]) for key in elem}
@@ -4,8 +4,16 @@
 @contact: sherlockliao01@gmail.com
 """
 
+import glob
+import hashlib
+import os
+import re
+
+import numpy as np
+import torch
 from torch.utils.data import Dataset
 
+from fastreid.utils import comm
 from .data_utils import read_image
 
 
@@ -56,3 +64,81 @@ class CommDataset(Dataset):
     @property
     def num_cameras(self):
         return len(self.cams)
+
+
+class CachedCommDataset(CommDataset):
+    """
+    CommDataset for deterministic (test) transforms: every transformed image is kept in a
+    memory-mapped uint8 array in `cache_dir` the first time it is read, then served from there
+    by all the loader workers and the later evaluations. The file name hashes the transforms
+    (INPUT.SIZE_TEST, INPUT.CROP...) and the image list, so changing any of them starts a new
+    cache and the old one of the same `name` is removed. Every machine creates its own cache,
+    so `cache_dir` should be on a local disk.
+    """
+
+    def __init__(self, img_items, transform, cache_dir, name="test", relabel=False):
+        super().__init__(img_items, transform, relabel)
+        key = hashlib.sha1(repr(transform).encode())
+        for item in img_items:
+            key.update(item[0].encode() + b"\n")
+        prefix = os.path.join(cache_dir, name)
+        self.cache_file = "{}_{}.npy".format(prefix, key.hexdigest()[:16])
+        self.filled_file = self.cache_file[:-len(".npy")] + "_filled.npy"
+
+        # the output of the transforms fixes the shape of the cache
+        sample = self.transform(read_image(img_items[0][0]))
+        self.shape = tuple(sample.shape)
+        self.float_output = sample.dtype != torch.uint8
+
+        if comm.get_local_rank() == 0 and not os.path.exists(self.filled_file):
+            os.makedirs(cache_dir, exist_ok=True)
+            for path in glob.glob("{}_*.npy".format(glob.escape(prefix))):
+                if re.fullmatch(r"[0-9a-f]{16}(_filled)?\.npy(\.tmp\.npy)?", path[len(prefix) + 1:]):
+                    os.remove(path)
+            for path, shape in [(self.cache_file, (len(img_items),) + self.shape),
+                                (self.filled_file, (len(img_items),))]:
+                tmp_path = path + ".tmp.npy"
+                np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8, shape=shape).flush()
+                os.replace(tmp_path, path)
+        comm.local_synchronize()
+        self._images = None
+        self._filled = None
+
+    def __getstate__(self):
+        # every worker maps the files itself
+        state = self.__dict__.copy()
+        state["_images"] = state["_filled"] = None
+        return state
+
+    def __getitem__(self, index):
+        if self._images is None:
+            self._images = np.load(self.cache_file, mmap_mode="r")
+            self._filled = np.load(self.filled_file, mmap_mode="r+")
+        img_item = self.img_items[index]
+        img_path = img_item[0]
+        pid = img_item[1]
+        camid = img_item[2]
+        if self._filled[index]:
+            img = torch.from_numpy(np.array(self._images[index]))
+        else:
+            # float outputs of the test transforms are whole numbers in [0, 255]
+            img = self.transform(read_image(img_path)).to(torch.uint8)
+            # the row is written through its own mapping and flushed before it is marked as
+            # filled, so the flag never points to an image that is not on disk yet
+            row = np.memmap(self.cache_file, dtype=np.uint8, mode="r+", shape=self.shape,
+                            offset=self._images.offset + index * self._images[0].nbytes)
+            row[:] = img.numpy()
+            row.flush()
+            del row
+            self._filled[index] = 1
+        if self.float_output:
+            img = img.float()
+        if self.relabel:
+            pid = self.pid_dict[pid]
+            camid = self.cam_dict[camid]
+        return {
+            "images": img,
+            "targets": pid,
+            "camids": camid,
+            "img_paths": img_path,
+        }
@@ -7,10 +7,12 @@ import torch
 import numpy as np
 from PIL import Image, ImageOps
 import threading
+import time
 
 import queue
 from torch.utils.data import DataLoader
 
+from fastreid.utils.events import get_event_storage, has_event_storage
 from fastreid.utils.file_io import PathManager
 
 
@@ -88,7 +90,7 @@ class BackgroundGenerator(threading.Thread):
     >> help(BackgroundGenerator)
     """
 
-    def __init__(self, generator, local_rank, max_prefetch=10):
+    def __init__(self, generator, local_rank=None, max_prefetch=10):
         """
         This function transforms generator into a background-thead generator.
         :param generator: generator or genexp or any
@@ -103,6 +105,7 @@ class BackgroundGenerator(threading.Thread):
         There's no restriction on doing weird stuff, reading/writing files, retrieving
         URLs [or whatever] wlilst iterating.
 
+        :param local_rank: cuda device of the thread, None when the batches stay on the CPU.
         :param max_prefetch: defines, how many iterations (at most) can background generator keep
         stored at any moment of time.
         Whenever there's already max_prefetch batches stored in queue, the background process will halt until
@@ -124,17 +127,24 @@ class BackgroundGenerator(threading.Thread):
         self.start()
 
     def run(self):
-        torch.cuda.set_device(self.local_rank)
-        for item in self.generator:
-            if self.exit_event.is_set():
-                break
-            self.queue.put(item)
+        if self.local_rank is not None:
+            torch.cuda.set_device(self.local_rank)
+        try:
+            for item in self.generator:
+                if self.exit_event.is_set():
+                    break
+                self.queue.put(item)
+        except Exception as e:
+            # raised again in the consumer, which would otherwise wait forever
+            self.queue.put(e)
         self.queue.put(None)
 
     def next(self):
         next_item = self.queue.get()
         if next_item is None:
             raise StopIteration
+        if isinstance(next_item, Exception):
+            raise next_item
         return next_item
 
     # Python 3 compatibility
@@ -146,22 +156,50 @@ class BackgroundGenerator(threading.Thread):
 
 
 class DataLoaderX(DataLoader):
-    def __init__(self, local_rank, **kwargs):
+    """
+    DataLoader whose batches are prefetched by a background thread, `prefetch_depth` batches
+    ahead of the model. With cuda the next batch is also copied to the device on a side stream;
+    on CPU the batches are passed on as the workers produced them, in shared memory, so CPU-only
+    hosts get the same overlap of loading and inference.
+    The time waited for every batch is put into the current EventStorage as "data_wait_time",
+    and the number of batches ready as "prefetch_queue_size". `wait_time` and `num_batches`
+    sum them over the current iteration.
+    """
+
+    def __init__(self, local_rank, prefetch_depth=10, use_cuda=None, **kwargs):
+        if use_cuda is None:
+            use_cuda = torch.cuda.is_available()
+        if not use_cuda:
+            # pinning only speeds up copies to a cuda device
+            kwargs["pin_memory"] = False
         super().__init__(**kwargs)
-        self.stream = torch.cuda.Stream(
-            local_rank
-        )  # create a new cuda stream in each process
+        self.use_cuda = use_cuda
+        # create a new cuda stream in each process
+        self.stream = torch.cuda.Stream(local_rank) if use_cuda else None
         self.local_rank = local_rank
+        self.prefetch_depth = prefetch_depth
+        self.iter = None
+        self.batch = None
+        self.wait_time = 0.
+        self.num_batches = 0
 
     def __iter__(self):
+        if self.iter is not None:
+            # a new epoch before the last one finished
+            self._shutdown_background_thread()
+        # the totals of inference_on_dataset are per pass over the data
+        self.wait_time = 0.
+        self.num_batches = 0
         self.iter = super().__iter__()
-        self.iter = BackgroundGenerator(self.iter, self.local_rank)
+        self.iter = BackgroundGenerator(self.iter, self.local_rank if self.use_cuda else None,
+                                        self.prefetch_depth)
         self.preload()
         return self
 
     def _shutdown_background_thread(self):
-        if not self.iter.is_alive():
-            # avoid re-entrance or ill-conditioned thread state
+        if self.iter is None or not self.iter.is_alive() or self.batch is None:
+            # avoid re-entrance or ill-conditioned thread state, an exhausted
+            # generator has already stopped or is about to
             return
 
         # Set exit event to True for background threading stopping
@@ -169,15 +207,17 @@ class DataLoaderX(DataLoader):
 
         # Exhaust all remaining elements, so that the queue becomes empty,
         # and the thread should quit
-        for _ in self.iter:
+        while self.iter.queue.get() is not None:
             pass
 
         # Waiting for background thread to quit
         self.iter.join()
 
     def preload(self):
+        tic = time.perf_counter()
         self.batch = next(self.iter, None)
-        if self.batch is None:
+        self._put_wait_time(time.perf_counter() - tic)
+        if self.batch is None or not self.use_cuda:
             return None
         with torch.cuda.stream(self.stream):
             for k in self.batch:
@@ -186,10 +226,18 @@ class DataLoaderX(DataLoader):
                         device=self.local_rank, non_blocking=True
                     )
 
+    def _put_wait_time(self, seconds):
+        self.wait_time += seconds
+        self.num_batches += 1
+        if has_event_storage():
+            storage = get_event_storage()
+            storage.put_scalar("data_wait_time", seconds)
+            storage.put_scalar("prefetch_queue_size", self.iter.queue.qsize())
+
     def __next__(self):
-        torch.cuda.current_stream().wait_stream(
-            self.stream
-        )  # wait tensor to put on GPU
+        if self.use_cuda:
+            # wait tensor to put on GPU
+            torch.cuda.current_stream().wait_stream(self.stream)
         batch = self.batch
         if batch is None:
             raise StopIteration
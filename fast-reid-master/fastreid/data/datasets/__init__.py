@@ -34,6 +34,7 @@ from .lpw import LPW
 from .shinpuhkan import Shinpuhkan
 from .wildtracker import WildTrackCrop
 from .cuhk_sysu import cuhkSYSU
+from .crop_shards import CropShards
 
 # Vehicle re-id datasets
 from .veri import VeRi
@@ -0,0 +1,58 @@
+# encoding: utf-8
+
+import os.path as osp
+
+from fastreid.utils.crop_shards import ShardPathHandler, is_shard_dir, parse_crop_name, shard_path
+from .bases import ImageDataset
+from ..datasets import DATASET_REGISTRY
+
+
+@DATASET_REGISTRY.register()
+class CropShards(ImageDataset):
+    """Crops packed by :class:`fastreid.utils.crop_shards.CropShardWriter`.
+
+    `shard_dir` either holds the shards of the training set, or has "train", "query" and
+    "gallery" sub directories of shards, like the folders of Market1501. The crops are
+    named as by generate.ipynb, pid and camera are read from the names.
+    """
+    _junk_pids = [0, -1]
+    dataset_dir = 'crop_shards'
+    dataset_name = "cropshards"
+
+    def __init__(self, root='datasets', shard_dir=None, **kwargs):
+        self.root = root
+        self.shard_dir = shard_dir or osp.join(self.root, self.dataset_dir)
+
+        splits = [osp.join(self.shard_dir, split) for split in ['train', 'query', 'gallery']]
+        if any(is_shard_dir(split) for split in splits):
+            self.train_dir, self.query_dir, self.gallery_dir = splits
+        else:
+            self.train_dir, self.query_dir, self.gallery_dir = self.shard_dir, None, None
+        self.check_before_run([self.shard_dir])
+
+        train = lambda: self.process_dir(self.train_dir)
+        query = lambda: self.process_dir(self.query_dir, is_train=False)
+        gallery = lambda: self.process_dir(self.gallery_dir, is_train=False)
+
+        super(CropShards, self).__init__(train, query, gallery, **kwargs)
+
+    def process_dir(self, dir_path, is_train=True):
+        if dir_path is None or not is_shard_dir(dir_path):
+            return []
+        shards = ShardPathHandler.get_shards(osp.abspath(dir_path))
+
+        data = []
+        for name in sorted(shards.names()):
+            fields = parse_crop_name(name)
+            if fields is None:
+                continue
+            pid, camid = fields[:2]
+            if pid == -1:
+                continue  # junk images are just ignored
+            camid -= 1  # index starts from 0
+            if is_train:
+                pid = self.dataset_name + "_" + str(pid)
+                camid = self.dataset_name + "_" + str(camid)
+            data.append((shard_path(dir_path, name), pid, camid))
+
+        return data
@@ -5,7 +5,8 @@
 """
 
 from .autoaugment import AutoAugment
-from .build import build_transforms
+from .batch_transforms import *
+from .build import batch_train_ops, build_batch_transforms, build_transforms
 from .transforms import *
 
 __all__ = [k for k in globals().keys() if not k.startswith("_")]
@@ -0,0 +1,184 @@
+# encoding: utf-8
+"""
+Train augmentations on a whole collated batch of images (B x C x H x W). The random parameters
+are drawn for every image as the per-sample transform of the same name draws them, and applied
+with batched indexing and masks instead of one image at a time.
+"""
+
+__all__ = ['BatchPadCrop', 'BatchFlip', 'BatchRandomErasing', 'BatchRandomPatch', ]
+
+import math
+from collections import deque
+
+import torch
+
+
+def _first_valid(valid, *values):
+    """Values of the first valid attempt of every image (rows of `valid`)."""
+    first = valid.to(torch.uint8).argmax(dim=1, keepdim=True)
+    return [v.gather(1, first).squeeze(1) for v in values]
+
+
+def _randint(high):
+    """Uniform integers in [0, high) with a different `high` per image."""
+    return (torch.rand(high.shape) * high).long()
+
+
+def _source_index(idx, size, mode):
+    # index of the input pixel that the padding mode of T.Pad puts at `idx`
+    if mode == 'reflect':
+        idx = idx.abs()
+        return torch.where(idx >= size, 2 * (size - 1) - idx, idx)
+    if mode == 'symmetric':
+        idx = torch.where(idx < 0, -idx - 1, idx)
+        return torch.where(idx >= size, 2 * size - 1 - idx, idx)
+    # edge, and constant where the padding is filled afterwards
+    return idx.clamp(0, size - 1)
+
+
+class BatchPadCrop(object):
+    """T.Pad(padding, padding_mode=padding_mode) followed by T.RandomCrop(size) on every image.
+
+    Args:
+        size (sequence): (height, width) of the crops.
+        padding (int): number of pixels added on every border.
+        padding_mode (str): constant, edge, reflect or symmetric.
+        fill (number): value of the constant padding.
+    """
+
+    def __init__(self, size, padding=10, padding_mode='constant', fill=0):
+        assert padding_mode in ['constant', 'edge', 'reflect', 'symmetric'], \
+            "Unknown padding mode {}".format(padding_mode)
+        self.size = tuple(size)
+        self.padding = padding
+        self.padding_mode = padding_mode
+        self.fill = fill
+
+    def __call__(self, images):
+        B, C, H, W = images.shape
+        th, tw = self.size
+        p = self.padding
+        # top left corner of every crop in the padded image
+        top = torch.randint(0, H + 2 * p - th + 1, (B,))
+        left = torch.randint(0, W + 2 * p - tw + 1, (B,))
+        rows = top[:, None] - p + torch.arange(th)
+        cols = left[:, None] - p + torch.arange(tw)
+
+        src_rows = _source_index(rows, H, self.padding_mode).to(images.device)
+        src_cols = _source_index(cols, W, self.padding_mode).to(images.device)
+        out = images.gather(2, src_rows[:, None, :, None].expand(B, C, th, W))
+        out = out.gather(3, src_cols[:, None, None, :].expand(B, C, th, tw))
+        if self.padding_mode == 'constant':
+            inside = ((rows >= 0) & (rows < H))[:, :, None] & ((cols >= 0) & (cols < W))[:, None, :]
+            out.masked_fill_(~inside[:, None].to(images.device), self.fill)
+        return out
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(size={}, padding={}, padding_mode={})'.format(
+            self.size, self.padding, self.padding_mode)
+
+
+class BatchFlip(object):
+    """T.RandomHorizontalFlip(p) on every image."""
+
+    def __init__(self, p=0.5):
+        self.p = p
+
+    def __call__(self, images):
+        flip = (torch.rand(len(images)) < self.p).to(images.device)
+        return torch.where(flip[:, None, None, None], images.flip(-1), images)
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(p={})'.format(self.p)
+
+
+class BatchRandomErasing(object):
+    """T.RandomErasing(p, scale, ratio, value) on every image, with a constant erasing value
+    per channel. As in torchvision, an image is left unchanged when none of the 10 attempts
+    fits in it."""
+
+    def __init__(self, p=0.5, scale=(0.02, 0.33), ratio=(0.3, 3.3), value=0):
+        self.p = p
+        self.scale = scale
+        self.ratio = ratio
+        self.value = value if isinstance(value, (list, tuple)) else [value]
+
+    def __call__(self, images):
+        B, C, H, W = images.shape
+        erase_area = H * W * torch.empty(B, 10).uniform_(self.scale[0], self.scale[1])
+        log_ratio = torch.log(torch.tensor(self.ratio))
+        aspect_ratio = torch.exp(torch.empty(B, 10).uniform_(log_ratio[0], log_ratio[1]))
+        h = torch.sqrt(erase_area * aspect_ratio).round().long()
+        w = torch.sqrt(erase_area / aspect_ratio).round().long()
+        valid = (h < H) & (w < W)
+        h, w = _first_valid(valid, h, w)
+        erase = (torch.rand(B) < self.p) & valid.any(dim=1)
+        i = _randint(H - h + 1)
+        j = _randint(W - w + 1)
+
+        ys = torch.arange(H)
+        xs = torch.arange(W)
+        rows = (ys >= i[:, None]) & (ys < (i + h)[:, None])
+        cols = (xs >= j[:, None]) & (xs < (j + w)[:, None])
+        mask = (rows[:, :, None] & cols[:, None, :] & erase[:, None, None]).to(images.device)
+        # the value is cast to the type of the images, as torchvision does
+        value = torch.tensor(self.value, dtype=images.dtype, device=images.device).view(1, -1, 1, 1)
+        return torch.where(mask[:, None], value, images)
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(p={}, scale={}, ratio={})'.format(self.p, self.scale, self.ratio)
+
+
+class BatchRandomPatch(object):
+    """RandomPatch on every image: a patch of every image of the batch is added to the pool,
+    then patches of the pool are pasted on the images, with the parameters of RandomPatch.
+    The patches have different sizes, so they are pasted one by one.
+    """
+
+    def __init__(self, prob_happen=0.5, pool_capacity=50000, min_sample_size=100,
+                 patch_min_area=0.01, patch_max_area=0.5, patch_min_ratio=0.1, prob_flip_leftright=0.5,
+                 ):
+        self.prob_happen = prob_happen
+
+        self.patch_min_area = patch_min_area
+        self.patch_max_area = patch_max_area
+        self.patch_min_ratio = patch_min_ratio
+
+        self.prob_flip_leftright = prob_flip_leftright
+
+        self.patchpool = deque(maxlen=pool_capacity)
+        self.min_sample_size = min_sample_size
+
+    def __call__(self, images):
+        B, C, H, W = images.shape
+
+        # collect new patches
+        target_area = H * W * torch.empty(B, 100).uniform_(self.patch_min_area, self.patch_max_area)
+        aspect_ratio = torch.empty(B, 100).uniform_(self.patch_min_ratio, 1. / self.patch_min_ratio)
+        h = torch.sqrt(target_area * aspect_ratio).round().long()
+        w = torch.sqrt(target_area / aspect_ratio).round().long()
+        valid = (w < W) & (h < H)
+        h, w = _first_valid(valid, h, w)
+        y1 = _randint(H - h + 1)
+        x1 = _randint(W - w + 1)
+        for b in valid.any(dim=1).nonzero().flatten().tolist():
+            self.patchpool.append(images[b, :, y1[b]:y1[b] + h[b], x1[b]:x1[b] + w[b]].clone())
+
+        if len(self.patchpool) < self.min_sample_size:
+            return images
+
+        # paste randomly selected patches on random positions
+        paste = (torch.rand(B) <= self.prob_happen).nonzero().flatten().tolist()
+        picks = torch.randint(0, len(self.patchpool), (len(paste),)).tolist()
+        flips = (torch.rand(len(paste)) > self.prob_flip_leftright).tolist()
+        for b, k, flip in zip(paste, picks, flips):
+            patch = self.patchpool[k]
+            _, patchH, patchW = patch.size()
+            y = math.floor(torch.rand(1).item() * (H - patchH + 1))
+            x = math.floor(torch.rand(1).item() * (W - patchW + 1))
+            images[b, :, y:y + patchH, x:x + patchW] = patch.flip(-1) if flip else patch
+        return images
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(prob_happen={}, pool_capacity={}, min_sample_size={})'.format(
+            self.prob_happen, self.patchpool.maxlen, self.min_sample_size)
@@ -8,10 +8,33 @@ import torchvision.transforms as T
 
 from .transforms import *
 from .autoaugment import AutoAugment
-
-
-def build_transforms(cfg, is_train=True):
+from .batch_transforms import *
+
+
+def batch_train_ops(cfg):
+    """
+    Train augmentations moved to whole batches by INPUT.BATCH_AUG: only the end of the
+    per-sample pipeline, so the order of the augmentations stays the same.
+    Returns:
+        set[str]: names of the moved augmentations, for `batch_ops` of :func:`build_transforms`
+            and :func:`build_batch_transforms`.
+    """
+    if not cfg.INPUT.BATCH_AUG.ENABLED:
+        return set()
+    ops = {"rea", "rpt"}
+    if not (cfg.INPUT.CJ.ENABLED or cfg.INPUT.AFFINE.ENABLED or cfg.INPUT.AUGMIX.ENABLED):
+        ops |= {"pad", "flip"}
+    return ops
+
+
+def build_transforms(cfg, is_train=True, batch_ops=()):
+    """
+    Args:
+        batch_ops (set[str]): train augmentations left out because build_batch_transforms
+            applies them to whole batches, see :func:`batch_train_ops`.
+    """
     res = []
+    uint8 = cfg.INPUT.UINT8
 
     if is_train:
         size_train = cfg.INPUT.SIZE_TRAIN
@@ -69,10 +92,10 @@ def build_transforms(cfg, is_train=True):
             res.append(T.RandomResizedCrop(size=crop_size[0] if len(crop_size) == 1 else crop_size,
                                            interpolation=3,
                                            scale=crop_scale, ratio=crop_ratio))
-        if do_pad:
+        if do_pad and "pad" not in batch_ops:
             res.extend([T.Pad(padding_size, padding_mode=padding_mode),
                         T.RandomCrop(size_train[0] if len(size_train) == 1 else size_train)])
-        if do_flip:
+        if do_flip and "flip" not in batch_ops:
             res.append(T.RandomHorizontalFlip(p=flip_prob))
 
         if do_cj:
@@ -82,10 +105,10 @@ def build_transforms(cfg, is_train=True):
                                       fillcolor=0))
         if do_augmix:
             res.append(AugMix(prob=augmix_prob))
-        res.append(ToTensor())
-        if do_rea:
+        res.append(ToTensor(uint8))
+        if do_rea and "rea" not in batch_ops:
             res.append(T.RandomErasing(p=rea_prob, value=rea_value))
-        if do_rpt:
+        if do_rpt and "rpt" not in batch_ops:
             res.append(RandomPatch(prob_happen=rpt_prob))
     else:
         size_test = cfg.INPUT.SIZE_TEST
@@ -96,5 +119,24 @@ def build_transforms(cfg, is_train=True):
             res.append(T.Resize(size_test[0] if len(size_test) == 1 else size_test, interpolation=3))
         if do_crop:
             res.append(T.CenterCrop(size=crop_size[0] if len(crop_size) == 1 else crop_size))
-        res.append(ToTensor())
+        res.append(ToTensor(uint8))
     return T.Compose(res)
+
+
+def build_batch_transforms(cfg, batch_ops):
+    """
+    Train augmentations of whole batches of images, which replace the same augmentations
+    left out by build_transforms(cfg, is_train=True, batch_ops=batch_ops), or None.
+    """
+    size_train = cfg.INPUT.SIZE_TRAIN
+    res = []
+    if cfg.INPUT.PADDING.ENABLED and "pad" in batch_ops:
+        res.append(BatchPadCrop(size_train * 2 if len(size_train) == 1 else size_train,
+                                padding=cfg.INPUT.PADDING.SIZE, padding_mode=cfg.INPUT.PADDING.MODE))
+    if cfg.INPUT.FLIP.ENABLED and "flip" in batch_ops:
+        res.append(BatchFlip(p=cfg.INPUT.FLIP.PROB))
+    if cfg.INPUT.REA.ENABLED and "rea" in batch_ops:
+        res.append(BatchRandomErasing(p=cfg.INPUT.REA.PROB, value=cfg.INPUT.REA.VALUE))
+    if cfg.INPUT.RPT.ENABLED and "rpt" in batch_ops:
+        res.append(BatchRandomPatch(prob_happen=cfg.INPUT.RPT.PROB))
+    return T.Compose(res) if res else None
@@ -9,13 +9,14 @@ import torch
 from PIL import Image, ImageOps, ImageEnhance
 
 
-def to_tensor(pic):
+def to_tensor(pic, uint8=False):
     """Convert a ``PIL Image`` or ``numpy.ndarray`` to tensor.
 
     See ``ToTensor`` for more details.
 
     Args:
         pic (PIL Image or numpy.ndarray): Image to be converted to tensor.
+        uint8 (bool): keep uint8 images as a torch.ByteTensor instead of converting them to float.
 
     Returns:
         Tensor: Converted image.
@@ -28,7 +29,7 @@ def to_tensor(pic):
 
         img = torch.from_numpy(pic.transpose((2, 0, 1)))
         # backward compatibility
-        if isinstance(img, torch.ByteTensor):
+        if isinstance(img, torch.ByteTensor) and not uint8:
             return img.float()
         else:
             return img
@@ -55,7 +56,7 @@ def to_tensor(pic):
     # put it from HWC to CHW format
     # yikes, this transpose takes 80% of the loading time/CPU
     img = img.transpose(0, 1).transpose(0, 2).contiguous()
-    if isinstance(img, torch.ByteTensor):
+    if isinstance(img, torch.ByteTensor) and not uint8:
         return img.float()
     else:
         return img
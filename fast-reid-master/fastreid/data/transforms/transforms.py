@@ -25,8 +25,14 @@ class ToTensor(object):
     or if the numpy.ndarray has dtype = np.uint8
 
     In the other cases, tensors are returned without scaling.
+
+    With ``uint8=True`` those images stay a torch.ByteTensor, a quarter of the bytes through the
+    data loader, and the model converts and normalizes them in ``preprocess_image``.
     """
 
+    def __init__(self, uint8=False):
+        self.uint8 = uint8
+
     def __call__(self, pic):
         """
         Args:
@@ -35,10 +41,10 @@ class ToTensor(object):
         Returns:
             Tensor: Converted image.
         """
-        return to_tensor(pic)
+        return to_tensor(pic, self.uint8)
 
     def __repr__(self):
-        return self.__class__.__name__ + '()'
+        return self.__class__.__name__ + '(uint8={})'.format(self.uint8)
 
 
 class RandomPatch(object):
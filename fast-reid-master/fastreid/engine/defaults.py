@@ -144,7 +144,8 @@ class DefaultPredictor:
     def __call__(self, image):
         """
         Args:
-            image (torch.tensor): an image tensor of shape (B, C, H, W).
+            image (torch.tensor): an image tensor of shape (B, C, H, W), float or uint8
+                (INPUT.UINT8), uint8 images are only converted on the device of the model.
         Returns:
             predictions (torch.tensor): the output features of the model
         """
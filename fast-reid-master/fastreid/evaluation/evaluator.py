@@ -26,6 +26,15 @@ class DatasetEvaluator:
         """
         pass
 
+    def reserve(self, num_samples):
+        """
+        Hint the number of samples this worker is about to process, so that
+        an evaluator can preallocate its buffers. Called after :meth:`reset`.
+        Args:
+            num_samples (int): an upper bound on the number of samples
+        """
+        pass
+
     def preprocess_inputs(self, inputs):
         pass
 
@@ -103,6 +112,9 @@ def inference_on_dataset(model, data_loader, evaluator, flip_test=False):
 
     total = len(data_loader)  # inference data loader must have a fixed length
     evaluator.reset()
+    batch_size = getattr(getattr(data_loader, "batch_sampler", None), "batch_size", None)
+    if batch_size is not None:
+        evaluator.reserve(total * batch_size)
 
     num_warmup = min(5, total - 1)
     start_time = time.perf_counter()
@@ -153,6 +165,14 @@ def inference_on_dataset(model, data_loader, evaluator, flip_test=False):
             total_compute_time_str, total_compute_time / (total - num_warmup), num_devices
         )
     )
+    if getattr(data_loader, "num_batches", 0) > 0:
+        # time the model waited for the prefetching loader, see DataLoaderX
+        logger.info(
+            "Total data loading wait time: {} ({:.6f} s / batch per device)".format(
+                str(datetime.timedelta(seconds=int(data_loader.wait_time))),
+                data_loader.wait_time / data_loader.num_batches,
+            )
+        )
     results = evaluator.evaluate()
 
     # An evaluator may return None when not in main process.
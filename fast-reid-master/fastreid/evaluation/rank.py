@@ -13,7 +13,7 @@ except ImportError:
     IS_CYTHON_AVAI = False
     warnings.warn(
         'Cython rank evaluation (very fast so highly recommended) is '
-        'unavailable, now use python evaluation.'
+        'unavailable, now use vectorized numpy evaluation.'
     )
 
 
@@ -163,11 +163,127 @@ def eval_market1501(distmat, q_pids, g_pids, q_camids, g_camids, max_rank):
     return all_cmc, all_AP, all_INP
 
 
+def eval_market1501_vectorized(distmat, q_pids, g_pids, q_camids, g_camids, max_rank, block_size=256):
+    """Evaluation with market1501 metric, vectorized over blocks of queries.
+    Key: for each query identity, its gallery images from the same camera view are discarded.
+    Produces the same result as the cython implementation. Each block of `block_size` queries
+    is sorted once; precision at every kept position is the ratio of the cumulative sums of the
+    masked match and keep matrices, from which CMC, AP and INP are read without per-query loops.
+    """
+    num_q, num_g = distmat.shape
+
+    if num_g < max_rank:
+        max_rank = num_g
+        print('Note: number of gallery samples is quite small, got {}'.format(num_g))
+
+    all_cmc = []
+    all_AP = []
+    all_INP = []
+    for start in range(0, num_q, block_size):
+        q_pid = q_pids[start: start + block_size, np.newaxis]
+        q_camid = q_camids[start: start + block_size, np.newaxis]
+        indices = np.argsort(distmat[start: start + block_size], axis=1)
+
+        matches = g_pids[indices] == q_pid
+        # remove gallery samples that have the same pid and camid with query
+        keep = ~(matches & (g_camids[indices] == q_camid))
+        raw_cmc = matches & keep
+
+        # this condition is false when query identity does not appear in gallery
+        valid = raw_cmc.any(axis=1)
+        if not np.any(valid):
+            continue
+        raw_cmc, keep = raw_cmc[valid], keep[valid]
+        rows = np.arange(len(raw_cmc))
+
+        # 1-based rank of every position after removing discarded samples
+        kept_rank = np.cumsum(keep, axis=1, dtype=np.int64)
+        cmc = np.cumsum(raw_cmc, axis=1, dtype=np.int64)
+        num_rel = cmc[:, -1].astype(np.float64)
+
+        # compute average precision
+        # reference: https://en.wikipedia.org/wiki/Evaluation_measures_(information_retrieval)#Average_precision
+        # precision only at the positives, kept_rank is 0 before the first kept sample
+        precision = np.divide(cmc, kept_rank, out=np.zeros(cmc.shape), where=raw_cmc)
+        all_AP.append(precision.sum(axis=1) / num_rel)
+
+        # compute mean inverse negative penalty
+        # reference : https://github.com/mangye16/ReID-Survey/blob/master/utils/reid_metric.py
+        max_pos_idx = num_g - 1 - np.argmax(raw_cmc[:, ::-1], axis=1)
+        all_INP.append(num_rel / kept_rank[rows, max_pos_idx])
+
+        first_rank = kept_rank[rows, np.argmax(raw_cmc, axis=1)]
+        all_cmc.append(first_rank[:, np.newaxis] <= np.arange(1, max_rank + 1))
+
+    assert len(all_cmc) > 0, 'Error: all query identities do not appear in gallery'
+
+    all_cmc = np.concatenate(all_cmc)
+    all_cmc = (all_cmc.sum(0) / len(all_cmc)).astype(np.float32)
+
+    return all_cmc, np.concatenate(all_AP).astype(np.float32), np.concatenate(all_INP).astype(np.float32)
+
+
+def eval_market1501_topk(indices, q_pids, g_pids, q_camids, g_camids, max_rank):
+    """Evaluation with market1501 metric on a truncated ranking list.
+    Key: only the top-k gallery indices of each query are known, as produced by
+    :func:`fastreid.utils.compute_dist.compute_topk_distance`. CMC is exact up to the number of
+    valid entries kept per query. Positives that fall outside the top-k contribute zero precision,
+    so AP and INP are lower bounds of the values computed on the full distance matrix.
+    """
+    num_q, k = indices.shape
+    num_g = len(g_pids)
+
+    if k < max_rank:
+        max_rank = k
+        print('Note: number of kept neighbours is smaller than max_rank, got {}'.format(k))
+
+    # number of valid positives and valid gallery samples of each query in the full gallery
+    pid_count = dict(zip(*np.unique(g_pids, return_counts=True)))
+    pid_cam_count = defaultdict(int)
+    for pid, camid in zip(g_pids.tolist(), g_camids.tolist()):
+        pid_cam_count[(pid, camid)] += 1
+    same = np.asarray([pid_cam_count[(p, c)] for p, c in zip(q_pids.tolist(), q_camids.tolist())], dtype=np.float64)
+    num_rel = np.asarray([pid_count.get(p, 0) for p in q_pids], dtype=np.float64) - same
+    num_valid_g = num_g - same
+
+    # remove gallery samples that have the same pid and camid with query
+    matches = g_pids[indices] == q_pids[:, np.newaxis]
+    keep = ~(matches & (g_camids[indices] == q_camids[:, np.newaxis]))
+
+    # shift kept entries to the front of each row, preserving their order
+    order = np.argsort(~keep, axis=1, kind='stable')
+    raw_cmc = np.take_along_axis(matches & keep, order, axis=1).astype(np.int32)
+
+    valid = num_rel > 0
+    assert np.any(valid), 'Error: all query identities do not appear in gallery'
+    raw_cmc, num_rel, num_valid_g = raw_cmc[valid], num_rel[valid], num_valid_g[valid]
+
+    cmc = raw_cmc.cumsum(1)
+    ranks = np.arange(1, k + 1, dtype=np.float64)
+
+    # average precision over the retrieved positives
+    all_AP = ((cmc / ranks) * raw_cmc).sum(1) / num_rel
+
+    # inverse negative penalty, the last positive is assumed at the end of the gallery
+    # when it is not retrieved within the top-k
+    num_found = cmc[:, -1]
+    last_pos = k - 1 - np.argmax(raw_cmc[:, ::-1], axis=1)
+    all_INP = np.where(num_found == num_rel, num_rel / (last_pos + 1.0), num_rel / num_valid_g)
+
+    # removed entries are at the end of the rows with raw_cmc 0, so the cumulative sum
+    # already carries the hit state over them
+    cmc = np.minimum(cmc[:, :max_rank], 1).astype(np.float32)
+
+    all_cmc = cmc.sum(0) / len(cmc)
+
+    return all_cmc, all_AP, all_INP
+
+
 def evaluate_py(distmat, q_pids, g_pids, q_camids, g_camids, max_rank, use_metric_cuhk03):
     if use_metric_cuhk03:
         return eval_cuhk03(distmat, q_pids, g_pids, q_camids, g_camids, max_rank)
     else:
-        return eval_market1501(distmat, q_pids, g_pids, q_camids, g_camids, max_rank)
+        return eval_market1501_vectorized(distmat, q_pids, g_pids, q_camids, g_camids, max_rank)
 
 
 def evaluate_rank(
@@ -182,7 +298,9 @@ def evaluate_rank(
 ):
     """Evaluates CMC rank.
     Args:
-        distmat (numpy.ndarray): distance matrix of shape (num_query, num_gallery).
+        distmat (numpy.ndarray or tuple): distance matrix of shape (num_query, num_gallery),
+            or an (indices, distances) pair of shape (num_query, topk) from blocked top-k
+            distance computation.
         q_pids (numpy.ndarray): 1-D array containing person identities
             of each query instance.
         g_pids (numpy.ndarray): 1-D array containing person identities
@@ -196,8 +314,13 @@ def evaluate_rank(
             Default is False. This should be enabled when using cuhk03 classic split.
         use_cython (bool, optional): use cython code for evaluation. Default is True.
             This is highly recommended as the cython code can speed up the cmc computation
-            by more than 10x. This requires Cython to be installed.
+            by more than 10x. This requires Cython to be installed. When it is unavailable,
+            a vectorized numpy implementation with the same results is used.
     """
+    if isinstance(distmat, tuple):
+        assert not use_metric_cuhk03, "cuhk03 metric is not supported with top-k distances"
+        return eval_market1501_topk(distmat[0], q_pids, g_pids, q_camids, g_camids, max_rank)
+
     if use_cython and IS_CYTHON_AVAI:
         return evaluate_cy(distmat, q_pids, g_pids, q_camids, g_camids, max_rank, use_metric_cuhk03)
     else:
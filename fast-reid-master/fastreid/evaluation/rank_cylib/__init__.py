@@ -7,14 +7,20 @@
 
 def compile_helper():
     """Compile helper function at runtime. Make sure this
-    is invoked on a single process."""
+    is invoked on a single process.
+    Returns:
+        bool: whether the cython module was built. Evaluation falls back
+            to the vectorized numpy implementation otherwise.
+    """
     import os
     import subprocess
 
     path = os.path.abspath(os.path.dirname(__file__))
-    ret = subprocess.run(["make", "-C", path])
-    if ret.returncode != 0:
-        print("Making cython reid evaluation module failed, exiting.")
-        import sys
-
-        sys.exit(1)
+    try:
+        ret = subprocess.run(["make", "-C", path])
+    except OSError:
+        ret = None
+    if ret is None or ret.returncode != 0:
+        print("Making cython reid evaluation module failed, using numpy evaluation instead.")
+        return False
+    return True
@@ -5,7 +5,7 @@ import os.path as osp
 
 sys.path.insert(0, osp.dirname(osp.abspath(__file__)) + '/../../..')
 
-from fastreid.evaluation.rank import evaluate_rank
+from fastreid.evaluation.rank import evaluate_rank, eval_market1501_vectorized
 from fastreid.evaluation.roc import evaluate_roc
 
 """
@@ -24,7 +24,7 @@ import sys
 import os.path as osp
 import numpy as np
 sys.path.insert(0, osp.dirname(osp.abspath(__file__)) + '/../../..')
-from fastreid.evaluation.rank import evaluate_rank
+from fastreid.evaluation.rank import evaluate_rank, eval_market1501, eval_market1501_vectorized
 from fastreid.evaluation.roc import evaluate_roc
 num_q = 30
 num_g = 300
@@ -52,9 +52,22 @@ cytime = timeit.timeit(
     setup=setup,
     number=20
 )
+looptime = timeit.timeit(
+    'eval_market1501(distmat, q_pids, g_pids, q_camids, g_camids, max_rank)',
+    setup=setup,
+    number=20
+)
+vectime = timeit.timeit(
+    'eval_market1501_vectorized(distmat, q_pids, g_pids, q_camids, g_camids, max_rank)',
+    setup=setup,
+    number=20
+)
 print('Python time: {} s'.format(pytime))
 print('Cython time: {} s'.format(cytime))
+print('Python loop time: {} s'.format(looptime))
+print('Python vectorized time: {} s'.format(vectime))
 print('CMC Cython is {} times faster than python\n'.format(pytime / cytime))
+print('CMC vectorized is {} times faster than python loop\n'.format(looptime / vectime))
 
 print('=> Using ROC metric')
 pytime = timeit.timeit(
@@ -95,6 +108,13 @@ np.testing.assert_allclose(mAP_py, mAP_cy, rtol=1e-3, atol=1e-6)
 np.testing.assert_allclose(mINP_py, mINP_cy, rtol=1e-3, atol=1e-6)
 print('Rank results between python and cython are the same!')
 
+cmc_vec, mAP_vec, mINP_vec = eval_market1501_vectorized(distmat, q_pids, g_pids, q_camids, g_camids, max_rank)
+
+np.testing.assert_allclose(cmc_vec, cmc_cy, rtol=1e-3, atol=1e-6)
+np.testing.assert_allclose(mAP_vec, mAP_cy, rtol=1e-3, atol=1e-6)
+np.testing.assert_allclose(mINP_vec, mINP_cy, rtol=1e-3, atol=1e-6)
+print('Rank results between vectorized python and cython are the same!')
+
 scores_cy, labels_cy = evaluate_roc(distmat, q_pids, g_pids, q_camids, g_camids, use_cython=True)
 scores_py, labels_py = evaluate_roc(distmat, q_pids, g_pids, q_camids, g_camids, use_cython=False)
 
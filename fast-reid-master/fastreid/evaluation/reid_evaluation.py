@@ -5,17 +5,17 @@
 """
 import copy
 import logging
+import tempfile
 import time
-import itertools
 from collections import OrderedDict
 
 import numpy as np
 import torch
 import torch.nn.functional as F
-from sklearn import metrics
 
 from fastreid.utils import comm
 from fastreid.utils.compute_dist import build_dist
+from fastreid.utils.file_io import PathManager
 from .evaluator import DatasetEvaluator
 from .query_expansion import aqe
 from .rank_cylib import compile_helper
@@ -30,45 +30,87 @@ class ReidEvaluator(DatasetEvaluator):
         self._output_dir = output_dir
 
         self._cpu_device = torch.device('cpu')
+        self._feat_dtype = torch.float16 if cfg.TEST.FEAT_BUFFER.FP16 else torch.float32
+        self._mmap_dir = cfg.TEST.FEAT_BUFFER.MMAP_DIR
 
-        self._predictions = []
+        self._mmap_file = None
+        self.reset()
         self._compile_dependencies()
 
     def reset(self):
-        self._predictions = []
+        if self._mmap_file is not None:
+            self._mmap_file.close()
+        self._capacity = 0
+        self._num_samples = 0
+        self._feats = None
+        self._pids = None
+        self._camids = None
+        self._mmap_file = None
+
+    def reserve(self, num_samples):
+        self._capacity = max(self._capacity, num_samples)
+
+    def _allocate(self, capacity, feat_dim):
+        """
+        (Re)allocate the feature, pid and camid buffers with room for `capacity` samples,
+        keeping the samples written so far.
+        """
+        n = self._num_samples
+        if self._mmap_dir:
+            PathManager.mkdirs(self._mmap_dir)
+            # an anonymous temporary file is unlinked on close, the mapping keeps it alive
+            mmap_file = tempfile.TemporaryFile(dir=self._mmap_dir)
+            np_dtype = np.float16 if self._feat_dtype == torch.float16 else np.float32
+            feats = torch.from_numpy(np.memmap(mmap_file, mode='w+', shape=(capacity, feat_dim), dtype=np_dtype))
+        else:
+            mmap_file = None
+            feats = torch.empty((capacity, feat_dim), dtype=self._feat_dtype)
+        pids = torch.empty((capacity,), dtype=torch.int64)
+        camids = torch.empty((capacity,), dtype=torch.int64)
+
+        if self._feats is not None:
+            feats[:n] = self._feats[:n]
+            pids[:n] = self._pids[:n]
+            camids[:n] = self._camids[:n]
+        if self._mmap_file is not None:
+            self._mmap_file.close()
+
+        self._feats, self._pids, self._camids = feats, pids, camids
+        self._mmap_file = mmap_file
+        self._capacity = capacity
 
     def process(self, inputs, outputs):
-        prediction = {
-            'feats': outputs.to(self._cpu_device, torch.float32),
-            'pids': inputs['targets'].to(self._cpu_device),
-            'camids': inputs['camids'].to(self._cpu_device)
-
-        }
-        self._predictions.append(prediction)
+        batch_size = outputs.shape[0]
+        end = self._num_samples + batch_size
+        if self._feats is None or end > self._feats.shape[0]:
+            # grow geometrically when no (or a too small) size hint was given
+            capacity = max(end, self._capacity if self._feats is None else 2 * self._capacity)
+            self._allocate(capacity, outputs.shape[1])
+
+        self._feats[self._num_samples:end] = outputs.to(self._cpu_device, self._feat_dtype)
+        self._pids[self._num_samples:end] = inputs['targets'].to(self._cpu_device)
+        self._camids[self._num_samples:end] = inputs['camids'].to(self._cpu_device)
+        self._num_samples = end
 
     def evaluate(self):
+        n = self._num_samples
+        assert self._feats is not None, "ReidEvaluator.process() was never called"
+        features = self._feats[:n]
+        pids = self._pids[:n]
+        camids = self._camids[:n]
+
         if comm.get_world_size() > 1:
             comm.synchronize()
-            predictions = comm.gather(self._predictions, dst=0)
-            predictions = list(itertools.chain(*predictions))
+            features = comm.gather_tensor(features, dst=0)
+            pids = comm.gather_tensor(pids, dst=0)
+            camids = comm.gather_tensor(camids, dst=0)
 
             if not comm.is_main_process():
                 return {}
 
-        else:
-            predictions = self._predictions
-
-        features = []
-        pids = []
-        camids = []
-        for prediction in predictions:
-            features.append(prediction['feats'])
-            pids.append(prediction['pids'])
-            camids.append(prediction['camids'])
-
-        features = torch.cat(features, dim=0)
-        pids = torch.cat(pids, dim=0).numpy()
-        camids = torch.cat(camids, dim=0).numpy()
+        features = features.float()
+        pids = pids.numpy()
+        camids = camids.numpy()
         # query feature, person ids and camera ids
         query_features = features[:self._num_query]
         query_pids = pids[:self._num_query]
@@ -88,7 +130,14 @@ class ReidEvaluator(DatasetEvaluator):
             alpha = self.cfg.TEST.AQE.ALPHA
             query_features, gallery_features = aqe(query_features, gallery_features, qe_time, qe_k, alpha)
 
-        dist = build_dist(query_features, gallery_features, self.cfg.TEST.METRIC)
+        if self.cfg.TEST.TOPK.ENABLED:
+            assert not self.cfg.TEST.RERANK.ENABLED, "Rerank needs the full distance matrix, " \
+                                                     "disable TEST.TOPK to use it"
+            logger.info("Test with blocked top-k distance")
+            dist = build_dist(query_features, gallery_features, self.cfg.TEST.METRIC,
+                              topk=self.cfg.TEST.TOPK.K, block_size=self.cfg.TEST.TOPK.BLOCK_SIZE)
+        else:
+            dist = build_dist(query_features, gallery_features, self.cfg.TEST.METRIC)
 
         if self.cfg.TEST.RERANK.ENABLED:
             logger.info("Test with rerank setting")
@@ -100,7 +149,10 @@ class ReidEvaluator(DatasetEvaluator):
                 query_features = F.normalize(query_features, dim=1)
                 gallery_features = F.normalize(gallery_features, dim=1)
 
-            rerank_dist = build_dist(query_features, gallery_features, metric="jaccard", k1=k1, k2=k2)
+            rerank_dist = build_dist(query_features, gallery_features, metric="jaccard", k1=k1, k2=k2,
+                                     engine=self.cfg.TEST.RERANK.ENGINE,
+                                     num_workers=self.cfg.TEST.RERANK.NUM_WORKERS,
+                                     cache=self.cfg.TEST.RERANK.GALLERY_CACHE)
             dist = rerank_dist * (1 - lambda_value) + dist * lambda_value
 
         from .rank import evaluate_rank
@@ -115,13 +167,14 @@ class ReidEvaluator(DatasetEvaluator):
         self._results["metric"] = (mAP + cmc[0]) / 2 * 100
 
         if self.cfg.TEST.ROC.ENABLED:
-            from .roc import evaluate_roc
-            scores, labels = evaluate_roc(dist, query_pids, gallery_pids, query_camids, gallery_camids)
-            fprs, tprs, thres = metrics.roc_curve(labels, scores)
+            from .roc import RocAccumulator, finite_range
+            distances = dist[1] if isinstance(dist, tuple) else dist
+            roc = RocAccumulator(self.cfg.TEST.ROC.NUM_BINS, finite_range(distances))
+            roc.update(dist, query_pids, gallery_pids, query_camids, gallery_camids)
 
-            for fpr in [1e-4, 1e-3, 1e-2]:
-                ind = np.argmin(np.abs(fprs - fpr))
-                self._results["TPR@FPR={:.0e}".format(fpr)] = tprs[ind]
+            fprs = [1e-4, 1e-3, 1e-2]
+            for fpr, tpr in zip(fprs, roc.tpr_at_fpr(fprs)):
+                self._results["TPR@FPR={:.0e}".format(fpr)] = tpr
 
         return copy.deepcopy(self._results)
 
@@ -135,9 +188,12 @@ class ReidEvaluator(DatasetEvaluator):
                 start_time = time.time()
                 logger.info("> compiling reid evaluation cython tool")
 
-                compile_helper()
-
-                logger.info(
-                    ">>> done with reid evaluation cython tool. Compilation time: {:.3f} "
-                    "seconds".format(time.time() - start_time))
+                if compile_helper():
+                    logger.info(
+                        ">>> done with reid evaluation cython tool. Compilation time: {:.3f} "
+                        "seconds".format(time.time() - start_time))
+                else:
+                    logger.warning(
+                        ">>> failed to compile reid evaluation cython tool, "
+                        "falling back to vectorized numpy evaluation")
         comm.synchronize()
@@ -9,6 +9,8 @@ import warnings
 import faiss
 import numpy as np
 
+from fastreid.utils import comm
+
 try:
     from .rank_cylib.roc_cy import evaluate_roc_cy
 
@@ -61,6 +63,150 @@ def evaluate_roc_py(distmat, q_pids, g_pids, q_camids, g_camids):
     return scores, labels
 
 
+def evaluate_roc_topk(indices, distances, q_pids, g_pids, q_camids, g_camids):
+    r"""Evaluation with ROC curve on the top-k pairs of each query.
+    Key: for each query identity, its gallery images from the same camera view are discarded.
+    Only pairs kept by the blocked top-k distance computation contribute to the curve.
+
+    Args:
+        indices (np.ndarray): gallery indices of shape (num_query, topk)
+        distances (np.ndarray): cosine distances of shape (num_query, topk)
+    """
+    matches = g_pids[indices] == q_pids[:, np.newaxis]
+    keep = ~(matches & (g_camids[indices] == q_camids[:, np.newaxis]))
+
+    pos = distances[matches & keep]
+    neg = distances[~matches & keep]
+
+    scores = np.hstack((pos, neg))
+
+    labels = np.hstack((np.zeros(len(pos)), np.ones(len(neg))))
+    return scores, labels
+
+
+def finite_range(distances):
+    """(min, max) of the finite distances, the `score_range` of a :class:`RocAccumulator`."""
+    finite = distances[np.isfinite(distances)]
+    if finite.size == 0:
+        return 0., 1.
+    return finite.min(), finite.max()
+
+
+class RocAccumulator:
+    """
+    Streaming ROC curve built from fixed-resolution histograms of the distances of
+    positive (same identity) and negative pairs, instead of keeping every pair.
+    Gallery samples with the same pid and camid as the query are discarded, as in
+    :func:`evaluate_roc`. Distances outside `score_range` fall in the first or last bin, and
+    non-finite distances (the padding of top-k results, or NaN) are ignored.
+    The curve follows ``sklearn.metrics.roc_curve(labels, scores)`` on the output of
+    :func:`evaluate_roc`, i.e. negatives are the positive class of the curve, up to the bin width.
+    Accumulators of different query blocks are combined with :meth:`merge`, and those of
+    different ranks with :meth:`all_reduce`, which all ranks must call.
+
+    Args:
+        num_bins (int): number of histogram bins.
+        score_range (tuple): (min, max) of the distances, default covers cosine distances.
+        block_size (int): number of queries binned at once by :meth:`update`.
+    """
+
+    def __init__(self, num_bins=20000, score_range=(0., 2.), block_size=256):
+        self.num_bins = num_bins
+        self.score_range = (float(score_range[0]), float(score_range[1]))
+        self.block_size = block_size
+        self.pos_hist = np.zeros(num_bins, dtype=np.int64)
+        self.neg_hist = np.zeros(num_bins, dtype=np.int64)
+
+    @property
+    def bin_edges(self):
+        return np.linspace(self.score_range[0], self.score_range[1], self.num_bins + 1)
+
+    def _accumulate(self, dist, matches, keep):
+        keep = keep & np.isfinite(dist)
+        low, high = self.score_range
+        scale = self.num_bins / max(high - low, np.finfo(np.float32).eps)
+        bins = np.clip(((dist[keep].astype(np.float64) - low) * scale).astype(np.int64), 0, self.num_bins - 1)
+        # one bincount for both classes, negatives are shifted by num_bins
+        hist = np.bincount(bins + self.num_bins * ~matches[keep], minlength=2 * self.num_bins)
+        self.pos_hist += hist[:self.num_bins]
+        self.neg_hist += hist[self.num_bins:]
+
+    def update(self, distmat, q_pids, g_pids, q_camids, g_camids):
+        """
+        Args:
+            distmat (numpy.ndarray or tuple): distance matrix of shape (num_query, num_gallery),
+                or an (indices, distances) pair of shape (num_query, topk).
+        """
+        if isinstance(distmat, tuple):
+            indices, distances = distmat
+        else:
+            indices, distances = None, distmat
+
+        for start in range(0, len(q_pids), self.block_size):
+            end = start + self.block_size
+            if indices is None:
+                block_pids, block_camids = g_pids[np.newaxis], g_camids[np.newaxis]
+            else:
+                block_pids, block_camids = g_pids[indices[start:end]], g_camids[indices[start:end]]
+            matches = block_pids == q_pids[start:end, np.newaxis]
+            keep = ~(matches & (block_camids == q_camids[start:end, np.newaxis]))
+            self._accumulate(distances[start:end], matches, keep)
+        return self
+
+    def merge(self, other):
+        assert self.num_bins == other.num_bins and self.score_range == other.score_range, \
+            "Can only merge ROC accumulators with the same bins"
+        self.pos_hist += other.pos_hist
+        self.neg_hist += other.neg_hist
+        return self
+
+    def all_reduce(self):
+        """Sum the histograms of all ranks, only the two histograms are communicated."""
+        hists = comm.all_gather((self.pos_hist, self.neg_hist))
+        self.pos_hist = sum(pos for pos, _ in hists)
+        self.neg_hist = sum(neg for _, neg in hists)
+        return self
+
+    def roc_curve(self):
+        """
+        Returns:
+            tuple(numpy.ndarray): fpr, tpr and the decreasing thresholds (lower bin edges),
+                starting from the (0, 0) point.
+        """
+        # walk the bins from the largest distance down, dropping empty ones
+        nonzero = np.flatnonzero((self.pos_hist + self.neg_hist)[::-1])
+        fps = np.cumsum(self.pos_hist[::-1])[nonzero]
+        tps = np.cumsum(self.neg_hist[::-1])[nonzero]
+        thresholds = self.bin_edges[:-1][::-1][nonzero]
+
+        fpr = np.r_[0, fps / max(fps[-1], 1)] if len(fps) else np.zeros(1)
+        tpr = np.r_[0, tps / max(tps[-1], 1)] if len(tps) else np.zeros(1)
+        thresholds = np.r_[np.inf, thresholds]
+        return fpr, tpr, thresholds
+
+    def tpr_at_fpr(self, fprs=(1e-4, 1e-3, 1e-2)):
+        fpr, tpr, _ = self.roc_curve()
+        return [tpr[np.argmin(np.abs(fpr - x))] for x in fprs]
+
+    def histogram(self, num_bins=80):
+        """Positive and negative histograms merged down to `num_bins` bins, with their edges."""
+        assert self.num_bins % num_bins == 0, "num_bins must divide {}".format(self.num_bins)
+        edges = self.bin_edges[::self.num_bins // num_bins]
+        pos = self.pos_hist.reshape(num_bins, -1).sum(axis=1)
+        neg = self.neg_hist.reshape(num_bins, -1).sum(axis=1)
+        return edges, pos, neg
+
+    def state_dict(self):
+        return {"pos_hist": self.pos_hist, "neg_hist": self.neg_hist, "score_range": self.score_range}
+
+    @classmethod
+    def from_state_dict(cls, state):
+        roc = cls(len(state["pos_hist"]), state["score_range"])
+        roc.pos_hist += state["pos_hist"]
+        roc.neg_hist += state["neg_hist"]
+        return roc
+
+
 def evaluate_roc(
         distmat,
         q_pids,
@@ -71,7 +217,8 @@ def evaluate_roc(
 ):
     """Evaluates CMC rank.
     Args:
-        distmat (numpy.ndarray): distance matrix of shape (num_query, num_gallery).
+        distmat (numpy.ndarray or tuple): distance matrix of shape (num_query, num_gallery),
+            or an (indices, distances) pair of shape (num_query, topk).
         q_pids (numpy.ndarray): 1-D array containing person identities
             of each query instance.
         g_pids (numpy.ndarray): 1-D array containing person identities
@@ -84,6 +231,9 @@ def evaluate_roc(
             This is highly recommended as the cython code can speed up the cmc computation
             by more than 10x. This requires Cython to be installed.
     """
+    if isinstance(distmat, tuple):
+        return evaluate_roc_topk(*distmat, q_pids, g_pids, q_camids, g_camids)
+
     if use_cython and IS_CYTHON_AVAI:
         return evaluate_roc_cy(distmat, q_pids, g_pids, q_camids, g_camids)
     else:
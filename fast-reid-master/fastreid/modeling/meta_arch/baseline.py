@@ -127,6 +127,9 @@ class Baseline(nn.Module):
         else:
             raise TypeError("batched_inputs must be dict or torch.Tensor, but get {}".format(type(batched_inputs)))
 
+        if images.dtype == torch.uint8:
+            # uint8 inputs (INPUT.UINT8) are converted on the device of the model
+            images = images.to(self.pixel_mean.dtype)
         images.sub_(self.pixel_mean).div_(self.pixel_std)
         return images
 
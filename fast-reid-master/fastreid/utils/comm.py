@@ -78,6 +78,15 @@ def synchronize():
     dist.barrier()
 
 
+def local_synchronize():
+    """
+    Helper function to synchronize (barrier) among the processes of this machine
+    """
+    if get_local_size() == 1:
+        return
+    dist.barrier(group=_LOCAL_PROCESS_GROUP)
+
+
 @functools.lru_cache()
 def _get_global_gloo_group():
     """
@@ -212,6 +221,59 @@ def gather(data, dst=0, group=None):
         return []
 
 
+def gather_tensor(tensor, dst=0, group=None):
+    """
+    Run gather on CPU tensors without pickling them. The tensors may have a
+    different length along dim 0 on each rank, the other dims must match.
+    Args:
+        tensor (Tensor): a CPU tensor
+        dst (int): destination rank
+        group: a torch process group. By default, will use a group which
+            contains all ranks on gloo backend.
+    Returns:
+        Tensor: on dst, the tensors of all ranks concatenated along dim 0 in rank order.
+            Otherwise, None.
+    """
+    if get_world_size() == 1:
+        return tensor
+    if group is None:
+        group = _get_global_gloo_group()
+    world_size = dist.get_world_size(group=group)
+    if world_size == 1:
+        return tensor
+    rank = dist.get_rank(group=group)
+
+    local_size = torch.tensor([tensor.shape[0]], dtype=torch.int64)
+    size_list = [torch.zeros([1], dtype=torch.int64) for _ in range(world_size)]
+    dist.all_gather(size_list, local_size, group=group)
+    size_list = [int(size.item()) for size in size_list]
+    max_size = max(size_list)
+
+    # pad along dim 0 because torch gather does not support tensors of different shapes
+    tensor = tensor.contiguous()
+    if tensor.shape[0] != max_size:
+        padding = tensor.new_zeros((max_size - tensor.shape[0],) + tuple(tensor.shape[1:]))
+        tensor = torch.cat((tensor, padding), dim=0)
+
+    if rank == dst:
+        # receive straight into one buffer, so the result is not copied again
+        output = tensor.new_empty((world_size * max_size,) + tuple(tensor.shape[1:]))
+        tensor_list = list(output.split(max_size, dim=0))
+        dist.gather(tensor, tensor_list, dst=dst, group=group)
+
+        # InferenceSampler gives full shards to the leading ranks, then at most one short
+        # rank and empty ones: the valid rows are a prefix of the buffer and no copy is
+        # needed. Any other split (e.g. the extra samples on the leading ranks) is copied
+        is_prefix = all(size == max_size or not any(size_list[i + 1:])
+                        for i, size in enumerate(size_list))
+        if is_prefix:
+            return output[:sum(size_list)]
+        return torch.cat([t[:size] for size, t in zip(size_list, tensor_list)], dim=0)
+    else:
+        dist.gather(tensor, [], dst=dst, group=group)
+        return None
+
+
 def shared_random_seed():
     """
     Returns:
@@ -7,10 +7,15 @@
 # Modified from: https://github.com/open-mmlab/OpenUnReID/blob/66bb2ae0b00575b80fbe8915f4d4f4739cc21206/openunreid/core/utils/compute_dist.py
 
 
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
 import faiss
 import numpy as np
 import torch
 import torch.nn.functional as F
+from scipy import sparse
 
 from .faiss_utils import (
     index_init_cpu,
@@ -18,30 +23,45 @@ from .faiss_utils import (
     search_index_pytorch,
     search_raw_array_pytorch,
 )
+from .file_io import PathManager
+
+logger = logging.getLogger(__name__)
 
 __all__ = [
     "build_dist",
+    "compute_topk_distance",
     "compute_jaccard_distance",
+    "compute_jaccard_distance_sparse",
+    "GalleryReranker",
     "compute_euclidean_distance",
     "compute_cosine_distance",
 ]
 
 
 @torch.no_grad()
-def build_dist(feat_1: torch.Tensor, feat_2: torch.Tensor, metric: str = "euclidean", **kwargs) -> np.ndarray:
+def build_dist(feat_1: torch.Tensor, feat_2: torch.Tensor, metric: str = "euclidean", topk: int = None,
+               block_size: int = 8192, **kwargs):
     r"""Compute distance between two feature embeddings.
 
     Args:
         feat_1 (torch.Tensor): 2-D feature with batch dimension.
         feat_2 (torch.Tensor): 2-D feature with batch dimension.
         metric:
+        topk (int, optional): if given, the gallery is processed in tiles of `block_size` and only
+            the `topk` nearest neighbours of each query are kept, see :func:`compute_topk_distance`.
+        block_size (int): number of gallery features per tile in blocked mode.
 
     Returns:
-        numpy.ndarray: distance matrix.
+        numpy.ndarray: distance matrix, or a tuple of (indices, distances) arrays of
+            shape (num_query, topk) in blocked mode.
     """
     assert metric in ["cosine", "euclidean", "jaccard"], "Expected metrics are cosine, euclidean and jaccard, " \
                                                          "but got {}".format(metric)
 
+    if topk is not None:
+        assert metric != "jaccard", "Blocked top-k mode does not support jaccard distance"
+        return compute_topk_distance(feat_1, feat_2, topk, metric=metric, block_size=block_size)
+
     if metric == "euclidean":
         return compute_euclidean_distance(feat_1, feat_2)
 
@@ -49,11 +69,97 @@ def build_dist(feat_1: torch.Tensor, feat_2: torch.Tensor, metric: str = "euclid
         return compute_cosine_distance(feat_1, feat_2)
 
     elif metric == "jaccard":
+        engine = kwargs.get("engine", "dense")
+        if engine not in ["dense", "sparse", "query"]:
+            raise ValueError("Expected re-ranking engines are dense, sparse and query, but got {}".format(engine))
+        if engine == "query":
+            reranker = GalleryReranker.from_cache(kwargs.get("cache", ""), feat_2, k1=kwargs["k1"], k2=kwargs["k2"],
+                                                  num_workers=kwargs.get("num_workers", 4))
+            return reranker.query_jaccard(feat_1)
         feat = torch.cat((feat_1, feat_2), dim=0)
+        if engine == "sparse":
+            return compute_jaccard_distance_sparse(feat, k1=kwargs["k1"], k2=kwargs["k2"],
+                                                   num_query=feat_1.size(0),
+                                                   num_workers=kwargs.get("num_workers", 4))
         dist = compute_jaccard_distance(feat, k1=kwargs["k1"], k2=kwargs["k2"], search_option=0)
         return dist[: feat_1.size(0), feat_1.size(0):]
 
 
+def _pairwise_distance(features, others, metric):
+    if metric == "cosine":
+        return 1 - torch.mm(features, others.t())
+    dist_m = (
+            torch.pow(features, 2).sum(dim=1, keepdim=True)
+            + torch.pow(others, 2).sum(dim=1, keepdim=True).t()
+    )
+    dist_m.addmm_(features, others.t(), beta=1, alpha=-2)
+    return dist_m
+
+
+@torch.no_grad()
+def compute_topk_distance(features, others, topk, metric="euclidean", block_size=8192):
+    """Computes the `topk` nearest gallery entries of every query without building the
+    full distance matrix.
+    Queries and gallery are both processed in tiles of `block_size`; for each query tile a running
+    top-k is merged with every gallery tile, so peak memory is bounded by
+    ``block_size * (block_size + topk)`` instead of ``num_query * num_gallery``.
+    Euclidean distances of the selected pairs are recomputed exactly from the features at the end,
+    cosine distances of the tiles are already exact.
+    Args:
+        features (torch.Tensor): 2-D query feature matrix.
+        others (torch.Tensor): 2-D gallery feature matrix.
+        topk (int): number of nearest neighbours to keep for each query.
+        metric (str): "euclidean" or "cosine".
+        block_size (int): number of features per tile.
+    Returns:
+        tuple(numpy.ndarray, numpy.ndarray): gallery indices (int64) and distances (float32),
+            both of shape (num_query, topk) and sorted by ascending distance.
+    """
+    assert metric in ["cosine", "euclidean"], "Expected metrics are cosine and euclidean, " \
+                                              "but got {}".format(metric)
+    features = features.float()
+    others = others.to(features.device, torch.float32)
+    if metric == "cosine":
+        features = F.normalize(features, p=2, dim=1)
+        others = F.normalize(others, p=2, dim=1)
+
+    m, n = features.size(0), others.size(0)
+    topk = min(topk, n)
+    all_indices = np.empty((m, topk), dtype=np.int64)
+    all_dists = np.empty((m, topk), dtype=np.float32)
+
+    for q_start in range(0, m, block_size):
+        q_feat = features[q_start: q_start + block_size]
+        best_dist = q_feat.new_empty((q_feat.size(0), 0))
+        best_idx = torch.empty((q_feat.size(0), 0), dtype=torch.int64, device=q_feat.device)
+        for g_start in range(0, n, block_size):
+            tile = _pairwise_distance(q_feat, others[g_start: g_start + block_size], metric)
+            tile_idx = torch.arange(g_start, g_start + tile.size(1), device=tile.device).expand_as(tile)
+            cand_dist = torch.cat((best_dist, tile), dim=1)
+            cand_idx = torch.cat((best_idx, tile_idx), dim=1)
+            k = min(topk, cand_dist.size(1))
+            best_dist, pos = torch.topk(cand_dist, k, dim=1, largest=False, sorted=False)
+            best_idx = torch.gather(cand_idx, 1, pos)
+            del tile, tile_idx, cand_dist, cand_idx
+
+        if metric == "euclidean":
+            # exact distances for the kept pairs only, instead of the expanded form of the tiles;
+            # a few queries at a time, so the gathered gallery features stay within the bound
+            chunk = max(1, block_size * (block_size + topk) // (topk * others.size(1)))
+            for start in range(0, q_feat.size(0), chunk):
+                g_feat = others[best_idx[start: start + chunk]]
+                best_dist[start: start + chunk] = \
+                    (q_feat[start: start + chunk].unsqueeze(1) - g_feat).pow(2).sum(dim=2)
+                del g_feat
+        best_dist, order = torch.sort(best_dist, dim=1)
+        best_idx = torch.gather(best_idx, 1, order)
+
+        all_indices[q_start: q_start + q_feat.size(0)] = best_idx.cpu().numpy()
+        all_dists[q_start: q_start + q_feat.size(0)] = best_dist.cpu().numpy()
+
+    return all_indices, all_dists
+
+
 def k_reciprocal_neigh(initial_rank, i, k1):
     forward_k_neigh_index = initial_rank[i, : k1 + 1]
     backward_k_neigh_index = initial_rank[forward_k_neigh_index, : k1 + 1]
@@ -173,6 +279,356 @@ def compute_jaccard_distance(features, k1=20, k2=6, search_option=0, fp16=False)
     return jaccard_dist
 
 
+def _k_reciprocal_index(initial_rank, k, rows):
+    """Padded k-reciprocal neighbour sets of `rows`, in the order of
+    :func:`k_reciprocal_neigh`. Missing entries are set to -1."""
+    forward_k_neigh_index = initial_rank[rows, : k + 1]
+    backward_k_neigh_index = initial_rank[forward_k_neigh_index, : k + 1]
+    reciprocal = (backward_k_neigh_index == rows[:, None, None]).any(axis=2)
+    # move reciprocal neighbours to the front of each row, keeping their rank order
+    order = np.argsort(~reciprocal, axis=1, kind="stable")
+    index = np.take_along_axis(forward_k_neigh_index, order, axis=1)
+    index[~np.take_along_axis(reciprocal, order, axis=1)] = -1
+    return index
+
+
+def _sparse_v_rows(features, sq_norm, nn_k1, nn_k1_half, rows):
+    """Rows of the k-reciprocal encoding `V`, as (indptr counts, indices, data)."""
+    k_reciprocal_index = nn_k1[rows]
+    valid = k_reciprocal_index >= 0
+
+    # candidate expansion: half-size reciprocal sets of every k-reciprocal neighbour
+    candidate = nn_k1_half[np.where(valid, k_reciprocal_index, 0)]
+    candidate_valid = (candidate >= 0) & valid[:, :, None]
+    inter = (candidate[:, :, :, None] == k_reciprocal_index[:, None, None, :]).any(axis=3) & candidate_valid
+    accept = inter.sum(axis=2) > 2 / 3 * candidate_valid.sum(axis=2)
+
+    expansion = np.concatenate(
+        (k_reciprocal_index,
+         np.where(accept[:, :, None] & candidate_valid, candidate, -1).reshape(len(rows), -1)),
+        axis=1,
+    )
+    # element-wise unique
+    expansion.sort(axis=1)
+    expansion[:, 1:][expansion[:, 1:] == expansion[:, :-1]] = -1
+    expansion.sort(axis=1)
+    expansion = expansion[:, (expansion >= 0).any(axis=0)]
+    mask = expansion >= 0
+
+    x = features[torch.from_numpy(rows)]
+    y_index = torch.from_numpy(np.where(mask, expansion, 0))
+    y = features[y_index]
+    dist = sq_norm[torch.from_numpy(rows)].unsqueeze(1) + sq_norm[y_index] \
+           - 2 * torch.bmm(y, x.unsqueeze(2)).squeeze(2)
+    dist[~torch.from_numpy(mask)] = float("inf")
+    weight = torch.nan_to_num(F.softmax(-dist, dim=1)).numpy()
+
+    return mask.sum(axis=1), expansion[mask], weight[mask]
+
+
+def _sparse_jaccard_rows(V, V_csc, rows, col_start):
+    """Jaccard distance between `rows` of `V` and every row of `V` from `col_start` on,
+    using the sum of element-wise minimum over the shared non-zero columns."""
+    sub = V[rows[0]: rows[-1] + 1].tocoo()
+    starts = V_csc.indptr[sub.col]
+    lengths = V_csc.indptr[sub.col + 1] - starts
+
+    # expand each non-zero (i, k) of V over the non-zeros (j, k) of the same column
+    total = lengths.sum()
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+    i = np.repeat(sub.row.astype(np.int64), lengths)
+    j = V_csc.indices[offsets]
+    value = np.minimum(np.repeat(sub.data, lengths), V_csc.data[offsets])
+
+    keep = j >= col_start
+    width = V.shape[0] - col_start
+    temp_min = np.bincount(i[keep] * width + (j[keep] - col_start), weights=value[keep],
+                           minlength=len(rows) * width).reshape(len(rows), width)
+
+    return (1 - temp_min / (2 - temp_min)).astype(np.float32)
+
+
+@torch.no_grad()
+def compute_jaccard_distance_sparse(features, k1=20, k2=6, fp16=False, num_query=None, num_workers=4,
+                                    chunk_size=256):
+    """CPU k-reciprocal re-ranking with a sparse k-reciprocal encoding.
+    Produces the same result as :func:`compute_jaccard_distance`, but `V` is kept as a CSR
+    matrix with at most a few times `k1` non-zeros per row, the k-reciprocal expansion is
+    vectorised over chunks of rows, and the Jaccard term is computed with sparse
+    min-sum products. Chunks are processed by a pool of `num_workers` threads.
+    Args:
+        features (torch.Tensor): 2-D feature matrix of all samples, queries first.
+        k1 (int): size of the k-reciprocal neighbourhood.
+        k2 (int): size of the local query expansion.
+        fp16 (bool): return the distance matrix in float16.
+        num_query (int, optional): if given, only the (num_query, N - num_query) query x gallery
+            block of the distance matrix is computed and returned.
+        num_workers (int): number of worker threads.
+        chunk_size (int): number of rows processed by a worker at a time.
+    Returns:
+        numpy.ndarray: jaccard distance matrix.
+    """
+    features = features.cpu().float().contiguous()
+    N = features.size(0)
+    mat_type = np.float16 if fp16 else np.float32
+
+    index = index_init_cpu(features.size(-1))
+    index.add(features.numpy())
+    _, initial_rank = index.search(features.numpy(), k1)
+
+    chunks = [np.arange(i, min(i + chunk_size, N)) for i in range(0, N, chunk_size)]
+    with ThreadPoolExecutor(max_workers=max(num_workers, 1)) as pool:
+        nn_k1 = np.concatenate(list(pool.map(
+            lambda rows: _k_reciprocal_index(initial_rank, k1, rows), chunks)))
+        nn_k1_half = np.concatenate(list(pool.map(
+            lambda rows: _k_reciprocal_index(initial_rank, int(np.around(k1 / 2)), rows), chunks)))
+
+        # gathering the expanded neighbours' features is the memory bound step, use smaller chunks
+        v_chunk_size = max(1, chunk_size // 8)
+        v_chunks = [np.arange(i, min(i + v_chunk_size, N)) for i in range(0, N, v_chunk_size)]
+        sq_norm = torch.pow(features, 2).sum(dim=1)
+        v_rows = list(pool.map(
+            lambda rows: _sparse_v_rows(features, sq_norm, nn_k1, nn_k1_half, rows), v_chunks))
+        del nn_k1, nn_k1_half
+
+        indptr = np.concatenate(([0], np.cumsum(np.concatenate([r[0] for r in v_rows]))))
+        V = sparse.csr_matrix(
+            (np.concatenate([r[2] for r in v_rows]), np.concatenate([r[1] for r in v_rows]), indptr),
+            shape=(N, N),
+        )
+        del v_rows
+
+        if k2 != 1:
+            qe_index = initial_rank[:, :k2]
+            A = sparse.csr_matrix(
+                (np.full(qe_index.size, 1. / k2, dtype=np.float32), qe_index.reshape(-1),
+                 np.arange(0, qe_index.size + 1, k2)),
+                shape=(N, N),
+            )
+            V = A @ V
+            del A
+
+        del initial_rank
+        V.sort_indices()
+        V_csc = V.tocsc()
+
+        num_rows = N if num_query is None else num_query
+        col_start = 0 if num_query is None else num_query
+        row_chunks = [np.arange(i, min(i + chunk_size, num_rows)) for i in range(0, num_rows, chunk_size)]
+        jaccard_dist = np.concatenate(list(pool.map(
+            lambda rows: _sparse_jaccard_rows(V, V_csc, rows, col_start).astype(mat_type), row_chunks)))
+
+    del V, V_csc
+
+    pos_bool = jaccard_dist < 0
+    jaccard_dist[pos_bool] = 0.0
+
+    return jaccard_dist
+
+
+def _gallery_hash(features):
+    return hashlib.sha1(features.numpy().tobytes()).hexdigest()
+
+
+class GalleryReranker:
+    """Query-only k-reciprocal re-ranking against a fixed gallery.
+    The gallery-side structures of :func:`compute_jaccard_distance_sparse` (k-reciprocal
+    half-size sets, neighbourhood radii and the sparse encoding `V`) are computed once on the
+    gallery alone and can be persisted with :meth:`save`. A new query then only needs its own
+    k-reciprocal set, found by checking whether it falls inside the radius of its gallery
+    neighbours, and the Jaccard distance against the stored gallery encodings, so its cost
+    depends on `k1` and the neighbourhood size instead of (num_query + num_gallery) ** 2.
+    Since gallery neighbourhoods are computed without the queries, the result approximates
+    the joint re-ranking; it is exact for the query rows whenever no query enters the
+    k-reciprocal neighbourhood of a gallery item.
+    """
+
+    def __init__(self, features, k1=20, k2=6, num_workers=4, chunk_size=256):
+        """
+        Args:
+            features (torch.Tensor): 2-D gallery feature matrix.
+            k1 (int): size of the k-reciprocal neighbourhood.
+            k2 (int): size of the local query expansion.
+            num_workers (int): number of worker threads used for building.
+            chunk_size (int): number of rows processed by a worker at a time.
+        """
+        features = features.cpu().float().contiguous()
+        self.features = features
+        self.k1 = k1
+        self.k2 = k2
+        self.gallery_hash = _gallery_hash(features)
+        self._build_index()
+
+        N = features.size(0)
+        k1_half = int(np.around(k1 / 2))
+        dist, initial_rank = self.index.search(features.numpy(), k1)
+        # a query enters the neighbour list of a gallery item if it is closer than the last entry
+        self.radius = dist[:, k1 - 1]
+        self.radius_half = dist[:, min(k1_half, k1 - 1)]
+
+        chunks = [np.arange(i, min(i + chunk_size, N)) for i in range(0, N, chunk_size)]
+        v_chunk_size = max(1, chunk_size // 8)
+        v_chunks = [np.arange(i, min(i + v_chunk_size, N)) for i in range(0, N, v_chunk_size)]
+        with ThreadPoolExecutor(max_workers=max(num_workers, 1)) as pool:
+            nn_k1 = np.concatenate(list(pool.map(
+                lambda rows: _k_reciprocal_index(initial_rank, k1, rows), chunks)))
+            self.nn_k1_half = np.concatenate(list(pool.map(
+                lambda rows: _k_reciprocal_index(initial_rank, k1_half, rows), chunks)))
+            v_rows = list(pool.map(
+                lambda rows: _sparse_v_rows(features, self.sq_norm, nn_k1, self.nn_k1_half, rows), v_chunks))
+
+        indptr = np.concatenate(([0], np.cumsum(np.concatenate([r[0] for r in v_rows]))))
+        self.V = sparse.csr_matrix(
+            (np.concatenate([r[2] for r in v_rows]), np.concatenate([r[1] for r in v_rows]), indptr),
+            shape=(N, N),
+        )
+        if k2 != 1:
+            qe_index = initial_rank[:, :k2]
+            A = sparse.csr_matrix(
+                (np.full(qe_index.size, 1. / k2, dtype=np.float32), qe_index.reshape(-1),
+                 np.arange(0, qe_index.size + 1, k2)),
+                shape=(N, N),
+            )
+            self.V_qe = (A @ self.V).tocsc()
+        else:
+            self.V_qe = self.V.tocsc()
+        self.V_qe.sort_indices()
+
+    def _build_index(self):
+        self.sq_norm = torch.pow(self.features, 2).sum(dim=1)
+        self.index = index_init_cpu(self.features.size(-1))
+        self.index.add(self.features.numpy())
+
+    def __len__(self):
+        return self.features.size(0)
+
+    def save(self, path):
+        with PathManager.open(path, "wb") as f:
+            np.savez(
+                f,
+                features=self.features.numpy(),
+                k1=self.k1,
+                k2=self.k2,
+                gallery_hash=self.gallery_hash,
+                radius=self.radius,
+                radius_half=self.radius_half,
+                nn_k1_half=self.nn_k1_half,
+                V_data=self.V.data, V_indices=self.V.indices, V_indptr=self.V.indptr,
+                V_qe_data=self.V_qe.data, V_qe_indices=self.V_qe.indices, V_qe_indptr=self.V_qe.indptr,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with PathManager.open(path, "rb") as f:
+            data = dict(np.load(f))
+        self = cls.__new__(cls)
+        self.features = torch.from_numpy(data["features"])
+        self.k1 = int(data["k1"])
+        self.k2 = int(data["k2"])
+        self.gallery_hash = str(data["gallery_hash"])
+        self.radius = data["radius"]
+        self.radius_half = data["radius_half"]
+        self.nn_k1_half = data["nn_k1_half"]
+        N = self.features.size(0)
+        self.V = sparse.csr_matrix((data["V_data"], data["V_indices"], data["V_indptr"]), shape=(N, N))
+        self.V_qe = sparse.csc_matrix((data["V_qe_data"], data["V_qe_indices"], data["V_qe_indptr"]), shape=(N, N))
+        self._build_index()
+        return self
+
+    @classmethod
+    def from_cache(cls, path, features, k1=20, k2=6, num_workers=4):
+        """Load the gallery structures from `path` if they were built for the same gallery
+        features and parameters, otherwise build them and save them to `path`."""
+        if path and PathManager.exists(path):
+            reranker = cls.load(path)
+            if reranker.k1 == k1 and reranker.k2 == k2 and \
+                    reranker.gallery_hash == _gallery_hash(features.cpu().float().contiguous()):
+                logger.info("Loaded gallery re-ranking structures from {}".format(path))
+                return reranker
+            logger.info("Gallery re-ranking structures in {} are outdated, rebuilding".format(path))
+        reranker = cls(features, k1=k1, k2=k2, num_workers=num_workers)
+        if path:
+            reranker.save(path)
+            logger.info("Saved gallery re-ranking structures to {}".format(path))
+        return reranker
+
+    def _query_row(self, q_feat, q_sq_norm, dist, rank):
+        """Sparse k-reciprocal encoding of one query over the gallery columns plus its own
+        column (index len(self))."""
+        N = len(self)
+        k1_half = int(np.around(self.k1 / 2))
+        # the query itself is its own first neighbour
+        forward = rank[: self.k1 - 1]
+        reciprocal = forward[dist[: self.k1 - 1] <= self.radius[forward]]
+        forward_half = rank[: k1_half]
+        reciprocal_half = forward_half[dist[: k1_half] <= self.radius_half[forward_half]]
+
+        k_reciprocal_index = np.append(reciprocal, N)
+        k_reciprocal_expansion_index = k_reciprocal_index
+        for candidate in k_reciprocal_index:
+            if candidate == N:
+                candidate_k_reciprocal_index = np.append(reciprocal_half, N)
+            else:
+                candidate_k_reciprocal_index = self.nn_k1_half[candidate]
+                candidate_k_reciprocal_index = candidate_k_reciprocal_index[candidate_k_reciprocal_index >= 0]
+                if candidate in reciprocal_half:
+                    candidate_k_reciprocal_index = np.append(candidate_k_reciprocal_index, N)
+            if len(np.intersect1d(candidate_k_reciprocal_index, k_reciprocal_index)) > \
+                    2 / 3 * len(candidate_k_reciprocal_index):
+                k_reciprocal_expansion_index = np.append(k_reciprocal_expansion_index,
+                                                         candidate_k_reciprocal_index)
+        k_reciprocal_expansion_index = np.unique(k_reciprocal_expansion_index)
+
+        gallery_index = k_reciprocal_expansion_index[k_reciprocal_expansion_index < N]
+        y = self.features[torch.from_numpy(gallery_index)]
+        e_dist = torch.cat((q_sq_norm + self.sq_norm[torch.from_numpy(gallery_index)] - 2 * torch.mv(y, q_feat),
+                            torch.zeros(len(k_reciprocal_expansion_index) - len(gallery_index))))
+        weight = F.softmax(-e_dist, dim=0).numpy()
+        return sparse.csr_matrix(
+            (weight, k_reciprocal_expansion_index, [0, len(weight)]), shape=(1, N + 1),
+        )
+
+    @torch.no_grad()
+    def query_jaccard(self, query_features):
+        """Jaccard distance between new queries and the gallery.
+        Args:
+            query_features (torch.Tensor): 2-D query feature matrix.
+        Returns:
+            numpy.ndarray: jaccard distance matrix of shape (num_query, num_gallery).
+        """
+        query_features = query_features.cpu().float().contiguous()
+        N = len(self)
+        dist, initial_rank = self.index.search(query_features.numpy(), self.k1)
+        q_sq_norm = torch.pow(query_features, 2).sum(dim=1)
+        V_gallery = sparse.hstack((self.V, sparse.csr_matrix((N, 1), dtype=self.V.dtype))).tocsr()
+
+        jaccard_dist = np.ones((query_features.size(0), N), dtype=np.float32)
+        for i in range(query_features.size(0)):
+            V_q = self._query_row(query_features[i], q_sq_norm[i], dist[i], initial_rank[i])
+            if self.k2 != 1:
+                neighbours = V_gallery[initial_rank[i, : self.k2 - 1]]
+                V_q = (V_q + sparse.csr_matrix(np.ones((1, neighbours.shape[0]), dtype=np.float32)) @ neighbours) \
+                      / self.k2
+
+            # only gallery columns are shared with the gallery encodings
+            cols = V_q.indices[V_q.indices < N]
+            values = V_q.data[V_q.indices < N]
+            starts = self.V_qe.indptr[cols]
+            lengths = self.V_qe.indptr[cols + 1] - starts
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            temp_min = np.bincount(
+                self.V_qe.indices[offsets],
+                weights=np.minimum(np.repeat(values, lengths), self.V_qe.data[offsets]),
+                minlength=N,
+            )
+            jaccard_dist[i] = 1 - temp_min / (2 - temp_min)
+
+        pos_bool = jaccard_dist < 0
+        jaccard_dist[pos_bool] = 0.0
+
+        return jaccard_dist
+
+
 @torch.no_grad()
 def compute_euclidean_distance(features, others):
     m, n = features.size(0), others.size(0)
@@ -0,0 +1,240 @@
+# encoding: utf-8
+
+import glob
+import io
+import mmap
+import os
+import re
+import threading
+
+from .file_io import PathHandler, PathManager
+
+__all__ = ["CropShardWriter", "CropShards", "ShardPathHandler", "SHARD_PREFIX", "is_shard_dir", "shard_path",
+           "parse_crop_name"]
+
+SHARD_PREFIX = "shard://"
+
+# crop names written by generate.ipynb: pid, camera, video segment, frame and date time
+CROP_PATTERN = re.compile(r'([-\d]+)_c(\d+)s(\d+)_(\d+)_(\d+)\.jpg$')
+
+
+def parse_crop_name(name):
+    """
+    Returns:
+        tuple[int] or None: (pid, camera, segment, frame, date time) of a crop name, None if it does not match.
+    """
+    match = CROP_PATTERN.search(name)
+    if match is None:
+        return None
+    return tuple(int(v) for v in match.groups())
+
+
+def is_shard_dir(path):
+    return os.path.isdir(path) and len(glob.glob(os.path.join(path, "*.idx"))) > 0
+
+
+def shard_path(root, name):
+    """Path of a crop in a shard directory, which :class:`PathManager` and `read_image` can open."""
+    return SHARD_PREFIX + os.path.join(os.path.abspath(root), name)
+
+
+class CropShardWriter:
+    """
+    Append encoded crops to a shard directory instead of writing one file per crop.
+    Every writer owns the files starting with `prefix`: the data files ``{prefix}-00000.bin``, ...
+    hold the encoded images back to back, a new one is started once `max_shard_bytes` is reached,
+    and ``{prefix}.idx`` has one ``name<TAB>data file<TAB>offset<TAB>length`` line per crop.
+    The data is flushed before its index line is written, so a crash never leaves an index
+    entry without data. Writers with different prefixes may fill the same directory at once,
+    e.g. one per video, and a writer can be reopened to append more crops.
+    """
+
+    def __init__(self, root, prefix="crops", max_shard_bytes=1 << 30):
+        os.makedirs(root, exist_ok=True)
+        assert "\t" not in prefix and "\n" not in prefix, "Invalid shard prefix {}".format(prefix)
+        self.root = root
+        self.prefix = prefix
+        self.max_shard_bytes = max_shard_bytes
+        self._lock = threading.Lock()
+
+        index_file = os.path.join(root, "{}.idx".format(prefix))
+        # drop the last line if a crash cut it
+        if os.path.exists(index_file):
+            with open(index_file, "rb") as f:
+                content = f.read()
+            if content and not content.endswith(b"\n"):
+                with open(index_file, "r+b") as f:
+                    f.truncate(content.rfind(b"\n") + 1)
+        self._index = open(index_file, "a")
+
+        # only the data files of this prefix, not those of a prefix like "{prefix}-day2"
+        self._shard_id = len(glob.glob(os.path.join(root, "{}-[0-9][0-9][0-9][0-9][0-9].bin".format(
+            glob.escape(prefix)))))
+        self._data = None
+        self._open_shard(max(self._shard_id - 1, 0))
+
+    def _open_shard(self, shard_id):
+        if self._data is not None:
+            self._data.close()
+        self._shard_id = shard_id
+        self._shard_name = "{}-{:05d}.bin".format(self.prefix, shard_id)
+        self._data = open(os.path.join(self.root, self._shard_name), "ab")
+
+    def write(self, name, data):
+        """
+        Args:
+            name (str): crop file name, e.g. "0001_c01s01_0025_20211012080012.jpg".
+            data (bytes): the encoded image.
+        """
+        assert "\t" not in name and "\n" not in name, "Invalid crop name {}".format(name)
+        data = bytes(data)
+        with self._lock:
+            offset = self._data.tell()
+            if offset > 0 and offset + len(data) > self.max_shard_bytes:
+                self._open_shard(self._shard_id + 1)
+                offset = 0
+            self._data.write(data)
+            self._data.flush()
+            self._index.write("{}\t{}\t{}\t{}\n".format(name, self._shard_name, offset, len(data)))
+            self._index.flush()
+
+    def close(self):
+        with self._lock:
+            self._data.close()
+            self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CropShards:
+    """
+    Read-only view of a shard directory written by :class:`CropShardWriter`. The data files are
+    memory-mapped, so a crop is read without any open() or stat() on the file system. A crop
+    written several times keeps its last version. Crops written after the view was created
+    are only seen after :meth:`refresh`.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.items = {}
+        self._signature = None
+        self.refresh()
+        # opened lazily, mmaps can not be pickled to the dataloader workers
+        self._maps = {}
+
+    def _index_signature(self):
+        signature = []
+        for path in sorted(glob.glob(os.path.join(self.root, "*.idx"))):
+            st = os.stat(path)
+            signature.append((path, st.st_mtime_ns, st.st_size))
+        return signature
+
+    def refresh(self):
+        """
+        Reload the index files if any of them changed since they were read.
+        Returns:
+            bool: whether the index was reloaded.
+        """
+        signature = self._index_signature()
+        if signature == self._signature:
+            return False
+        items = {}
+        for index_file, _, _ in signature:
+            with open(index_file, "r") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        # being written
+                        break
+                    name, shard, offset, length = line.rstrip("\n").split("\t")
+                    items[name] = (shard, int(offset), int(length))
+        self.items = items
+        self._signature = signature
+        return True
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_maps"] = {}
+        return state
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, name):
+        return name in self.items
+
+    def names(self):
+        return list(self.items.keys())
+
+    def _map(self, shard, end):
+        mm = self._maps.get(shard)
+        if mm is None or len(mm) < end:
+            # (re)map, the shard may have grown since it was mapped
+            with open(os.path.join(self.root, shard), "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[shard] = mm
+        return mm
+
+    def read(self, name):
+        shard, offset, length = self.items[name]
+        return self._map(shard, offset + length)[offset: offset + length]
+
+    def stat(self, name):
+        """
+        Returns:
+            (int, int): offset and length of the crop, they change whenever it is written again.
+        """
+        return self.items[name][1:]
+
+
+class ShardPathHandler(PathHandler):
+    """
+    Opens ``shard://<shard dir>/<crop name>`` paths, so datasets can list crops of a shard
+    directory as image paths and `read_image` reads them unchanged. The index of a shard
+    directory is loaded once and reloaded when a crop is missing from it and the index files
+    changed, e.g. because a writer is still appending crops.
+    """
+    _shards = {}
+
+    def _get_supported_prefixes(self):
+        return [SHARD_PREFIX]
+
+    @classmethod
+    def get_shards(cls, root):
+        shards = cls._shards.get(root)
+        if shards is None:
+            shards = cls._shards[root] = CropShards(root)
+        return shards
+
+    @classmethod
+    def split(cls, path):
+        root, name = os.path.split(path[len(SHARD_PREFIX):])
+        shards = cls.get_shards(root)
+        if name not in shards:
+            shards.refresh()
+        return shards, name
+
+    def _open(self, path, mode="rb", buffering=-1, **kwargs):
+        self._check_kwargs(kwargs)
+        assert mode in ["r", "rb"], "{} only supports reading, got mode {}".format(self.__class__.__name__, mode)
+        shards, name = self.split(path)
+        data = shards.read(name)
+        return io.BytesIO(data) if mode == "rb" else io.StringIO(data.decode())
+
+    def _exists(self, path, **kwargs):
+        self._check_kwargs(kwargs)
+        shards, name = self.split(path)
+        return name in shards
+
+    def _isfile(self, path, **kwargs):
+        return self._exists(path, **kwargs)
+
+    def _isdir(self, path, **kwargs):
+        self._check_kwargs(kwargs)
+        return False
+
+
+PathManager.register_handler(ShardPathHandler())
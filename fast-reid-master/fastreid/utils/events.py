@@ -12,6 +12,7 @@ from .history_buffer import HistoryBuffer
 
 __all__ = [
     "get_event_storage",
+    "has_event_storage",
     "JSONWriter",
     "TensorboardXWriter",
     "CommonMetricPrinter",
@@ -33,6 +34,14 @@ def get_event_storage():
     return _CURRENT_STORAGE_STACK[-1]
 
 
+def has_event_storage():
+    """
+    Returns:
+        Check if there are EventStorage() context existed.
+    """
+    return len(_CURRENT_STORAGE_STACK) > 0
+
+
 class EventWriter:
     """
     Base class for writers that obtain events from :class:`EventStorage` and process them.
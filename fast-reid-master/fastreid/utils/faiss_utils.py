@@ -1,8 +1,14 @@
 # encoding: utf-8
 # copy from: https://github.com/open-mmlab/OpenUnReID/blob/66bb2ae0b00575b80fbe8915f4d4f4739cc21206/openunreid/core/utils/faiss_utils.py
 
+import time
+
 import faiss
+import numpy as np
 import torch
+import torch.nn.functional as F
+
+from .file_io import PathManager
 
 
 def swig_ptr_from_FloatTensor(x):
@@ -125,3 +131,197 @@ def index_init_gpu(ngpus, feat_dim):
 
 def index_init_cpu(feat_dim):
     return faiss.IndexFlatL2(feat_dim)
+
+
+class GalleryIndex:
+    """Persistent CPU faiss index over L2-normalised gallery features, with the pid, camid
+    and image path of every item, so that queries can be filtered by camera or identity.
+    `index_type` is "flat" (exact), "ivfpq" or "hnsw". Items can be appended at any time with
+    :meth:`add`; an IVF-PQ index is trained on the first batch it receives.
+    Distances are cosine distances, as :func:`fastreid.utils.compute_dist.build_dist`.
+    """
+
+    def __init__(self, feat_dim, index_type="flat", nlist=1024, pq_m=16, hnsw_m=32, nprobe=16, ef_search=128,
+                 model_key=""):
+        """
+        Args:
+            feat_dim (int): feature dimension.
+            index_type (str): "flat", "ivfpq" or "hnsw".
+            nlist (int): number of IVF cells, "ivfpq" only.
+            pq_m (int): number of PQ sub-quantizers, must divide `feat_dim`, "ivfpq" only.
+            hnsw_m (int): number of HNSW neighbours per node, "hnsw" only.
+            nprobe (int): number of IVF cells visited by a search, "ivfpq" only.
+            ef_search (int): HNSW search depth, "hnsw" only.
+            model_key (str): key of the model the features come from, saved with the index so
+                that an index of other model weights is not reused.
+        """
+        factory = {
+            "flat": "Flat",
+            "ivfpq": "IVF{},PQ{}".format(nlist, pq_m),
+            "hnsw": "HNSW{}".format(hnsw_m),
+        }
+        assert index_type in factory, "Expected index types are {}, but got {}".format(list(factory), index_type)
+        self.feat_dim = feat_dim
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.model_key = model_key
+        self.index = faiss.index_factory(feat_dim, factory[index_type], faiss.METRIC_INNER_PRODUCT)
+        self.pids = np.empty(0, dtype=np.int64)
+        self.camids = np.empty(0, dtype=np.int64)
+        self.paths = np.empty(0, dtype=object)
+        self._set_search_params()
+
+    @classmethod
+    def from_config(cls, cfg, feat_dim, model_key=""):
+        ann = cfg.TEST.ANN
+        return cls(feat_dim, ann.TYPE, nlist=ann.NLIST, pq_m=ann.PQ_M, hnsw_m=ann.HNSW_M,
+                   nprobe=ann.NPROBE, ef_search=ann.EF_SEARCH, model_key=model_key)
+
+    def _set_search_params(self):
+        if self.index_type == "ivfpq":
+            faiss.extract_index_ivf(self.index).nprobe = self.nprobe
+        elif self.index_type == "hnsw":
+            self.index.hnsw.efSearch = self.ef_search
+
+    def __len__(self):
+        return self.index.ntotal
+
+    @staticmethod
+    def _prepare(feats):
+        feats = torch.as_tensor(feats).float()
+        return F.normalize(feats, p=2, dim=1).cpu().contiguous().numpy()
+
+    def add(self, feats, pids=None, camids=None, paths=None):
+        """
+        Append gallery items, their rows are numbered after the ones already in the index.
+        Args:
+            feats (torch.Tensor or np.ndarray): 2-D feature matrix.
+            pids, camids (array-like): identity and camera of every item, -1 if unknown.
+            paths (list[str]): image path of every item.
+        """
+        feats = self._prepare(feats)
+        n = feats.shape[0]
+        if not self.index.is_trained:
+            assert n >= faiss.extract_index_ivf(self.index).nlist, \
+                "IVF-PQ needs at least nlist items in its first batch to be trained"
+            self.index.train(feats)
+        self.index.add(feats)
+        self.pids = np.concatenate((self.pids, np.full(n, -1) if pids is None else np.asarray(pids)))
+        self.camids = np.concatenate((self.camids, np.full(n, -1) if camids is None else np.asarray(camids)))
+        self.paths = np.concatenate((self.paths, np.full(n, None, dtype=object) if paths is None
+                                     else np.asarray(paths, dtype=object)))
+
+    def search(self, query, k, q_pids=None, q_camids=None, exclude_same_pid=False,
+               exclude_same_camera=False, mask=None):
+        """
+        Top-k search with optional filters. Filtered-out items are dropped and the search
+        is widened until every query has `k` results or the whole index has been searched.
+        Args:
+            query (torch.Tensor or np.ndarray): 2-D query feature matrix.
+            k (int): number of results per query.
+            q_pids, q_camids (array-like): identity and camera of every query, for the filters.
+            exclude_same_pid (bool): drop gallery items with the query identity.
+            exclude_same_camera (bool): drop gallery items from the query camera.
+            mask (np.ndarray): boolean array over the index rows, only True rows are returned.
+        Returns:
+            tuple(numpy.ndarray, numpy.ndarray): index rows (int64) and cosine distances (float32),
+                both of shape (num_query, k) and sorted by ascending distance. Missing results
+                have row -1 and distance inf.
+        """
+        query = self._prepare(query)
+        n = len(self)
+        k = min(k, n)
+        filtered = exclude_same_pid or exclude_same_camera or mask is not None
+        fetch = min(n, 2 * k) if filtered else k
+
+        while True:
+            sims, indices = self.index.search(query, fetch)
+            valid = indices >= 0
+            rows = np.where(valid, indices, 0)
+            if mask is not None:
+                valid &= mask[rows]
+            if exclude_same_pid:
+                valid &= self.pids[rows] != np.asarray(q_pids)[:, np.newaxis]
+            if exclude_same_camera:
+                valid &= self.camids[rows] != np.asarray(q_camids)[:, np.newaxis]
+            if fetch >= n or (valid.sum(axis=1) >= k).all():
+                break
+            fetch = min(n, 4 * fetch)
+
+        # move the valid results to the front, keeping their order
+        order = np.argsort(~valid, axis=1, kind="stable")[:, :k]
+        indices = np.take_along_axis(indices, order, axis=1)
+        dists = 1 - np.take_along_axis(sims, order, axis=1)
+        valid = np.take_along_axis(valid, order, axis=1)
+        indices[~valid] = -1
+        dists[~valid] = np.inf
+        return indices, dists.astype(np.float32)
+
+    def save(self, path):
+        with PathManager.open(path, "wb") as f:
+            np.savez(
+                f,
+                index=faiss.serialize_index(self.index),
+                index_type=self.index_type,
+                nprobe=self.nprobe,
+                ef_search=self.ef_search,
+                model_key=self.model_key,
+                pids=self.pids,
+                camids=self.camids,
+                paths=self.paths.astype(str),
+            )
+
+    @classmethod
+    def load(cls, path):
+        with PathManager.open(path, "rb") as f:
+            data = dict(np.load(f))
+        self = cls.__new__(cls)
+        self.index = faiss.deserialize_index(data["index"])
+        self.feat_dim = self.index.d
+        self.index_type = str(data["index_type"])
+        self.nprobe = int(data["nprobe"])
+        self.ef_search = int(data["ef_search"])
+        self.model_key = str(data["model_key"]) if "model_key" in data else ""
+        self.pids = data["pids"]
+        self.camids = data["camids"]
+        self.paths = data["paths"].astype(object)
+        self._set_search_params()
+        return self
+
+
+def evaluate_recall(index, gallery_feats, query_feats, k=10, rows=None):
+    """Recall@k of `index` against exact search over the same gallery features, i.e. the
+    fraction of the exact top-k neighbours it returns, with the search time of both.
+    Args:
+        index (GalleryIndex): index holding `gallery_feats`.
+        gallery_feats (torch.Tensor or np.ndarray): 2-D gallery feature matrix.
+        query_feats (torch.Tensor or np.ndarray): 2-D query feature matrix.
+        k (int): number of neighbours.
+        rows (np.ndarray): index row of every gallery feature, by default the index holds
+            exactly `gallery_feats` in the same order.
+    Returns:
+        dict: "recall", "ann_time" and "exact_time" in seconds.
+    """
+    mask = None
+    if rows is None:
+        assert len(index) == len(gallery_feats), "The index must hold exactly the gallery features"
+        rows = np.arange(len(index))
+    else:
+        mask = np.zeros(len(index), dtype=bool)
+        mask[rows] = True
+    exact = faiss.IndexFlatIP(index.feat_dim)
+    exact.add(GalleryIndex._prepare(gallery_feats))
+
+    start = time.perf_counter()
+    ann_indices, _ = index.search(query_feats, k, mask=mask)
+    ann_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, exact_indices = exact.search(GalleryIndex._prepare(query_feats), ann_indices.shape[1])
+    exact_time = time.perf_counter() - start
+
+    exact_indices = rows[exact_indices]
+    hits = [len(np.intersect1d(a[a >= 0], e)) for a, e in zip(ann_indices, exact_indices)]
+    recall = np.sum(hits) / exact_indices.size
+    return {"recall": recall, "ann_time": ann_time, "exact_time": exact_time}
@@ -13,7 +13,6 @@ import matplotlib.pyplot as plt
 import numpy as np
 import tqdm
 from scipy.stats import norm
-from sklearn import metrics
 
 from .file_io import PathManager
 
@@ -25,15 +24,26 @@ class Visualizer:
         self.dataset = dataset
 
     def get_model_output(self, all_ap, dist, q_pids, g_pids, q_camids, g_camids):
+        """
+        Args:
+            dist (np.ndarray or tuple): distance matrix of shape (num_query, num_gallery), or an
+                (indices, distances) pair of the top-k gallery items of each query.
+        """
         self.all_ap = all_ap
-        self.dist = dist
-        self.sim = 1 - dist
         self.q_pids = q_pids
         self.g_pids = g_pids
         self.q_camids = q_camids
         self.g_camids = g_camids
 
-        self.indices = np.argsort(dist, axis=1)
+        if isinstance(dist, tuple):
+            # blocked top-k distances, rows are already sorted by ascending distance
+            self.indices, self.dist = dist
+            self.topk = True
+        else:
+            self.indices = np.argsort(dist, axis=1)
+            self.dist = dist
+            self.topk = False
+        self.sim = 1 - self.dist
         self.matches = (g_pids[self.indices] == q_pids[:, np.newaxis]).astype(np.int32)
 
         self.num_query = len(q_pids)
@@ -49,6 +59,15 @@ class Visualizer:
         sort_idx = order[keep]
         return cmc, sort_idx
 
+    def get_matched_dist(self, q_index):
+        """Distances of the gallery items returned by :meth:`get_matched_result`, in rank order."""
+        order = self.indices[q_index]
+        remove = (self.g_pids[order] == self.q_pids[q_index]) & (self.g_camids[order] == self.q_camids[q_index])
+        keep = np.invert(remove)
+        if self.topk:
+            return self.dist[q_index][keep]
+        return self.dist[q_index][order[keep]]
+
     def save_rank_result(self, query_indices, output, max_rank=5, vis_label=False, label_sort='ascending',
                          actmap=False):
         if vis_label:
@@ -165,30 +184,28 @@ class Visualizer:
         query_indices = query_indices[:int(num_vis)]
         self.save_rank_result(query_indices, output, max_rank, vis_label, label_sort, actmap)
 
-    def vis_roc_curve(self, output):
-        PathManager.mkdirs(output)
-        pos, neg = [], []
-        for i, q in enumerate(self.q_pids):
-            cmc, sort_idx = self.get_matched_result(i)  # remove same id in same camera
-            ind_pos = np.where(cmc == 1)[0]
-            q_dist = self.dist[i]
-            pos.extend(q_dist[sort_idx[ind_pos]])
-
-            ind_neg = np.where(cmc == 0)[0]
-            neg.extend(q_dist[sort_idx[ind_neg]])
-
-        scores = np.hstack((pos, neg))
-        labels = np.hstack((np.zeros(len(pos)), np.ones(len(neg))))
+    def vis_roc_curve(self, output, num_bins=20000):
+        """
+        Plot the ROC curve from histograms of the matched distances, see :class:`RocAccumulator`.
+        Returns:
+            fpr, tpr and the :class:`RocAccumulator` holding the positive and negative histograms.
+        """
+        from fastreid.evaluation.roc import RocAccumulator, finite_range
 
-        fpr, tpr, thresholds = metrics.roc_curve(labels, scores)
+        PathManager.mkdirs(output)
+        dist = (self.indices, self.dist) if self.topk else self.dist
+        roc = RocAccumulator(num_bins, finite_range(self.dist))
+        roc.update(dist, self.q_pids, self.g_pids, self.q_camids, self.g_camids)
+        fpr, tpr, thresholds = roc.roc_curve()
 
         self.plot_roc_curve(fpr, tpr)
         filepath = os.path.join(output, "roc.jpg")
         plt.savefig(filepath)
-        # self.plot_distribution(pos, neg)
+        # edges, pos, neg = roc.histogram()
+        # self.plot_distribution(pos, neg, bins=edges)
         # filepath = os.path.join(output, "pos_neg_dist.jpg")
         # plt.savefig(filepath)
-        return fpr, tpr, pos, neg
+        return fpr, tpr, roc
 
     @staticmethod
     def plot_roc_curve(fpr, tpr, name='model', fig=None):
@@ -204,26 +221,30 @@ class Visualizer:
         return fig
 
     @staticmethod
-    def plot_distribution(pos, neg, name='model', fig=None):
+    def plot_distribution(pos, neg, name='model', fig=None, bins=None):
+        """
+        Args:
+            pos, neg: distances of positive and negative pairs, or their histogram
+                counts over the `bins` edges, e.g. from :meth:`RocAccumulator.histogram`.
+        """
         if fig is None:
             fig = plt.figure()
         pos_color = (random.uniform(0, 1), random.uniform(0, 1), random.uniform(0, 1))
-        n, bins, _ = plt.hist(pos, bins=80, alpha=0.7, density=True,
-                              color=pos_color,
-                              label='positive with {}'.format(name))
-        mu = np.mean(pos)
-        sigma = np.std(pos)
-        y = norm.pdf(bins, mu, sigma)  # fitting curve
-        plt.plot(bins, y, color=pos_color)  # plot y curve
-
         neg_color = (random.uniform(0, 1), random.uniform(0, 1), random.uniform(0, 1))
-        n, bins, _ = plt.hist(neg, bins=80, alpha=0.5, density=True,
-                              color=neg_color,
-                              label='negative with {}'.format(name))
-        mu = np.mean(neg)
-        sigma = np.std(neg)
-        y = norm.pdf(bins, mu, sigma)  # fitting curve
-        plt.plot(bins, y, color=neg_color)  # plot y curve
+        for values, color, alpha, label in [(pos, pos_color, 0.7, 'positive'), (neg, neg_color, 0.5, 'negative')]:
+            if bins is None:
+                n, edges, _ = plt.hist(values, bins=80, alpha=alpha, density=True,
+                                       color=color, label='{} with {}'.format(label, name))
+                mu = np.mean(values)
+                sigma = np.std(values)
+            else:
+                centers = (bins[:-1] + bins[1:]) / 2
+                n, edges, _ = plt.hist(centers, bins=bins, weights=values, alpha=alpha, density=True,
+                                       color=color, label='{} with {}'.format(label, name))
+                mu = np.average(centers, weights=values)
+                sigma = np.sqrt(np.average((centers - mu) ** 2, weights=values))
+            y = norm.pdf(edges, mu, sigma)  # fitting curve
+            plt.plot(edges, y, color=color)  # plot y curve
 
         plt.xticks(np.arange(0, 1.5, 0.1))
         plt.title('positive and negative pairs distribution')
@@ -231,13 +252,20 @@ class Visualizer:
         return fig
 
     @staticmethod
-    def save_roc_info(output, fpr, tpr, pos, neg):
+    def save_roc_info(output, fpr, tpr, pos=None, neg=None, roc=None):
+        """
+        Save the curve together with either the raw `pos`/`neg` distances or,
+        much smaller, the histograms of a :class:`RocAccumulator`.
+        """
         results = {
             "fpr": np.asarray(fpr),
             "tpr": np.asarray(tpr),
-            "pos": np.asarray(pos),
-            "neg": np.asarray(neg),
         }
+        if pos is not None and neg is not None:
+            results["pos"] = np.asarray(pos)
+            results["neg"] = np.asarray(neg)
+        if roc is not None:
+            results["roc"] = roc.state_dict()
         with open(os.path.join(output, "roc_info.pickle"), "wb") as handle:
             pickle.dump(results, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
@@ -82,7 +82,13 @@ class NaicEvaluator(ReidEvaluator):
             query_features = F.normalize(query_features, dim=1)
             gallery_features = F.normalize(gallery_features, dim=1)
 
-        dist = build_dist(query_features, gallery_features, self.cfg.TEST.METRIC)
+        if self.cfg.TEST.TOPK.ENABLED:
+            assert not self.cfg.TEST.RERANK.ENABLED, "Rerank needs the full distance matrix, " \
+                                                     "disable TEST.TOPK to use it"
+            dist = build_dist(query_features, gallery_features, self.cfg.TEST.METRIC,
+                              topk=max(self.cfg.TEST.TOPK.K, 200), block_size=self.cfg.TEST.TOPK.BLOCK_SIZE)
+        else:
+            dist = build_dist(query_features, gallery_features, self.cfg.TEST.METRIC)
 
         if self.cfg.TEST.RERANK.ENABLED:
             logger.info("Test with rerank setting")
@@ -94,15 +100,25 @@ class NaicEvaluator(ReidEvaluator):
                 query_features = F.normalize(query_features, dim=1)
                 gallery_features = F.normalize(gallery_features, dim=1)
 
-            rerank_dist = build_dist(query_features, gallery_features, metric="jaccard", k1=k1, k2=k2)
+            rerank_dist = build_dist(query_features, gallery_features, metric="jaccard", k1=k1, k2=k2,
+                                     engine=self.cfg.TEST.RERANK.ENGINE,
+                                     num_workers=self.cfg.TEST.RERANK.NUM_WORKERS,
+                                     cache=self.cfg.TEST.RERANK.GALLERY_CACHE)
             dist = rerank_dist * (1 - lambda_value) + dist * lambda_value
 
         if self.cfg.TEST.SAVE_DISTMAT:
-            np.save(os.path.join(self.cfg.OUTPUT_DIR, "distmat.npy"), dist)
+            if isinstance(dist, tuple):
+                np.savez(os.path.join(self.cfg.OUTPUT_DIR, "distmat.npz"), indices=dist[0], distances=dist[1])
+            else:
+                np.save(os.path.join(self.cfg.OUTPUT_DIR, "distmat.npy"), dist)
 
         results = defaultdict(list)
 
-        topk_indices = partition_arg_topK(dist, K=200, axis=1)[:, :200]
+        if isinstance(dist, tuple):
+            # blocked top-k distances are already sorted
+            topk_indices = dist[0][:, :200]
+        else:
+            topk_indices = partition_arg_topK(dist, K=200, axis=1)[:, :200]
         for i in range(topk_indices.shape[0]):
             results[query_pids[i]].extend(gallery_pids[topk_indices[i]])
 
@@ -0,0 +1,84 @@
+import sys
+import unittest
+
+import torch
+import torchvision.transforms as T
+import torchvision.transforms.functional as F
+
+sys.path.append('.')
+from fastreid.config import get_cfg
+from fastreid.data.build import BatchTransformCollator
+from fastreid.data.transforms import batch_train_ops, build_batch_transforms, build_transforms
+from fastreid.data.transforms import BatchPadCrop, BatchRandomErasing, BatchRandomPatch, RandomPatch
+
+
+class BatchTransformsTestCase(unittest.TestCase):
+    def test_pad_crop(self):
+        images = torch.rand(8, 3, 16, 12)
+        for mode in ['constant', 'edge', 'reflect', 'symmetric']:
+            out = BatchPadCrop((16, 12), padding=4, padding_mode=mode)(images)
+            for image, crop in zip(images, out):
+                padded = F.pad(image, 4, padding_mode=mode)
+                self.assertTrue(any(torch.equal(padded[:, y:y + 16, x:x + 12], crop)
+                                    for y in range(9) for x in range(9)))
+
+    def test_random_erasing(self):
+        images = torch.ones(2000, 3, 64, 32)
+        batch = BatchRandomErasing(p=0.5, value=[0, 0, 0])(images)
+        rea = T.RandomErasing(p=0.5, value=0)
+        single = torch.stack([rea(image.clone()) for image in images])
+        for erased in [batch, single]:
+            area = (erased[:, 0] == 0).float().mean((1, 2))
+            self.assertAlmostEqual((area > 0).float().mean().item(), 0.5, delta=0.05)
+            self.assertAlmostEqual(area[area > 0].mean().item(), 0.16, delta=0.015)
+
+        images = torch.full((4, 3, 8, 8), 255, dtype=torch.uint8)
+        self.assertEqual(BatchRandomErasing(value=[123.6, 50, 1])(images).dtype, torch.uint8)
+
+    def test_random_patch(self):
+        batch_patch = BatchRandomPatch(prob_happen=0.5)
+        single_patch = RandomPatch(prob_happen=0.5)
+        changed = [[], []]
+        for _ in range(60):
+            images = torch.rand(32, 3, 64, 32)
+            out = batch_patch(images.clone())
+            changed[0].append((out != images).float().mean((1, 2, 3)))
+            changed[1].append(torch.stack([(single_patch(image.clone()) != image).float().mean()
+                                           for image in images]))
+        self.assertEqual(len(batch_patch.patchpool), 60 * 32)
+        for area in changed:
+            # once the pool holds min_sample_size patches
+            area = torch.cat(area)[256:]
+            self.assertAlmostEqual((area > 0).float().mean().item(), 0.5, delta=0.05)
+            self.assertAlmostEqual(area[area > 0].mean().item(), 0.2, delta=0.02)
+
+        images = torch.randint(0, 255, (8, 3, 64, 32), dtype=torch.uint8)
+        self.assertEqual(batch_patch(images).dtype, torch.uint8)
+
+    def test_build(self):
+        cfg = get_cfg()
+        cfg.INPUT.PADDING.ENABLED = True
+        cfg.INPUT.FLIP.ENABLED = True
+        cfg.INPUT.REA.ENABLED = True
+        cfg.INPUT.CJ.ENABLED = True
+        self.assertIsNone(build_batch_transforms(cfg, batch_train_ops(cfg)))
+        # without batch_ops nothing is left out, as for the train sets of projects
+        self.assertEqual(len(build_transforms(cfg, is_train=True).transforms), 7)
+
+        cfg.INPUT.BATCH_AUG.ENABLED = True
+        # padding and flip come before color jitter, so they stay per sample
+        self.assertEqual(len(build_batch_transforms(cfg, batch_train_ops(cfg)).transforms), 1)
+        cfg.INPUT.CJ.ENABLED = False
+        batch_ops = batch_train_ops(cfg)
+        batch_transforms = build_batch_transforms(cfg, batch_ops)
+        self.assertEqual(len(batch_transforms.transforms), 3)
+        self.assertEqual(len(build_transforms(cfg, is_train=True, batch_ops=batch_ops).transforms), 2)
+        self.assertEqual(len(build_transforms(cfg, is_train=True).transforms), 6)
+
+        collator = BatchTransformCollator(batch_transforms)
+        batch = collator([{"images": torch.rand(3, 256, 128), "targets": i} for i in range(4)])
+        self.assertEqual(tuple(batch["images"].shape), (4, 3, 256, 128))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+sys.path.append('.')
+from fastreid.utils.compute_dist import (build_dist, compute_jaccard_distance, compute_jaccard_distance_sparse,
+                                         GalleryReranker)
+from fastreid.evaluation.rank import evaluate_rank
+
+
+class ComputeDistTestCase(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.q_feat = torch.randn(50, 32)
+        self.g_feat = torch.randn(700, 32)
+
+    def test_topk_matches_dense(self):
+        for metric in ["cosine", "euclidean"]:
+            dist = build_dist(self.q_feat, self.g_feat, metric)
+            indices, topk_dist = build_dist(self.q_feat, self.g_feat, metric, topk=20, block_size=64)
+            self.assertEqual(indices.shape, (50, 20))
+            np.testing.assert_array_equal(indices, np.argsort(dist, axis=1)[:, :20])
+            np.testing.assert_allclose(topk_dist, np.take_along_axis(dist, indices, axis=1), rtol=1e-4, atol=1e-4)
+
+    def test_topk_rank(self):
+        q_pids = np.random.randint(0, 20, size=50)
+        g_pids = np.random.randint(0, 20, size=700)
+        q_camids = np.random.randint(0, 3, size=50)
+        g_camids = np.random.randint(0, 3, size=700)
+        full = build_dist(self.q_feat, self.g_feat, "cosine", topk=700)
+        part = build_dist(self.q_feat, self.g_feat, "cosine", topk=30)
+        cmc, all_AP, all_INP = evaluate_rank(full, q_pids, g_pids, q_camids, g_camids, max_rank=10)
+        cmc_k, all_AP_k, all_INP_k = evaluate_rank(part, q_pids, g_pids, q_camids, g_camids, max_rank=10)
+        np.testing.assert_allclose(cmc, cmc_k)
+        self.assertTrue(np.all(all_AP_k <= all_AP + 1e-6))
+        self.assertTrue(np.all(all_INP_k <= all_INP + 1e-6))
+
+    def test_sparse_jaccard_matches_dense(self):
+        feat = torch.cat((self.q_feat, self.g_feat[:250]), dim=0)
+        for k2 in [1, 6]:
+            dist = compute_jaccard_distance(feat, k1=20, k2=k2, search_option=3)
+            sparse_dist = compute_jaccard_distance_sparse(feat, k1=20, k2=k2, num_workers=2, chunk_size=64)
+            np.testing.assert_allclose(sparse_dist, dist, atol=1e-5)
+            sparse_dist = compute_jaccard_distance_sparse(feat, k1=20, k2=k2, num_query=50)
+            np.testing.assert_allclose(sparse_dist, dist[:50, 50:], atol=1e-5)
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            build_dist(self.q_feat, self.g_feat, "jaccard", k1=20, k2=6, engine="Sparse")
+
+    def test_gallery_reranker(self):
+        # a handful of new queries against a fixed gallery
+        q_feat = self.q_feat[:5]
+        dist = compute_jaccard_distance_sparse(torch.cat((q_feat, self.g_feat), dim=0), k1=20, k2=6, num_query=5)
+        reranker = GalleryReranker(self.g_feat, k1=20, k2=6)
+        query_dist = reranker.query_jaccard(q_feat)
+        self.assertEqual(query_dist.shape, dist.shape)
+        self.assertLess(np.abs(query_dist - dist).mean(), 1e-2)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "gallery.npz")
+            reranker.save(path)
+            np.testing.assert_array_equal(GalleryReranker.load(path).query_jaccard(q_feat), query_dist)
+
+
+if __name__ == '__main__':
+    unittest.main()
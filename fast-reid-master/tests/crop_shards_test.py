@@ -0,0 +1,83 @@
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+sys.path.append('.')
+from fastreid.data.data_utils import read_image
+from fastreid.data.datasets import CropShards
+from fastreid.utils.crop_shards import CropShardWriter, ShardPathHandler, shard_path
+from fastreid.utils.file_io import PathManager
+
+
+def encode(color):
+    buf = io.BytesIO()
+    Image.fromarray(np.full((32, 16, 3), color, dtype=np.uint8)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class CropShardsTestCase(unittest.TestCase):
+    def test_write_and_read(self):
+        with tempfile.TemporaryDirectory() as root:
+            names = ["%04d_c%02ds01_%04d_20211012080012.jpg" % (i % 5, 1 + i % 2, i) for i in range(20)]
+            with CropShardWriter(root, "D01", max_shard_bytes=1024) as writer:
+                for i, name in enumerate(names[:10]):
+                    writer.write(name, encode(i))
+            # a reopened writer appends, a cut index line is dropped
+            with open(os.path.join(root, "D01.idx"), "a") as f:
+                f.write("broken")
+            with CropShardWriter(root, "D01", max_shard_bytes=1024) as writer:
+                for i, name in enumerate(names[10:], 10):
+                    writer.write(name, encode(i))
+            self.assertGreater(len([f for f in os.listdir(root) if f.endswith(".bin")]), 1)
+
+            shards = ShardPathHandler.get_shards(os.path.abspath(root))
+            self.assertEqual(sorted(shards.names()), sorted(names))
+            for i, name in enumerate(names):
+                image = np.asarray(read_image(shard_path(root, name)))
+                self.assertTrue((image == i).all())
+
+    def test_refresh(self):
+        with tempfile.TemporaryDirectory() as root:
+            with CropShardWriter(root, "D01") as writer:
+                writer.write("0001_c01s01_0001_20211012080012.jpg", encode(1))
+                self.assertTrue(PathManager.exists(shard_path(root, "0001_c01s01_0001_20211012080012.jpg")))
+                # written after the index was loaded
+                writer.write("0002_c01s01_0002_20211012080012.jpg", encode(2))
+                self.assertTrue(PathManager.exists(shard_path(root, "0002_c01s01_0002_20211012080012.jpg")))
+                image = np.asarray(read_image(shard_path(root, "0002_c01s01_0002_20211012080012.jpg")))
+                self.assertTrue((image == 2).all())
+            self.assertFalse(PathManager.exists(shard_path(root, "0003_c01s01_0003_20211012080012.jpg")))
+
+    def test_prefixes(self):
+        with tempfile.TemporaryDirectory() as root:
+            with CropShardWriter(root, "D01", max_shard_bytes=1024) as writer:
+                for i in range(4):
+                    writer.write("%04d_c01s01_0001_20211012080012.jpg" % i, encode(i))
+            with CropShardWriter(root, "D01-day2", max_shard_bytes=1024) as writer:
+                for i in range(8):
+                    writer.write("%04d_c01s02_0001_20211012080012.jpg" % i, encode(i))
+            num_shards = len([f for f in os.listdir(root) if f.startswith("D01-0")])
+            # a reopened writer continues its own last data file
+            with CropShardWriter(root, "D01", max_shard_bytes=1024) as writer:
+                self.assertEqual(writer._shard_name, "D01-{:05d}.bin".format(num_shards - 1))
+
+    def test_dataset(self):
+        with tempfile.TemporaryDirectory() as root:
+            for split, cam in [("train", 1), ("query", 1), ("gallery", 2)]:
+                with CropShardWriter(os.path.join(root, split), "D0{}".format(cam)) as writer:
+                    for pid in [-1, 1, 2]:
+                        writer.write("%04d_c%02ds01_0001_20211012080012.jpg" % (pid, cam), encode(pid + 1))
+            data = CropShards(shard_dir=root, verbose=False)
+            self.assertEqual(len(data.train), 2)
+            self.assertEqual(data.train[0][1:], ("cropshards_1", "cropshards_0"))
+            self.assertEqual([item[1:] for item in data.gallery], [(1, 1), (2, 1)])
+            self.assertTrue(os.path.basename(data.query[0][0]).startswith("0001_c01"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import itertools
+import sys
+import unittest
+
+import torch
+from torch.utils.data import Dataset
+
+sys.path.append('.')
+from fastreid.data.build import fast_batch_collator
+from fastreid.data.data_utils import DataLoaderX
+from fastreid.data.samplers import InferenceSampler, TrainingSampler
+from fastreid.utils.events import EventStorage
+
+
+class _Dataset(Dataset):
+    def __init__(self, size, fail_at=None):
+        self.size = size
+        self.fail_at = fail_at
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index == self.fail_at:
+            raise RuntimeError("broken image")
+        return {"images": torch.full((3, 4, 2), index, dtype=torch.uint8), "targets": index}
+
+
+def _loader(dataset, sampler, batch_size=4, num_workers=0, prefetch_depth=2):
+    batch_sampler = torch.utils.data.BatchSampler(sampler, batch_size, False)
+    return DataLoaderX(0, prefetch_depth=prefetch_depth, use_cuda=False, dataset=dataset,
+                       batch_sampler=batch_sampler, num_workers=num_workers,
+                       collate_fn=fast_batch_collator, pin_memory=True)
+
+
+class DataLoaderXTestCase(unittest.TestCase):
+    def test_cpu_prefetch(self):
+        for num_workers in [0, 2]:
+            loader = _loader(_Dataset(10), InferenceSampler(10), num_workers=num_workers)
+            with EventStorage() as storage:
+                for _ in range(2):
+                    targets = torch.cat([batch["targets"] for batch in loader])
+                    self.assertEqual(targets.tolist(), list(range(10)))
+                self.assertIn("data_wait_time", storage.histories())
+            # counted again for every iteration, with the end of the data
+            self.assertEqual(loader.num_batches, 3 + 1)
+
+    def test_shutdown_and_errors(self):
+        loader = _loader(_Dataset(10), TrainingSampler(10))
+        batches = list(itertools.islice(iter(loader), 5))
+        self.assertEqual(len(batches), 5)
+        loader.shutdown()
+        self.assertFalse(loader.iter.is_alive())
+
+        loader = _loader(_Dataset(10, fail_at=6), InferenceSampler(10))
+        with self.assertRaises(RuntimeError):
+            list(loader)
+        loader.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
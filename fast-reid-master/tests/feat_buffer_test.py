@@ -0,0 +1,89 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+sys.path.append('.')
+from fastreid.config import get_cfg
+from fastreid.evaluation import ReidEvaluator
+from fastreid.utils import comm
+
+
+def _gather(rank, world_size, init_file, sizes, results):
+    dist.init_process_group("gloo", init_method="file://" + init_file, rank=rank, world_size=world_size)
+    for i, split in enumerate(sizes):
+        start = sum(split[:rank])
+        tensor = torch.arange(start, start + split[rank], dtype=torch.float32)[:, None].repeat(1, 3)
+        output = comm.gather_tensor(tensor, dst=0)
+        if rank == 0:
+            results[i] = output
+        else:
+            assert output is None
+    dist.destroy_process_group()
+
+
+class FeatBufferTestCase(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.feats = torch.randn(60, 16)
+        self.pids = torch.randint(0, 10, (60,))
+        self.camids = torch.randint(0, 3, (60,))
+
+    def run_evaluator(self, cfg, batch_size=8, reserve=None):
+        evaluator = ReidEvaluator(cfg, num_query=20)
+        evaluator.reset()
+        if reserve is not None:
+            evaluator.reserve(reserve)
+        for start in range(0, 60, batch_size):
+            end = start + batch_size
+            evaluator.process({"targets": self.pids[start:end], "camids": self.camids[start:end]},
+                              self.feats[start:end])
+        return evaluator
+
+    def test_buffer(self):
+        cfg = get_cfg()
+        # without a size hint the buffer grows
+        evaluator = self.run_evaluator(cfg)
+        self.assertEqual(evaluator._feats.dtype, torch.float32)
+        self.assertTrue(torch.equal(evaluator._feats[:60], self.feats))
+        self.assertTrue(torch.equal(evaluator._pids[:60], self.pids))
+        results = evaluator.evaluate()
+
+        evaluator = self.run_evaluator(cfg, reserve=64)
+        self.assertEqual(evaluator._feats.shape[0], 64)
+        self.assertEqual(evaluator.evaluate(), results)
+
+        cfg.TEST.FEAT_BUFFER.FP16 = True
+        with tempfile.TemporaryDirectory() as mmap_dir:
+            cfg.TEST.FEAT_BUFFER.MMAP_DIR = os.path.join(mmap_dir, "feats")
+            evaluator = self.run_evaluator(cfg, batch_size=7)
+            self.assertEqual(evaluator._feats.dtype, torch.float16)
+            self.assertIsNotNone(evaluator._mmap_file)
+            self.assertTrue(torch.equal(evaluator._feats[:60], self.feats.half()))
+            self.assertTrue(torch.equal(evaluator._camids[:60], self.camids))
+            fp16_results = evaluator.evaluate()
+            for key, value in results.items():
+                self.assertAlmostEqual(fp16_results[key], value, delta=1)
+
+            evaluator.reset()
+            self.assertIsNone(evaluator._mmap_file)
+            # the temporary files are unlinked
+            self.assertEqual(os.listdir(cfg.TEST.FEAT_BUFFER.MMAP_DIR), [])
+
+    def test_gather(self):
+        # InferenceSampler splits, and extra samples on the leading ranks
+        sizes = [[3, 3, 3, 1], [3, 3, 3, 0], [2, 2, 1, 0], [3, 3, 2, 2], [0, 2, 0, 1]]
+        with tempfile.TemporaryDirectory() as root:
+            results = mp.Manager().dict()
+            mp.spawn(_gather, args=(4, os.path.join(root, "init"), sizes, results), nprocs=4)
+            for i, split in enumerate(sizes):
+                expected = torch.arange(sum(split), dtype=torch.float32)[:, None].repeat(1, 3)
+                self.assertTrue(torch.equal(results[i], expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.append('.')
+sys.path.append('demo')
+from fastreid.config import get_cfg
+from feature_store import FeatureStore
+
+
+class FeatureStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.cfg = get_cfg()
+        self.paths = []
+        for i in range(1500):
+            path = os.path.join(self.root.name, "{}.jpg".format(i))
+            with open(path, "w") as f:
+                f.write(str(i))
+            self.paths.append(path)
+        self.feats = np.random.RandomState(0).rand(1500, 8).astype(np.float32)
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def test_reuse(self):
+        cache_dir = os.path.join(self.root.name, "cache")
+        store = FeatureStore(cache_dir, self.cfg)
+        self.assertTrue((store.lookup(self.paths) == -1).all())
+        store.put(self.paths[:1000], self.feats[:1000])
+        self.assertEqual(store._feats.shape, (1024, 8))
+        # grows geometrically, keeping the rows written so far
+        store.put(self.paths[1000:], self.feats[1000:])
+        self.assertEqual(store._feats.shape, (2048, 8))
+        store.flush()
+
+        store = FeatureStore(cache_dir, self.cfg)
+        rows = store.lookup(self.paths)
+        np.testing.assert_array_equal(rows, np.arange(1500))
+        np.testing.assert_array_equal(store.get(rows), self.feats)
+
+        # a touched image is the only one extracted again, into its old row
+        st = os.stat(self.paths[7])
+        os.utime(self.paths[7], ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        rows = store.lookup(self.paths)
+        self.assertEqual(np.flatnonzero(rows == -1).tolist(), [7])
+        store.put([self.paths[7]], np.ones((1, 8)))
+        store.flush()
+
+        store = FeatureStore(cache_dir, self.cfg)
+        rows = store.lookup(self.paths)
+        self.assertEqual((store.num_rows, rows[7]), (1500, 7))
+        np.testing.assert_array_equal(store.get(rows[[7]]), np.ones((1, 8)))
+        np.testing.assert_array_equal(store.get(rows[8:]), self.feats[8:])
+
+        # other model settings have their own cache
+        self.cfg.TEST.FLIP.ENABLED = True
+        self.assertTrue((FeatureStore(cache_dir, self.cfg).lookup(self.paths) == -1).all())
+        self.assertTrue((FeatureStore(cache_dir, get_cfg(), tag="crop").lookup(self.paths) == -1).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
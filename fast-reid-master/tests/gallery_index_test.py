@@ -0,0 +1,91 @@
+import argparse
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+sys.path.append('.')
+sys.path.append('demo')
+from fastreid.config import get_cfg
+from fastreid.utils.faiss_utils import GalleryIndex, evaluate_recall
+from visualize_result import search_gallery_index
+
+
+class GalleryIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.g_feat = torch.randn(2000, 32)
+        self.q_feat = torch.randn(50, 32)
+        self.g_pids = np.arange(2000) % 100
+        self.g_camids = np.arange(2000) % 4
+        self.g_paths = ["{}.jpg".format(i) for i in range(2000)]
+
+    def exact_topk(self, k):
+        sims = torch.mm(torch.nn.functional.normalize(self.q_feat), torch.nn.functional.normalize(self.g_feat).t())
+        return sims.topk(k, dim=1)[1].numpy()
+
+    def test_recall(self):
+        for index_type, min_recall in [("flat", 1.), ("hnsw", 0.95), ("ivfpq", 0.3)]:
+            index = GalleryIndex(32, index_type, nlist=16, pq_m=4, nprobe=16)
+            index.add(self.g_feat, self.g_pids, self.g_camids, self.g_paths)
+            self.assertGreaterEqual(evaluate_recall(index, self.g_feat, self.q_feat, k=10)["recall"], min_recall)
+
+        index = GalleryIndex(32)
+        index.add(self.g_feat, self.g_pids, self.g_camids)
+        q_camids = np.zeros(50, dtype=np.int64)
+        indices, dists = index.search(self.q_feat, 10, q_camids=q_camids, exclude_same_camera=True)
+        self.assertTrue((self.g_camids[indices] != 0).all())
+        self.assertTrue((np.diff(dists, axis=1) >= 0).all())
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as root:
+            index = GalleryIndex(32, "hnsw", ef_search=64, model_key="weights")
+            index.add(self.g_feat, self.g_pids, self.g_camids, self.g_paths)
+            index.save(os.path.join(root, "gallery.npz"))
+            loaded = GalleryIndex.load(os.path.join(root, "gallery.npz"))
+            self.assertEqual((loaded.index_type, loaded.ef_search, loaded.model_key), ("hnsw", 64, "weights"))
+            self.assertEqual(list(loaded.paths), self.g_paths)
+            np.testing.assert_array_equal(loaded.pids, self.g_pids)
+            for expected, result in zip(index.search(self.q_feat, 10), loaded.search(self.q_feat, 10)):
+                np.testing.assert_array_equal(result, expected)
+
+    def test_search_gallery_index(self):
+        cfg = get_cfg()
+        cfg.TEST.ANN.TYPE = "ivfpq"
+        cfg.TEST.ANN.NLIST = 64
+        cfg.TEST.ANN.PQ_M = 4
+        # a single probed cell can not hold the top 100 of every query
+        cfg.TEST.ANN.NPROBE = 1
+        with tempfile.TemporaryDirectory() as root:
+            args = argparse.Namespace(ann_index=os.path.join(root, "gallery.npz"), ann_topk=100, ann_recall=False)
+            indices, dists = search_gallery_index(cfg, args, self.q_feat, self.g_feat, self.g_pids,
+                                                  self.g_camids, self.g_paths)
+            self.assertEqual(indices.shape, (50, 100))
+            self.assertTrue((indices >= 0).all() and np.isfinite(dists).all())
+            # the short rows are searched exactly
+            exact = self.exact_topk(100)
+            index = GalleryIndex.load(args.ann_index)
+            short, _ = index.search(self.q_feat, 100, mask=np.ones(len(index), dtype=bool))
+            short = (short < 0).any(axis=1)
+            self.assertTrue(short.any())
+            np.testing.assert_array_equal(indices[short], exact[short])
+
+            # the index only holds the gallery once, and is rebuilt for other model weights
+            model_key = index.model_key
+            search_gallery_index(cfg, args, self.q_feat, self.g_feat, self.g_pids, self.g_camids, self.g_paths)
+            self.assertEqual(len(GalleryIndex.load(args.ann_index)), 2000)
+            cfg.TEST.ANN.TYPE = "flat"
+            cfg.TEST.FLIP.ENABLED = True
+            indices, _ = search_gallery_index(cfg, args, self.q_feat, self.g_feat.flip(0),
+                                              self.g_pids, self.g_camids, self.g_paths)
+            index = GalleryIndex.load(args.ann_index)
+            self.assertNotEqual(index.model_key, model_key)
+            self.assertEqual((index.index_type, len(index)), ("flat", 2000))
+            np.testing.assert_array_equal(indices[:, 0], 1999 - self.exact_topk(1)[:, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
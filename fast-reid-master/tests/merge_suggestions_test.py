@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import openpyxl
+import torch
+
+sys.path.append('.')
+sys.path.append('demo')
+sys.path.append('..')
+from merge import load_merge_sheet
+from merge_suggestions import aggregate_tracks, load_crops, save_merge_sheet, suggest_merges
+
+
+class MergeSuggestionsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        # camera 1 ids 1, 2, 3 are camera 2 ids 7, 5, 9 (shifted by one hour), camera 3 is dropped
+        self.same = {(1, 1): (2, 7), (1, 2): (2, 5), (1, 3): (2, 9)}
+        rng = np.random.RandomState(0)
+        identities = {key: rng.randn(16) for key in self.same}
+        identities.update({other: identities[key] for key, other in self.same.items()})
+        identities[(3, 4)] = rng.randn(16)
+        self.identity_feats = []
+        for (cam, pid), feat in sorted(identities.items()):
+            for frame in range(3):
+                hour = 8 + (cam == 2)
+                name = "%04d_c%02ds01_%04d_20211012%02d00%02d.jpg" % (pid, cam, frame, hour, frame)
+                os.makedirs(os.path.join(self.root.name, str(cam)), exist_ok=True)
+                open(os.path.join(self.root.name, str(cam), name), "w").close()
+                self.identity_feats.append((name, feat + 0.1 * rng.randn(16)))
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def load(self, cam_ids):
+        paths, columns, pids, times, cam_ids = load_crops(self.root.name, cam_ids)
+        feats_of = dict(self.identity_feats)
+        feats = torch.tensor(np.stack([feats_of[os.path.basename(path)] for path in paths]), dtype=torch.float32)
+        return aggregate_tracks(feats, torch.ones(len(paths)), columns, pids, times), cam_ids
+
+    def test_sheet(self):
+        tracks, cam_ids = self.load([[1], [2]])
+        self.assertEqual(len(tracks["pids"]), 6)
+        self.assertEqual(tracks["num_crops"].tolist(), [3] * 6)
+
+        merges = suggest_merges(tracks, threshold=0.5, topk=2, max_gap=-1)
+        self.assertEqual(len(merges), 3)
+        self.assertTrue(all(score > 0.9 for score, _, _ in merges))
+        # one hour apart
+        self.assertEqual(suggest_merges(tracks, threshold=0.5, max_gap=600), [])
+
+        path = os.path.join(self.root.name, "merge_suggestions.xlsx")
+        save_merge_sheet(path, merges, tracks, cam_ids)
+        rows = load_merge_sheet(path, len(cam_ids))
+        self.assertEqual(sorted(rows), sorted([[(0, pid), (1, other)] for (_, pid), (_, other) in self.same.items()]))
+        wb = openpyxl.load_workbook(path, read_only=True)
+        self.assertEqual(len(list(wb["candidates"].iter_rows())), 4)
+        wb.close()
+
+        # cameras 1 and 3 share a column, their tracks are never merged with each other
+        tracks, cam_ids = self.load([[1, 3], [2]])
+        self.assertEqual(len(tracks["pids"]), 7)
+        self.assertEqual(len(suggest_merges(tracks, threshold=0.5, topk=2, max_gap=-1)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import sys
+import unittest
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+sys.path.append('.')
+from fastreid.evaluation.query_expansion import aqe
+
+
+def dense_aqe(query_feat, gallery_feat, qe_times=1, qe_k=10, alpha=3.0):
+    # the full similarity matrix version aqe replaced
+    num_query = query_feat.shape[0]
+    all_feat = torch.cat((query_feat, gallery_feat), dim=0)
+    norm_feat = F.normalize(all_feat, p=2, dim=1)
+
+    all_feat = all_feat.numpy()
+    for i in range(qe_times):
+        all_feat_list = []
+        sims = torch.mm(norm_feat, norm_feat.t()).numpy()
+        for sim in sims:
+            init_rank = np.argpartition(-sim, range(1, qe_k + 1))
+            weights = sim[init_rank[:qe_k]].reshape((-1, 1))
+            weights = np.power(weights, alpha)
+            all_feat_list.append(np.mean(all_feat[init_rank[:qe_k], :] * weights, axis=0))
+        all_feat = np.stack(all_feat_list, axis=0)
+        norm_feat = F.normalize(torch.from_numpy(all_feat), p=2, dim=1)
+
+    return torch.from_numpy(all_feat[:num_query]), torch.from_numpy(all_feat[num_query:])
+
+
+class QueryExpansionTestCase(unittest.TestCase):
+    def test_matches_dense(self):
+        torch.manual_seed(0)
+        query_feat = torch.randn(40, 32)
+        gallery_feat = torch.randn(260, 32)
+        for qe_times, qe_k in [(1, 1), (1, 5), (2, 10), (3, 7)]:
+            query, gallery = aqe(query_feat, gallery_feat, qe_times, qe_k, alpha=3.0, block_size=64)
+            expected_query, expected_gallery = dense_aqe(query_feat, gallery_feat, qe_times, qe_k, alpha=3.0)
+            np.testing.assert_allclose(query.numpy(), expected_query.numpy(), rtol=1e-5, atol=1e-6)
+            np.testing.assert_allclose(gallery.numpy(), expected_gallery.numpy(), rtol=1e-5, atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append('.')
+from fastreid.evaluation.rank import IS_CYTHON_AVAI, eval_market1501_vectorized, eval_market1501_topk
+
+if IS_CYTHON_AVAI:
+    from fastreid.evaluation.rank_cylib.rank_cy import evaluate_cy
+
+
+class RankTestCase(unittest.TestCase):
+    def test_vectorized_matches_full_ranking(self):
+        rng = np.random.RandomState(0)
+        distmat = rng.rand(40, 300).astype(np.float32)
+        q_pids = rng.randint(0, 30, size=40)
+        g_pids = rng.randint(0, 30, size=300)
+        q_camids = rng.randint(0, 4, size=40)
+        g_camids = rng.randint(0, 4, size=300)
+
+        cmc, all_AP, all_INP = eval_market1501_vectorized(
+            distmat, q_pids, g_pids, q_camids, g_camids, max_rank=10, block_size=16)
+        indices = np.argsort(distmat, axis=1)
+        cmc_ref, all_AP_ref, all_INP_ref = eval_market1501_topk(
+            indices, q_pids, g_pids, q_camids, g_camids, max_rank=10)
+
+        np.testing.assert_allclose(cmc, cmc_ref, rtol=1e-5)
+        np.testing.assert_allclose(all_AP, all_AP_ref, rtol=1e-5)
+        np.testing.assert_allclose(all_INP, all_INP_ref, rtol=1e-5)
+
+    @unittest.skipUnless(IS_CYTHON_AVAI, "rank_cy is not compiled")
+    def test_vectorized_matches_cython(self):
+        rng = np.random.RandomState(1)
+        distmat = rng.rand(60, 200).astype(np.float32)
+        q_pids = rng.randint(0, 10, size=60)
+        g_pids = rng.randint(0, 10, size=200)
+        # few cameras, so the leading gallery samples of many queries are filtered out
+        q_camids = rng.randint(0, 2, size=60)
+        g_camids = rng.randint(0, 2, size=200)
+        order = np.argsort(distmat, axis=1)
+        self.assertTrue(np.any((g_pids[order[:, 0]] == q_pids) & (g_camids[order[:, 0]] == q_camids)))
+
+        with np.errstate(divide='raise', invalid='raise'):
+            cmc, all_AP, all_INP = eval_market1501_vectorized(
+                distmat, q_pids, g_pids, q_camids, g_camids, max_rank=10, block_size=16)
+        cmc_cy, all_AP_cy, all_INP_cy = evaluate_cy(distmat, q_pids, g_pids, q_camids, g_camids, 10, False)
+
+        np.testing.assert_allclose(cmc, cmc_cy, rtol=1e-5)
+        np.testing.assert_allclose(all_AP, all_AP_cy, rtol=1e-5)
+        np.testing.assert_allclose(all_INP, all_INP_cy, rtol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from sklearn import metrics
+
+sys.path.append('.')
+from fastreid.evaluation.roc import RocAccumulator, evaluate_roc, finite_range
+
+
+def _all_reduce(rank, world_size, init_file, distmat, q_pids, g_pids, q_camids, g_camids, results):
+    dist.init_process_group("gloo", init_method="file://" + init_file, rank=rank, world_size=world_size)
+    # every rank evaluates its own block of queries
+    block = slice(rank * len(q_pids) // world_size, (rank + 1) * len(q_pids) // world_size)
+    roc = RocAccumulator(20000, finite_range(distmat)).update(
+        distmat[block], q_pids[block], g_pids, q_camids[block], g_camids).all_reduce()
+    results[rank] = (roc.pos_hist, roc.neg_hist)
+    dist.destroy_process_group()
+
+
+class RocTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.q_pids = rng.randint(0, 100, 200)
+        self.g_pids = rng.randint(0, 100, 2000)
+        self.q_camids = rng.randint(0, 4, 200)
+        self.g_camids = rng.randint(0, 4, 2000)
+        matches = self.q_pids[:, np.newaxis] == self.g_pids
+        self.distmat = np.where(matches, rng.normal(0.6, 0.2, matches.shape),
+                                rng.normal(1.1, 0.2, matches.shape)).astype(np.float32)
+
+    def assertMatchesSklearn(self, roc, distmat):
+        scores, labels = evaluate_roc(distmat, self.q_pids, self.g_pids, self.q_camids, self.g_camids)
+        finite = np.isfinite(scores)
+        expected_fpr, expected_tpr, expected_thresholds = metrics.roc_curve(
+            labels[finite], scores[finite], drop_intermediate=False)
+        fpr, tpr, thresholds = roc.roc_curve()
+        # every bin edge is the point of sklearn at the smallest distance above it
+        index = np.searchsorted(-expected_thresholds, -thresholds, side='right') - 1
+        np.testing.assert_allclose(fpr, expected_fpr[index], atol=4e-5)
+        np.testing.assert_allclose(tpr, expected_tpr[index], atol=4e-5)
+
+        # up to the bin width
+        fprs = [1e-3, 1e-2, 1e-1]
+        expected = [expected_tpr[np.argmin(np.abs(expected_fpr - x))] for x in fprs]
+        np.testing.assert_allclose(roc.tpr_at_fpr(fprs), expected, atol=5e-4)
+
+    def test_sklearn(self):
+        roc = RocAccumulator(20000, finite_range(self.distmat), block_size=64)
+        roc.update(self.distmat, self.q_pids, self.g_pids, self.q_camids, self.g_camids)
+        self.assertMatchesSklearn(roc, self.distmat)
+        self.assertEqual(roc.pos_hist.sum() + roc.neg_hist.sum(),
+                         len(evaluate_roc(self.distmat, self.q_pids, self.g_pids, self.q_camids, self.g_camids)[0]))
+
+        # merged per block of queries, as evaluated by several processes
+        merged = RocAccumulator(20000, finite_range(self.distmat))
+        for start in range(0, 200, 50):
+            end = start + 50
+            merged.merge(RocAccumulator(20000, finite_range(self.distmat)).update(
+                self.distmat[start:end], self.q_pids[start:end], self.g_pids,
+                self.q_camids[start:end], self.g_camids))
+        np.testing.assert_array_equal(merged.pos_hist, roc.pos_hist)
+        np.testing.assert_array_equal(merged.neg_hist, roc.neg_hist)
+
+    def test_all_reduce(self):
+        roc = RocAccumulator(20000, finite_range(self.distmat)).update(
+            self.distmat, self.q_pids, self.g_pids, self.q_camids, self.g_camids)
+        with tempfile.TemporaryDirectory() as root:
+            results = mp.Manager().dict()
+            mp.spawn(_all_reduce, args=(3, os.path.join(root, "init"), self.distmat, self.q_pids, self.g_pids,
+                                        self.q_camids, self.g_camids, results), nprocs=3)
+            for rank in range(3):
+                np.testing.assert_array_equal(results[rank][0], roc.pos_hist)
+                np.testing.assert_array_equal(results[rank][1], roc.neg_hist)
+
+    def test_non_finite(self):
+        distmat = self.distmat.copy()
+        rng = np.random.RandomState(1)
+        distmat[rng.rand(*distmat.shape) < 0.01] = np.inf
+        distmat[rng.rand(*distmat.shape) < 0.01] = np.nan
+        score_range = finite_range(distmat)
+        self.assertTrue(np.isfinite(score_range).all())
+
+        roc = RocAccumulator(20000, score_range).update(
+            distmat, self.q_pids, self.g_pids, self.q_camids, self.g_camids)
+        self.assertMatchesSklearn(roc, distmat)
+        self.assertEqual(roc.pos_hist.sum() + roc.neg_hist.sum(),
+                         (np.isfinite(self.distmat) & np.isfinite(distmat)).sum() -
+                         ((self.q_pids[:, np.newaxis] == self.g_pids) &
+                          (self.q_camids[:, np.newaxis] == self.g_camids) & np.isfinite(distmat)).sum())
+
+        # top-k results padded with inf
+        indices = np.argsort(self.distmat, axis=1)[:, :50]
+        distances = np.take_along_axis(self.distmat, indices, axis=1)
+        distances[:, 40:] = np.inf
+        roc = RocAccumulator(20000, finite_range(distances)).update(
+            (indices, distances), self.q_pids, self.g_pids, self.q_camids, self.g_camids)
+        self.assertMatchesSklearn(roc, (indices, distances))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.append('.')
+from fastreid.config import get_cfg
+from fastreid.data.build import fast_batch_collator
+from fastreid.data.common import CachedCommDataset, CommDataset
+from fastreid.data.transforms import build_transforms
+
+
+class TestCacheTestCase(unittest.TestCase):
+    def test_cache(self):
+        cfg = get_cfg()
+        cfg.INPUT.SIZE_TEST = [64, 32]
+        with tempfile.TemporaryDirectory() as root:
+            items = []
+            for i in range(6):
+                path = os.path.join(root, "%04d_c1s1_000001_00.jpg" % i)
+                Image.fromarray(np.random.randint(0, 255, (90 + i, 40, 3), dtype=np.uint8)).save(path)
+                items.append((path, i, 1))
+            transforms = build_transforms(cfg, is_train=False)
+            expected = [item["images"] for item in CommDataset(items, transforms, relabel=False)]
+
+            cache_dir = os.path.join(root, "cache")
+            cached = CachedCommDataset(items, transforms, cache_dir, "data")
+            loader = torch.utils.data.DataLoader(cached, batch_size=2, num_workers=2, collate_fn=fast_batch_collator)
+            self.assertTrue(torch.equal(torch.cat([batch["images"] for batch in loader]), torch.stack(expected)))
+            self.assertTrue(np.load(cached.filled_file).all())
+
+            # served from the cache by a new dataset, e.g. at the next evaluation
+            Image.fromarray(np.zeros((90, 40, 3), dtype=np.uint8)).save(items[1][0])
+            again = CachedCommDataset(items, transforms, cache_dir, "data")
+            self.assertEqual(again.cache_file, cached.cache_file)
+            self.assertTrue(torch.equal(again[1]["images"], expected[1]))
+
+            # another test size is a new cache
+            cfg.INPUT.SIZE_TEST = [32, 16]
+            other = CachedCommDataset(items[1:], build_transforms(cfg, is_train=False), cache_dir, "data")
+            self.assertNotEqual(other.cache_file, cached.cache_file)
+            self.assertEqual(sorted(os.listdir(cache_dir)),
+                             sorted(os.path.basename(f) for f in [other.cache_file, other.filled_file]))
+            self.assertEqual(other[0]["images"].shape, (3, 32, 16))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import sys
+import types
+import unittest
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.append('.')
+from fastreid.config import get_cfg
+from fastreid.data.build import fast_batch_collator
+from fastreid.data.transforms import build_transforms
+from fastreid.modeling.meta_arch.baseline import Baseline
+
+
+class Uint8InputTestCase(unittest.TestCase):
+    def test_same_model_input(self):
+        cfg = get_cfg()
+        images = [Image.fromarray(np.random.randint(0, 255, (300, 120, 3), dtype=np.uint8)) for _ in range(3)]
+        model = types.SimpleNamespace(pixel_mean=torch.tensor(cfg.MODEL.PIXEL_MEAN).view(1, -1, 1, 1),
+                                      pixel_std=torch.tensor(cfg.MODEL.PIXEL_STD).view(1, -1, 1, 1))
+        batches = []
+        for uint8 in [False, True]:
+            cfg.INPUT.UINT8 = uint8
+            transforms = build_transforms(cfg, is_train=False)
+            batch = fast_batch_collator([{"images": transforms(img)} for img in images])
+            self.assertEqual(batch["images"].dtype, torch.uint8 if uint8 else torch.float32)
+            batches.append(Baseline.preprocess_image(model, batch))
+        self.assertEqual(batches[1].dtype, torch.float32)
+        self.assertTrue(torch.allclose(batches[0], batches[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
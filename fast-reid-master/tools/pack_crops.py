@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Pack a folder of crop jpgs into a shard directory, e.g.
+
+    python tools/pack_crops.py --input D1D2/1 --output shards/train
+    python tools/pack_crops.py --input D1D2/D01_20211012 --output shards/query
+    python tools/pack_crops.py --input D1D2/D02_20211012 --output shards/gallery
+
+then use "shards" as a dataset name, see fastreid.data.datasets.CropShards.
+"""
+
+import argparse
+import glob
+import os
+import sys
+
+import tqdm
+
+sys.path.append('.')
+
+from fastreid.utils.crop_shards import CropShards, CropShardWriter, is_shard_dir
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Pack crop folders into a shard directory")
+    parser.add_argument("--input", nargs="+", required=True, help="crop folders, searched recursively")
+    parser.add_argument("--output", required=True, help="shard directory")
+    parser.add_argument("--prefix", default=None, help="shard file prefix, the name of the first input by default")
+    parser.add_argument("--max-shard-size", default=1024, type=int, help="maximum size of a data file in MB")
+    parser.add_argument("--ext", default="jpg", help="image extension")
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    prefix = args.prefix or os.path.basename(os.path.normpath(args.input[0]))
+
+    paths = []
+    for input_dir in args.input:
+        paths += sorted(glob.glob(os.path.join(input_dir, "**", "*.{}".format(args.ext)), recursive=True))
+    # crops are keyed by file name, already packed ones are skipped so the tool can be run again
+    existing = CropShards(args.output) if is_shard_dir(args.output) else {}
+    names = {}
+    for path in paths:
+        name = os.path.basename(path)
+        if name in names:
+            print("Duplicate crop name {}, keeping {}".format(name, names[name]))
+        elif name not in existing:
+            names[name] = path
+    print("Packing {} of {} crops into {}".format(len(names), len(paths), args.output))
+
+    with CropShardWriter(args.output, prefix, max_shard_bytes=args.max_shard_size << 20) as writer:
+        for name, path in tqdm.tqdm(names.items()):
+            with open(path, "rb") as f:
+                writer.write(name, f.read())
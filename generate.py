@@ -0,0 +1,282 @@
+"""
+Crop the pedestrians tracked by FairMOT out of the source video and write the excel of every id,
+like generate.ipynb. The frames that need a crop are planned from output.txt first, so the
+other frames are skipped with grab() instead of being converted, and the jpgs are encoded
+by a writer pool. Seeking is opt-in with --seek_threshold: CAP_PROP_POS_FRAMES is not
+frame-exact on most H.264 videos, so a seek can land a few frames off while the crops keep
+the names of the planned frames. With it, long gaps are seeked over and the video is split
+into --num_workers segments decoded in parallel.
+
+    python generate.py --output_txt output/20211012/D02_20211012075959/mot_results/D02_20211012075959.txt \
+        --video /home/swjtu/dataset/20211012/D02_20211012075959.mp4 \
+        --save_crops output/20211012/D02_20211012075959/crops \
+        --save_excel output/20211012/D02_20211012075959/D02_20211012075959.xlsx \
+        --camera_id 2 --seq_id 1 --start_time 20211012080011
+
+With --track_db the tracks are added to a track_store.py database, the excel is exported from them.
+With --shard_dir the crops are appended to a shard directory of fast-reid-master
+(fastreid/utils/crop_shards.py) instead of being written as separate files.
+"""
+
+import argparse
+import datetime
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+from tqdm import tqdm
+
+from track_store import TrackStore, export_xlsx, tracks_from_output
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Crop pedestrians from a video with the FairMOT output")
+    parser.add_argument("--output_txt", required=True, help="FairMOT output.txt (mot_results/{video}.txt)")
+    parser.add_argument("--video", required=True, help="source video")
+    parser.add_argument("--save_crops", default=None, help="directory of the crops")
+    parser.add_argument("--shard_dir", default=None,
+                        help="shard directory to append the crops to, instead of --save_crops")
+    parser.add_argument("--save_excel", default=None, help="excel of the ids, not written if empty")
+    parser.add_argument("--track_db", default=None, help="track_store.py database to add the tracks to")
+    parser.add_argument("--camera_id", type=int, default=1, help="camera id of the source video")
+    parser.add_argument("--seq_id", type=int, default=1,
+                        help="segment id of the source video (from 1, in ascending file name order)")
+    parser.add_argument("--start_time", required=True, help="real start time of the video, e.g. 20211012080011")
+    parser.add_argument("--video_frame_rate", type=float, default=25.01, help="frame rate of the source video")
+    parser.add_argument("--detection_frame_rate", type=float, default=25.01, help="frame rate of the MOT output")
+    parser.add_argument("--crop_frame_interval", type=int, default=10,
+                        help="minimum number of frames between two crops of the same id")
+    parser.add_argument("--ignore_pids", type=int, nargs="*", default=[], help="ids to ignore")
+    parser.add_argument("--min_threshold", type=float, default=-1, help="minimum score, -1 to disable")
+    parser.add_argument("--min_box_area", type=float, default=20000, help="minimum box area, -1 to disable")
+    parser.add_argument("--num_workers", type=int, default=4,
+                        help="number of video segments decoded in parallel, only with --seek_threshold")
+    parser.add_argument("--num_writers", type=int, default=4, help="number of threads encoding the jpgs")
+    parser.add_argument("--seek_threshold", type=int, default=-1,
+                        help="seek instead of grabbing the frames over gaps longer than this, -1 to never seek. "
+                             "Only frame-exact on videos whose seeking is (e.g. intra-only)")
+    return parser
+
+
+def load_mot_output(output_txt_path, ignore_pids=(), min_threshold=-1, min_box_area=20000):
+    """
+    Returns:
+        list: [frame, pid, x, y, w, h, threshold] of the boxes kept, sorted by frame.
+    """
+    output = []
+    with open(output_txt_path, 'r') as f:
+        for line in f.readlines():
+            frame, pid, x, y, w, h, threshold = line.split(',')[:7]
+            frame, pid, x, y, w, h, threshold = int(frame), int(pid), float(x), float(y), float(w), float(h), float(threshold)
+            if pid in ignore_pids or (min_box_area != -1 and w * h < min_box_area) or \
+                    (min_threshold != -1 and threshold < min_threshold):
+                continue
+            output.append([frame, pid, x, y, w, h, threshold])
+    # the MOT output is written frame by frame, this only guards against edited files
+    output.sort(key=lambda row: row[0])
+    return output
+
+
+def plan_crops(output, crop_frame_interval=10, camera_id=1, seq_id=1, start_time="20211012080011",
+               video_frame_rate=25.01, detection_frame_rate=25.01):
+    """
+    Pick the boxes to crop: an id is cropped again only `crop_frame_interval` frames after its last crop.
+    Returns:
+        OrderedDict: frame (from 1, as in output.txt) -> list of (file name, (y0, y1, x0, x1)),
+            only for the frames that have something to crop.
+    """
+    frame_ratio = video_frame_rate / detection_frame_rate
+    start_time = datetime.datetime.strptime(start_time, "%Y%m%d%H%M%S")
+    last_crop_frame = {}
+    plan = OrderedDict()
+    for frame, pid, x, y, w, h, threshold in output:
+        if frame - last_crop_frame.get(pid, -crop_frame_interval) < crop_frame_interval:
+            continue
+        last_crop_frame[pid] = frame
+        if x * y * w * h <= 0:
+            continue
+        # date time of the frame
+        time = start_time + datetime.timedelta(seconds=round(frame / detection_frame_rate))
+        file_name = "%04d_c%02ds%02d_%04d_%s.jpg" % (pid, camera_id, seq_id, round(frame * frame_ratio),
+                                                     time.strftime("%Y%m%d%H%M%S"))
+        box = (round(y), round(y + h), round(x), round(x + w))
+        plan.setdefault(frame, []).append((file_name, box))
+    return plan
+
+
+def split_segments(frames, num_segments):
+    """Split the sorted frames into contiguous segments with about the same number of frames each."""
+    num_segments = max(1, min(num_segments, len(frames)))
+    size, rest = divmod(len(frames), num_segments)
+    segments, start = [], 0
+    for i in range(num_segments):
+        end = start + size + (i < rest)
+        segments.append(frames[start:end])
+        start = end
+    return [segment for segment in segments if segment]
+
+
+class CropWriter(object):
+    """
+    Encode and write the crops in a thread pool. At most `max_pending` crops wait to be written,
+    so decoding cannot run ahead and fill the memory. With a `shard_writer` the encoded crops are
+    appended to its shards instead of being written to `save_dir`.
+    """
+
+    def __init__(self, save_dir, num_writers=4, max_pending=256, shard_writer=None):
+        self.save_dir = save_dir
+        self.shard_writer = shard_writer
+        self.pool = ThreadPoolExecutor(max_workers=max(num_writers, 1))
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.num_written = 0
+        self.errors = []
+
+    def put(self, file_name, crop):
+        self._slots.acquire()
+        future = self.pool.submit(self._write, file_name, crop)
+        future.add_done_callback(lambda f, file_name=file_name: self._done(f, file_name))
+
+    def _write(self, file_name, crop):
+        if self.shard_writer is None:
+            return cv2.imwrite(os.path.join(self.save_dir, file_name), crop)
+        ret, buf = cv2.imencode('.jpg', crop)
+        if ret:
+            self.shard_writer.write(file_name, buf.tobytes())
+        return ret
+
+    def _done(self, future, file_name):
+        with self._lock:
+            if future.exception() is None and future.result():
+                self.num_written += 1
+            else:
+                self.errors.append(file_name)
+        self._slots.release()
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+def _seek(cap, frame_idx):
+    # False on streams that cannot seek at all; True does not mean the position is frame-exact
+    return cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx) and int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == frame_idx
+
+
+def extract_segment(video_path, frames, plan, writer, seek_threshold=-1, pbar=None):
+    """
+    Decode only the `frames` of the video and hand their crops to the writer. The other frames
+    are grabbed from the start of the video, so positions are exact, unless `seek_threshold`
+    is not negative and a gap (or the start of the segment) is longer than it.
+    Returns:
+        int: number of frames decoded.
+    """
+    cap = cv2.VideoCapture(video_path)
+    # position of the next frame read, from 0 while the frames of output.txt start at 1
+    pos = 0
+    num_decoded = 0
+    try:
+        for frame in frames:
+            target = frame - 1
+            if 0 <= seek_threshold < target - pos:
+                if _seek(cap, target):
+                    pos = target
+                else:
+                    # not seekable, read from the start again
+                    cap.release()
+                    cap = cv2.VideoCapture(video_path)
+                    pos = 0
+            while pos < target:
+                if not cap.grab():
+                    return num_decoded
+                pos += 1
+            ret, img = cap.read()
+            if not ret or img is None:
+                return num_decoded
+            pos += 1
+            num_decoded += 1
+            img_h, img_w = img.shape[:2]
+            for file_name, (y0, y1, x0, x1) in plan[frame]:
+                # boxes partly outside the frame are clipped to it, empty crops are skipped
+                y0, x0 = max(y0, 0), max(x0, 0)
+                y1, x1 = min(y1, img_h), min(x1, img_w)
+                if y1 <= y0 or x1 <= x0:
+                    continue
+                # copy so the frame is freed without waiting for the writer
+                writer.put(file_name, img[y0:y1, x0:x1].copy())
+            if pbar is not None:
+                pbar.update(1)
+    finally:
+        cap.release()
+    return num_decoded
+
+
+def extract_crops(video_path, plan, save_dir, num_workers=4, num_writers=4, seek_threshold=-1,
+                  shard_writer=None):
+    """
+    Write the crops planned by plan_crops(), to `save_dir` or to `shard_writer`. With seeking
+    (`seek_threshold` >= 0) the video is split into `num_workers` segments that are decoded in
+    parallel, each with its own capture; without it, it is read once from the start.
+    Returns:
+        int: number of crops written.
+    """
+    if shard_writer is None and not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    frames = list(plan.keys())
+    if seek_threshold < 0:
+        # every segment would have to grab the video from its start
+        num_workers = 1
+    else:
+        print("Seeking over gaps longer than {} frames, crops may be cut a few frames off "
+              "the planned ones if the video does not seek exactly".format(seek_threshold))
+    writer = CropWriter(save_dir, num_writers, shard_writer=shard_writer)
+    with tqdm(total=len(frames), desc='Processing') as pbar:
+        with ThreadPoolExecutor(max_workers=max(num_workers, 1)) as pool:
+            jobs = [pool.submit(extract_segment, video_path, segment, plan, writer, seek_threshold, pbar)
+                    for segment in split_segments(frames, num_workers)]
+            num_decoded = sum(job.result() for job in jobs)
+    writer.close()
+    if num_decoded < len(frames):
+        print("The video ends before {} of the planned frames".format(len(frames) - num_decoded))
+    if writer.errors:
+        print("Failed to write {} crops, e.g. {}".format(len(writer.errors), writer.errors[0]))
+    return writer.num_written
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    output = load_mot_output(args.output_txt, args.ignore_pids, args.min_threshold, args.min_box_area)
+    print("{} boxes".format(len(output)))
+
+    plan = plan_crops(output, args.crop_frame_interval, args.camera_id, args.seq_id, args.start_time,
+                      args.video_frame_rate, args.detection_frame_rate)
+    assert args.save_crops or args.shard_dir, "Set --save_crops or --shard_dir"
+    shard_writer = None
+    if args.shard_dir:
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fast-reid-master'))
+        from fastreid.utils.crop_shards import CropShardWriter
+        # one shard prefix per video, so several videos can be packed at once
+        shard_writer = CropShardWriter(args.shard_dir, os.path.splitext(os.path.basename(args.video))[0])
+    num_written = extract_crops(args.video, plan, args.save_crops, args.num_workers, args.num_writers,
+                                args.seek_threshold, shard_writer)
+    if shard_writer is not None:
+        shard_writer.close()
+    print("{} crops saved in {}".format(num_written, args.shard_dir or args.save_crops))
+
+    crop_counts = {}
+    for crops in plan.values():
+        for file_name, box in crops:
+            pid = int(file_name.split('_')[0])
+            crop_counts[pid] = crop_counts.get(pid, 0) + 1
+    tracks = tracks_from_output(output, args.camera_id, args.seq_id, args.start_time, args.detection_frame_rate,
+                                crop_counts=crop_counts, video=args.video)
+    if args.track_db:
+        store = TrackStore(args.track_db)
+        store.add(tracks)
+        store.close()
+        print("{} tracks added to {}".format(len(tracks), args.track_db))
+    if args.save_excel:
+        export_xlsx(args.save_excel, tracks)
+        print("Excel saved in {}".format(args.save_excel))
@@ -0,0 +1,320 @@
+# Copyright (c) 2021 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Track many videos with a pool of worker processes, each loading the model once.
+Copy it to PaddleDetection/tools/ next to infer_mot.py, e.g.
+
+    python tools/infer_mot_batch.py -c configs/mot/fairmot/fairmot_dla34_30e_1088x608.yml \
+        --video_dir=/home/swjtu/dataset/20211012 --output_root=output --num_workers=4 --gpus=0,1 \
+        --save_videos --draw_threshold 0.5 --frame_rate 25
+
+Every video is written to <output_root>/<seq>/ like run.sh does. The status of every video is
+kept in a ledger (<output_root>/ledger.json by default), so an interrupted run can simply be
+started again: videos whose mot_results/<seq>.txt is complete are skipped.
+
+With --save_crops, the crops of generate.ipynb are cut while tracking into <output_root>/<seq>/crops/,
+so the video is not decoded a second time. Camera id and start time are read from file names like
+D01_20211012122308.mp4 and the segment id is the rank of the video among those of its camera. A
+manifest line can give them explicitly after the path: `<video> <camera_id> <seq_id> <start_time>`.
+With --crop_shards the crops of all videos are packed into one shard directory instead, this needs
+fast-reid-master on PYTHONPATH (fastreid/utils/crop_shards.py).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+
+# add python path of PadleDetection to sys.path
+parent_path = os.path.abspath(os.path.join(__file__, *(['..'] * 2)))
+if parent_path not in sys.path:
+    sys.path.append(parent_path)
+
+import copy
+import glob
+import json
+import multiprocessing as mp
+import re
+import time
+from collections import OrderedDict
+import traceback
+
+# the model is only imported in the workers, so that each of them can set its device
+# and number of threads before paddle is loaded
+_WORKER = {}
+
+VIDEO_NAME_PATTERN = re.compile(r'D(\d+)_(\d{14})')
+
+
+def parse_args():
+    from ppdet.utils.cli import ArgsParser
+    parser = ArgsParser()
+    parser.add_argument("--video_dir", type=str, default=None, help="Directory of the videos to track.")
+    parser.add_argument("--manifest", type=str, default=None, help="Text file with one video path per line.")
+    parser.add_argument("--video_ext", type=str, default="mp4", help="Video extension searched in --video_dir.")
+    parser.add_argument("--output_root", type=str, default="output",
+                        help="Every video is tracked into <output_root>/<seq>/.")
+    parser.add_argument("--ledger", type=str, default=None,
+                        help="Status file of the videos, <output_root>/ledger.json by default.")
+    parser.add_argument("--num_workers", type=int, default=2, help="Number of worker processes.")
+    parser.add_argument("--gpus", type=str, default="",
+                        help="Comma separated GPU ids, workers are assigned round robin. Empty runs on CPU.")
+    parser.add_argument("--cpu_threads", type=int, default=0,
+                        help="Threads per worker, by default the cores are split between the workers.")
+    parser.add_argument("--frame_rate", type=int, default=-1, help="Video frame rate")
+    parser.add_argument("--batch_size", type=int, default=None, help="Frames per forward, see Tracker.mot_predict.")
+    parser.add_argument("--save_videos", action='store_true', help="Save tracking results (video).")
+    parser.add_argument("--draw_threshold", type=float, default=0.5, help="Threshold to reserve the result.")
+    parser.add_argument("--retry_failed", action='store_true', help="Run the videos that failed before again.")
+    parser.add_argument("--save_crops", action='store_true', help="Cut the crops of generate.ipynb while tracking.")
+    parser.add_argument("--crop_shards", type=str, default=None,
+                        help="Shard directory to pack the crops into, instead of <output_root>/<seq>/crops/.")
+    parser.add_argument("--crop_frame_interval", type=int, default=10,
+                        help="Minimum number of frames between two crops of the same id.")
+    parser.add_argument("--min_box_area", type=float, default=20000, help="Minimum area of a crop, -1 to disable.")
+    parser.add_argument("--min_threshold", type=float, default=-1, help="Minimum score of a crop, -1 to disable.")
+    return parser.parse_args()
+
+
+def list_videos(video_dir=None, manifest=None, video_ext="mp4"):
+    """
+    Returns:
+        OrderedDict: absolute path of every video -> the fields following it in the manifest.
+    """
+    videos = OrderedDict()
+    if manifest:
+        with open(manifest, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if fields and not fields[0].startswith('#'):
+                    videos.setdefault(os.path.abspath(fields[0]), fields[1:])
+    if video_dir:
+        for video_file in sorted(glob.glob(os.path.join(video_dir, '*.{}'.format(video_ext)))):
+            videos.setdefault(os.path.abspath(video_file), [])
+    assert videos, "No video found, set --video_dir or --manifest"
+    return videos
+
+
+def crop_infos(videos):
+    """
+    Returns:
+        dict: video -> (camera_id, seq_id, start_time) of its crops, None if it is unknown.
+    """
+    infos, by_camera = {}, {}
+    for video_file, fields in videos.items():
+        if len(fields) >= 3:
+            infos[video_file] = (int(fields[0]), int(fields[1]), fields[2])
+            continue
+        match = VIDEO_NAME_PATTERN.search(os.path.basename(video_file))
+        if match is None:
+            infos[video_file] = None
+            continue
+        by_camera.setdefault(int(match.group(1)), []).append((match.group(2), video_file))
+    for camera_id, items in by_camera.items():
+        # segment ids count from 1 in ascending file name order
+        for seq_id, (start_time, video_file) in enumerate(sorted(items, key=lambda item: item[1]), 1):
+            infos[video_file] = (camera_id, seq_id, start_time)
+    return infos
+
+
+def video_seq(video_file):
+    # same as Tracker.mot_predict
+    return video_file.split('/')[-1].split('.')[0]
+
+
+def result_file(output_root, video_file):
+    seq = video_seq(video_file)
+    return os.path.join(output_root, seq, 'mot_results', '{}.txt'.format(seq))
+
+
+class Ledger(object):
+    """
+    Status of every video ('pending', 'done' or 'failed') with timings and errors,
+    saved as json after every change. Only the parent process writes it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+
+    def is_done(self, video_file, output_root):
+        # mot_predict writes the result file atomically, so it is complete once it exists
+        entry = self.entries.get(video_file, {})
+        return entry.get('status') == 'done' and os.path.exists(result_file(output_root, video_file))
+
+    def update(self, video_file, **kwargs):
+        self.entries.setdefault(video_file, {}).update(kwargs)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def select_videos(videos, ledger, output_root, retry_failed=False):
+    """
+    Returns:
+        list: the videos to track, i.e. neither done nor (unless `retry_failed`) failed before.
+    """
+    todo = []
+    for video_file in videos:
+        status = ledger.entries.get(video_file, {}).get('status')
+        if ledger.is_done(video_file, output_root):
+            continue
+        if os.path.exists(result_file(output_root, video_file)):
+            # tracked before the ledger existed, e.g. by run.sh
+            ledger.update(video_file, status='done')
+            continue
+        if status == 'failed' and not retry_failed:
+            continue
+        todo.append(video_file)
+    return todo
+
+
+def init_worker(FLAGS, gpus, cpu_threads):
+    worker_id = mp.current_process()._identity[0] - 1
+    if cpu_threads > 0:
+        for key in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'CPU_NUM']:
+            os.environ[key] = str(cpu_threads)
+    if gpus:
+        os.environ['CUDA_VISIBLE_DEVICES'] = gpus[worker_id % len(gpus)]
+
+    import paddle
+    from ppdet.core.workspace import load_config, merge_config
+    from ppdet.engine import Tracker
+    from ppdet.utils.check import check_gpu, check_config
+
+    cfg = load_config(FLAGS.config)
+    merge_config(FLAGS.opt)
+    cfg.use_gpu = cfg.use_gpu and bool(gpus)
+    paddle.set_device('gpu:0' if cfg.use_gpu else 'cpu')
+    check_config(cfg)
+    check_gpu(cfg.use_gpu)
+
+    tracker = Tracker(cfg, mode='test')
+    if cfg.architecture in ['DeepSORT']:
+        if cfg.det_weights != 'None':
+            tracker.load_weights_sde(cfg.det_weights, cfg.reid_weights)
+        else:
+            tracker.load_weights_sde(None, cfg.reid_weights)
+    else:
+        tracker.load_weights_jde(cfg.weights)
+
+    _WORKER['tracker'] = tracker
+    _WORKER['cfg'] = cfg
+    # tracking state is reset from this copy for every video
+    _WORKER['mot_tracker'] = copy.deepcopy(tracker.model.tracker)
+
+
+def track_video(FLAGS, video_file, crop_info=None):
+    tracker = _WORKER['tracker']
+    cfg = _WORKER['cfg']
+    output_dir = os.path.join(FLAGS.output_root, video_seq(video_file))
+    start = time.time()
+    shard_writer = None
+    try:
+        from ppdet.engine.tracker import CropSink
+        from ppdet.modeling.mot.tracker.base_jde_tracker import BaseTrack
+        # track ids restart from 1 in every video, as with one infer_mot.py run per video
+        BaseTrack._count = 0
+        tracker.model.tracker = copy.deepcopy(_WORKER['mot_tracker'])
+        tracker.capture = None
+
+        crop_sink = None
+        if crop_info is not None:
+            camera_id, seq_id, start_time = crop_info
+            if FLAGS.crop_shards:
+                from fastreid.utils.crop_shards import CropShardWriter
+                # one shard prefix per video, the workers never append to the same files
+                shard_writer = CropShardWriter(FLAGS.crop_shards, video_seq(video_file))
+            frame_rate = FLAGS.frame_rate if FLAGS.frame_rate > 0 else 25.01
+            crop_sink = CropSink(
+                os.path.join(output_dir, 'crops'),
+                camera_id=camera_id,
+                seq_id=seq_id,
+                start_time=start_time,
+                video_frame_rate=frame_rate,
+                detection_frame_rate=frame_rate,
+                crop_frame_interval=FLAGS.crop_frame_interval,
+                min_threshold=FLAGS.min_threshold,
+                min_box_area=FLAGS.min_box_area,
+                shard_writer=shard_writer)
+
+        tracker.mot_predict(
+            video_file=video_file,
+            frame_rate=FLAGS.frame_rate,
+            image_dir=None,
+            output_dir=output_dir,
+            data_type=cfg.metric.lower(),
+            model_type=cfg.architecture,
+            save_videos=FLAGS.save_videos,
+            draw_threshold=FLAGS.draw_threshold,
+            batch_size=FLAGS.batch_size,
+            crop_sink=crop_sink)
+        return video_file, 'done', time.time() - start, None
+    except Exception:
+        return video_file, 'failed', time.time() - start, traceback.format_exc()
+    finally:
+        if shard_writer is not None:
+            shard_writer.close()
+
+
+def _track_job(args):
+    return track_video(*args)
+
+
+def main():
+    FLAGS = parse_args()
+    videos = list_videos(FLAGS.video_dir, FLAGS.manifest, FLAGS.video_ext)
+    os.makedirs(FLAGS.output_root, exist_ok=True)
+    ledger = Ledger(FLAGS.ledger or os.path.join(FLAGS.output_root, 'ledger.json'))
+
+    todo = select_videos(videos, ledger, FLAGS.output_root, FLAGS.retry_failed)
+    print('{} videos, {} to track'.format(len(videos), len(todo)))
+    if not todo:
+        return
+
+    save_crops = FLAGS.save_crops or FLAGS.crop_shards
+    infos = crop_infos(videos) if save_crops else {}
+    for video_file in todo:
+        if save_crops and infos[video_file] is None:
+            print('No camera id and start time for {}, its crops are not saved'.format(video_file))
+
+    gpus = [g for g in FLAGS.gpus.split(',') if g != '']
+    num_workers = max(1, min(FLAGS.num_workers, len(todo)))
+    cpu_threads = FLAGS.cpu_threads or max(1, mp.cpu_count() // num_workers)
+
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(num_workers, initializer=init_worker, initargs=(FLAGS, gpus, cpu_threads),
+                  maxtasksperchild=None) as pool:
+        for video_file in todo:
+            ledger.update(video_file, status='pending', error=None,
+                          queued=time.strftime('%Y-%m-%d %H:%M:%S'))
+        # in order of completion, so a long video does not hold back the ledger of the others
+        jobs = [(FLAGS, v, infos.get(v)) for v in todo]
+        for video_file, status, seconds, error in pool.imap_unordered(_track_job, jobs):
+            ledger.update(video_file, status=status, seconds=round(seconds, 1), error=error,
+                          result=result_file(FLAGS.output_root, video_file))
+            print('[{}] {} in {:.1f}s: {}'.format(status, video_seq(video_file), seconds, video_file))
+            if error:
+                print(error)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+"""
+Merge the ids of the same pedestrian across cameras, like merge.ipynb: every row of the merge
+sheet lists the ids (separated by spaces) of one person in the columns of its cameras, the
+merged ids are numbered from 1 in order of their smallest (column, id) and the crops are given
+their new names in <save_path>/crop. Crops are hard-linked (or moved with --mode rename)
+instead of copied, and every new name is recorded in <save_path>/crop/manifest.json: running
+again with more rows in the merge sheet only renames the crops whose id changed, and --undo
+removes the links (or moves the crops back). The renames are written to the manifest before
+they are applied, so an interrupted run is finished by the next one or by --undo.
+
+    python merge.py --merge_xlsx merge_D1D2.xlsx --pic_path output/D1D2/D1D2 --cam_ids 1 2 \
+        --save_path output/D1D2/merge_result --excel output/D1D2/D1D2.xlsx
+"""
+
+import argparse
+import errno
+import json
+import os
+import re
+import shutil
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import openpyxl
+
+CROP_PATTERN = re.compile(r'(\d*)_c(\d*)s(\d*)_(\d*)_(\d*)\.jpg')
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Merge the ids of the same pedestrian across cameras")
+    parser.add_argument("--merge_xlsx", required=True, help="merge sheet, one column per entry of --cam_ids")
+    parser.add_argument("--pic_path", required=True, help="directory of the crops of all cameras")
+    parser.add_argument("--cam_ids", nargs="+", required=True,
+                        help="camera ids of every column of the merge sheet, e.g. '1,3 2' puts cameras 1 and 3 "
+                             "in the first column")
+    parser.add_argument("--save_path", required=True, help="output directory")
+    parser.add_argument("--excel", default=None, help="excel of all cameras to relabel, as generate.ipynb writes")
+    parser.add_argument("--mode", default="link", choices=["link", "rename", "copy"],
+                        help="hard-link, move or copy the crops to their new names")
+    parser.add_argument("--num_workers", type=int, default=8, help="number of threads renaming the crops")
+    parser.add_argument("--undo", action='store_true', help="undo the renames recorded in the manifest")
+    return parser
+
+
+class UnionFind(object):
+    """Union-find over any hashable keys, with path compression."""
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        parent = self.parent
+        if x not in parent:
+            parent[x] = x
+            return x
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def union(self, x, y):
+        self.parent[self.find(x)] = self.find(y)
+
+
+def load_merge_sheet(path, num_columns):
+    """
+    Returns:
+        list[list[tuple]]: the (column, pid) of every id of every row.
+    """
+    wb = openpyxl.load_workbook(path, read_only=True)
+    rows = []
+    for values in wb['Sheet1'].iter_rows(values_only=True):
+        row = []
+        for i in range(min(num_columns, len(values))):
+            if values[i] is None:
+                continue
+            for pid in str(values[i]).split(' '):
+                if pid != '':
+                    row.append((i, int(pid)))
+        rows.append(row)
+    wb.close()
+    return rows
+
+
+def scan_crops(pic_path, cam_column):
+    """
+    Returns:
+        list[tuple]: (path, (column, pid), name fields) of every crop of the cameras in `cam_column`.
+    """
+    crops = []
+    stack = [pic_path]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                    continue
+                match = CROP_PATTERN.match(entry.name)
+                if match is None or int(match.group(2)) not in cam_column:
+                    continue
+                fields = match.groups()
+                crops.append((entry.path, (cam_column[int(fields[1])], int(fields[0])), fields))
+    return crops
+
+
+def compute_relabel(keys, merge_rows):
+    """
+    Returns:
+        dict: new id of every key, from 1 in order of the smallest key of every merged group.
+    """
+    uf = UnionFind()
+    for row in merge_rows:
+        for key in row:
+            uf.union(key, row[0])
+    groups = defaultdict(set)
+    for key in keys:
+        groups[uf.find(key)].add(key)
+    relabel = {}
+    for i, group in enumerate(sorted(groups.values(), key=min)):
+        for key in group:
+            relabel[key] = i + 1
+    return relabel
+
+
+def _link(src, dst, mode):
+    if mode == "rename":
+        os.replace(src, dst)
+    elif mode == "link":
+        _remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+            # another file system, or hard links are not supported
+            shutil.copyfile(src, dst)
+    else:
+        shutil.copyfile(src, dst)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class MergeManifest(object):
+    """
+    Crop path -> new name in the output directory, saved as json. The renames of a run are
+    journaled in `pending` before any crop is touched, so a run interrupted in between is
+    finished by the next one (or by --undo) instead of losing the crops moved so far.
+    """
+
+    def __init__(self, crop_dir, mode=None):
+        self.crop_dir = crop_dir
+        self.path = os.path.join(crop_dir, 'manifest.json')
+        self.mode = mode
+        self.entries = {}
+        # crop path -> [old name or None, new name], and the step they were interrupted at
+        self.pending = {}
+        self.phase = None
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+            assert mode is None or manifest['mode'] == mode, \
+                "{} was applied with --mode {}".format(crop_dir, manifest['mode'])
+            self.mode = manifest['mode']
+            self.entries = manifest['entries']
+            self.pending = manifest.get('pending', {})
+            self.phase = manifest.get('phase')
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'mode': self.mode, 'entries': self.entries, 'pending': self.pending, 'phase': self.phase},
+                      f, indent=0, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def apply_pending(self, num_workers=8):
+        """Rename the pending crops, skipping the steps an interrupted run already did."""
+        if not self.pending:
+            return 0
+
+        def staged_path(src):
+            old = os.path.join(self.crop_dir, self.pending[src][0])
+            return old + '.merge-tmp' if self.mode == "rename" else old
+
+        def stage(src):
+            # free the old name first, the new names of other crops may take it
+            if self.mode != "rename":
+                _remove(staged_path(src))
+            elif not os.path.exists(staged_path(src)):
+                os.replace(staged_path(src)[:-len('.merge-tmp')], staged_path(src))
+
+        def move(item):
+            src, (old, name) = item
+            dst = os.path.join(self.crop_dir, name)
+            if self.mode != "rename":
+                _link(src, dst, self.mode)
+                return
+            try:
+                os.replace(staged_path(src) if old is not None else src, dst)
+            except FileNotFoundError:
+                # moved before the interruption
+                if not os.path.exists(dst):
+                    raise
+
+        with ThreadPoolExecutor(max_workers=max(num_workers, 1)) as pool:
+            if self.phase == 'stage':
+                list(pool.map(stage, [src for src, (old, _) in self.pending.items() if old is not None]))
+                self.phase = 'move'
+                self.save()
+            list(pool.map(move, self.pending.items()))
+
+        num_renamed = len(self.pending)
+        self.entries.update({src: name for src, (_, name) in self.pending.items()})
+        self.pending = {}
+        self.phase = None
+        self.save()
+        return num_renamed
+
+
+def apply_renames(names, crop_dir, mode="link", num_workers=8):
+    """
+    Give every crop path its new name in `crop_dir`, only changing the crops whose name differs
+    from the manifest. The renames of an interrupted run are finished first.
+    Args:
+        names (dict): crop path -> new name.
+    Returns:
+        int: number of crops (re)named.
+    """
+    os.makedirs(crop_dir, exist_ok=True)
+    manifest = MergeManifest(crop_dir, mode)
+    manifest.apply_pending(num_workers)
+    manifest.pending = {src: [manifest.entries.get(src), name] for src, name in names.items()
+                        if manifest.entries.get(src) != name}
+    manifest.phase = 'stage' if manifest.pending else None
+    manifest.save()
+    return manifest.apply_pending(num_workers)
+
+
+def undo_renames(crop_dir, num_workers=8):
+    manifest = MergeManifest(crop_dir)
+    manifest.apply_pending(num_workers)
+
+    def undo(item):
+        src, name = item
+        dst = os.path.join(crop_dir, name)
+        if manifest.mode != "rename":
+            _remove(dst)
+            return
+        try:
+            os.replace(dst, src)
+        except FileNotFoundError:
+            # moved back by an interrupted undo
+            if not os.path.exists(src):
+                raise
+
+    with ThreadPoolExecutor(max_workers=max(num_workers, 1)) as pool:
+        list(pool.map(undo, manifest.entries.items()))
+    os.remove(manifest.path)
+    return len(manifest.entries)
+
+
+def relabel_excel(excel_path, save_path, relabel, cam_column):
+    """Relabel the excel of all cameras (as generate.ipynb writes) and sort it by the new ids."""
+    wb = openpyxl.load_workbook(excel_path, read_only=True)
+    xlsx = []
+    for values in wb['Sheet'].iter_rows(values_only=True):
+        pid, in_time, out_time, in_frame, out_frame, cam_id, seq = values[:7]
+        if pid == '人员ID': continue
+        key = (cam_column[int(cam_id)], int(pid))
+        new_label = relabel[key] if key in relabel else int(pid)
+        xlsx.append([new_label, in_time, out_time, in_frame, out_frame, cam_id, seq])
+    wb.close()
+    xlsx = sorted(xlsx, key=lambda x: x[0])
+    new_wb = openpyxl.Workbook()
+    new_ws = new_wb['Sheet']
+    new_ws.append(['人员ID', '进入时间', '离开时间', '进入帧号', '离开帧号', '摄像头ID', '视频片段序号'])
+    for i in xlsx:
+        new_ws.append(i)
+    new_wb.save(save_path)
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    crop_dir = os.path.join(args.save_path, 'crop')
+    if args.undo:
+        print("{} crops restored".format(undo_renames(crop_dir, args.num_workers)))
+        raise SystemExit
+
+    cam_ids = [[int(cam) for cam in column.split(",")] for column in args.cam_ids]
+    cam_column = {cam: i for i, column in enumerate(cam_ids) for cam in column}
+    merge_rows = load_merge_sheet(args.merge_xlsx, len(cam_ids))
+
+    crops = scan_crops(args.pic_path, cam_column)
+    # crops moved by an earlier run with --mode rename are only in the manifest
+    manifest = MergeManifest(crop_dir, args.mode) if os.path.isdir(crop_dir) else None
+    if manifest is not None and args.mode == "rename":
+        scanned = set(path for path, _, _ in crops)
+        for src in set(manifest.entries) | set(manifest.pending):
+            match = CROP_PATTERN.match(os.path.basename(src))
+            if src not in scanned and match is not None and int(match.group(2)) in cam_column:
+                fields = match.groups()
+                crops.append((src, (cam_column[int(fields[1])], int(fields[0])), fields))
+    print("{} crops, {} merge rows".format(len(crops), len(merge_rows)))
+
+    relabel = compute_relabel([key for _, key, _ in crops], merge_rows)
+    names = {}
+    owners = {}
+    for path, key, (pid, cam, seq, frame, vdate) in crops:
+        name = "%04d_c%ss%s_%s_%s.jpg" % (relabel[key], cam, seq, frame, vdate)
+        if name in owners:
+            print("{} and {} are both renamed to {}, keeping the first".format(owners[name], path, name))
+            continue
+        owners[name] = path
+        names[path] = name
+    print("{} crops renamed".format(apply_renames(names, crop_dir, args.mode, args.num_workers)))
+
+    if args.excel:
+        relabel_excel(args.excel, os.path.join(args.save_path, 'test2.xlsx'), relabel, cam_column)
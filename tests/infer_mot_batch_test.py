@@ -0,0 +1,83 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append('.')
+from infer_mot_batch import Ledger, crop_infos, list_videos, result_file, select_videos
+
+
+class InferMotBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.video_dir = os.path.join(self.root.name, "videos")
+        self.output_root = os.path.join(self.root.name, "output")
+        os.makedirs(self.video_dir)
+        for name in ["D02_20211012130000.mp4", "D01_20211012122308.mp4", "D02_20211012075959.mp4",
+                     "D01_20211012080011.mp4", "other.mp4", "D03_20211012080000.avi"]:
+            open(os.path.join(self.video_dir, name), "w").close()
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def video(self, name):
+        return os.path.abspath(os.path.join(self.video_dir, name))
+
+    def test_list_videos(self):
+        manifest = os.path.join(self.root.name, "manifest.txt")
+        with open(manifest, "w") as f:
+            f.write("# video camera_id seq_id start_time\n")
+            f.write("{} 3 7 20211012080000\n\n".format(self.video("D03_20211012080000.avi")))
+            f.write("{} 9 1 20211012122308\n".format(self.video("D01_20211012122308.mp4")))
+        videos = list_videos(self.video_dir, manifest)
+        # the manifest first, its fields win over the video directory
+        self.assertEqual(list(videos)[:2], [self.video("D03_20211012080000.avi"), self.video("D01_20211012122308.mp4")])
+        self.assertEqual(len(videos), 6)
+        self.assertEqual(videos[self.video("D01_20211012122308.mp4")], ["9", "1", "20211012122308"])
+        self.assertEqual(videos[self.video("D02_20211012075959.mp4")], [])
+        with self.assertRaises(AssertionError):
+            list_videos(os.path.join(self.root.name, "empty"))
+
+    def test_crop_infos(self):
+        videos = list_videos(self.video_dir)
+        videos[self.video("D03_20211012080000.avi")] = ["3", "7", "20211012080000"]
+        infos = crop_infos(videos)
+        # segment ids count per camera in file name order
+        self.assertEqual(infos[self.video("D01_20211012080011.mp4")], (1, 1, "20211012080011"))
+        self.assertEqual(infos[self.video("D01_20211012122308.mp4")], (1, 2, "20211012122308"))
+        self.assertEqual(infos[self.video("D02_20211012075959.mp4")], (2, 1, "20211012075959"))
+        self.assertEqual(infos[self.video("D02_20211012130000.mp4")], (2, 2, "20211012130000"))
+        self.assertEqual(infos[self.video("D03_20211012080000.avi")], (3, 7, "20211012080000"))
+        self.assertIsNone(infos[self.video("other.mp4")])
+
+    def write_result(self, name):
+        path = result_file(self.output_root, self.video(name))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+
+    def test_resume(self):
+        videos = list_videos(self.video_dir)
+        ledger_file = os.path.join(self.root.name, "ledger.json")
+        ledger = Ledger(ledger_file)
+        ledger.update(self.video("D01_20211012080011.mp4"), status="done")
+        self.write_result("D01_20211012080011.mp4")
+        # done in the ledger, but the result was deleted
+        ledger.update(self.video("D01_20211012122308.mp4"), status="done")
+        ledger.update(self.video("D02_20211012075959.mp4"), status="failed", error="Traceback")
+        ledger.update(self.video("D02_20211012130000.mp4"), status="pending")
+        # tracked before the ledger existed
+        self.write_result("other.mp4")
+
+        ledger = Ledger(ledger_file)
+        self.assertTrue(ledger.is_done(self.video("D01_20211012080011.mp4"), self.output_root))
+        self.assertFalse(ledger.is_done(self.video("D01_20211012122308.mp4"), self.output_root))
+        todo = select_videos(videos, ledger, self.output_root)
+        self.assertEqual(sorted(todo), [self.video("D01_20211012122308.mp4"), self.video("D02_20211012130000.mp4")])
+        self.assertEqual(Ledger(ledger_file).entries[self.video("other.mp4")]["status"], "done")
+        todo = select_videos(videos, Ledger(ledger_file), self.output_root, retry_failed=True)
+        self.assertIn(self.video("D02_20211012075959.mp4"), todo)
+        self.assertEqual(len(todo), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
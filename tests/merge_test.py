@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.append('.')
+import merge
+from merge import MergeManifest, apply_renames, undo_renames
+
+
+class MergeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.pic_path = os.path.join(self.root.name, "pic")
+        self.crop_dir = os.path.join(self.root.name, "merge_result", "crop")
+        os.makedirs(self.pic_path)
+        self.crops = {}
+        for pid in range(1, 5):
+            path = os.path.join(self.pic_path, "%d_c1s1_%d_20211012.jpg" % (pid, pid * 10))
+            with open(path, "w") as f:
+                f.write(str(pid))
+            self.crops[path] = str(pid)
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def assertCrops(self, names, mode):
+        for src, name in names.items():
+            with open(os.path.join(self.crop_dir, name)) as f:
+                self.assertEqual(f.read(), self.crops[src])
+            self.assertEqual(os.path.exists(src), mode != "rename")
+        self.assertEqual(sorted(os.listdir(self.crop_dir)), sorted(list(names.values()) + ['manifest.json']))
+        self.assertEqual(MergeManifest(self.crop_dir).entries, names)
+
+    def test_apply_and_undo(self):
+        for mode in ["link", "rename", "copy"]:
+            names = {src: "%04d_%s" % (1, os.path.basename(src)[2:]) for src in self.crops}
+            self.assertEqual(apply_renames(names, self.crop_dir, mode), 4)
+            self.assertCrops(names, mode)
+            self.assertEqual(apply_renames(names, self.crop_dir, mode), 0)
+
+            # swap the names of two crops, another crop gets a new name
+            first, second, third, _ = sorted(self.crops)
+            names[first], names[second] = names[second], names[first]
+            names[third] = "0002_" + names[third][5:]
+            self.assertEqual(apply_renames(names, self.crop_dir, mode), 3)
+            self.assertCrops(names, mode)
+
+            self.assertEqual(undo_renames(self.crop_dir), 4)
+            self.assertEqual(os.listdir(self.crop_dir), [])
+            for src, content in self.crops.items():
+                with open(src) as f:
+                    self.assertEqual(f.read(), content)
+
+    def test_interrupted(self):
+        for mode in ["link", "rename"]:
+            names = {src: "%04d_%s" % (1, os.path.basename(src)[2:]) for src in self.crops}
+            apply_renames(names, self.crop_dir, mode)
+            first, second, third, fourth = sorted(self.crops)
+            names[first], names[second] = names[second], names[first]
+            names[third] = "0002_" + names[third][5:]
+            names[fourth] = "0003_" + names[fourth][5:]
+
+            # the run stops after two crops were given their new names
+            link = merge._link
+            calls = []
+
+            def failing_link(src, dst, mode):
+                if len(calls) == 2:
+                    raise KeyboardInterrupt
+                calls.append(dst)
+                link(src, dst, mode)
+
+            replace = os.replace
+
+            def failing_replace(src, dst):
+                if dst.endswith('.jpg'):
+                    failing_link(src, dst, mode)
+                else:
+                    replace(src, dst)
+
+            with mock.patch.object(merge, '_link', failing_link), mock.patch.object(os, 'replace', failing_replace):
+                with self.assertRaises(KeyboardInterrupt):
+                    apply_renames(names, self.crop_dir, mode, num_workers=1)
+            with open(os.path.join(self.crop_dir, 'manifest.json')) as f:
+                self.assertEqual(len(json.load(f)['pending']), 4)
+
+            # the next run finishes the journaled renames
+            self.assertEqual(apply_renames(names, self.crop_dir, mode), 0)
+            self.assertCrops(names, mode)
+            self.assertEqual(undo_renames(self.crop_dir), 4)
+            self.assertEqual(os.listdir(self.crop_dir), [])
+
+            # or --undo does, before restoring the crops
+            apply_renames(names, self.crop_dir, mode)
+            names[first], names[second] = names[second], names[first]
+            calls.clear()
+            with mock.patch.object(merge, '_link', failing_link), mock.patch.object(os, 'replace', failing_replace):
+                # after the first of the two renames
+                calls.append(None)
+                with self.assertRaises(KeyboardInterrupt):
+                    apply_renames(names, self.crop_dir, mode, num_workers=1)
+            self.assertEqual(undo_renames(self.crop_dir), 4)
+            self.assertEqual(os.listdir(self.crop_dir), [])
+            for src, content in self.crops.items():
+                with open(src) as f:
+                    self.assertEqual(f.read(), content)
+
+
+if __name__ == '__main__':
+    unittest.main()
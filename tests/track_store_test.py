@@ -0,0 +1,63 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append('.')
+from track_store import TrackStore, export_xlsx, import_xlsx, tracks_from_output
+
+# frame, pid, x, y, w, h, threshold
+OUTPUT = [
+    [1, 1, 0, 0, 100, 200, 0.9],
+    [2, 1, 0, 0, 100, 300, 0.7],
+    [2, 2, 0, 0, 150, 200, 0.8],
+    [60, 2, 0, 0, 150, 200, 0.6],
+]
+
+
+class TrackStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.root.name, "tracks.db")
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def test_round_trip(self):
+        store = TrackStore(self.db)
+        # the same segment number and pids on two days
+        day1 = tracks_from_output(OUTPUT, 2, 1, "20211012080011", crop_counts={1: 3},
+                                  video="/data/20211012/D02_20211012075959.mp4")
+        day2 = tracks_from_output(OUTPUT, 2, 1, "20211013080011",
+                                  video="output/D02_20211013075959/mot_results/D02_20211013075959.txt")
+        store.add(day1)
+        store.add(day2)
+        self.assertEqual(len(store.query()), 4)
+
+        rows = store.query(camera_ids=[2], start="20211012080000", end="20211012090000")
+        self.assertEqual([(row['pid'], row['in_frame'], row['out_frame']) for row in rows], [(1, 1, 2), (2, 2, 60)])
+        self.assertEqual(rows[0]['video'], "D02_20211012075959")
+        self.assertEqual(rows[0]['num_boxes'], 2)
+        self.assertEqual(rows[0]['max_area'], 30000)
+        self.assertEqual(rows[0]['num_crops'], 3)
+
+        # adding a video again replaces all of its tracks
+        store.add(tracks_from_output(OUTPUT[:1], 2, 1, "20211012080011", video="D02_20211012075959.mp4"))
+        self.assertEqual(len(store.query(start="20211012080000", end="20211012090000")), 1)
+        self.assertEqual(len(store.query()), 3)
+
+        xlsx = os.path.join(self.root.name, "D02_20211013075959.xlsx")
+        export_xlsx(xlsx, store.query(start="20211013000000"))
+        rows = import_xlsx(xlsx, "20211013080011")
+        self.assertEqual([(row['pid'], row['in_frame'], row['out_frame'], row['video']) for row in rows],
+                         [(1, 1, 2, "D02_20211013075959"), (2, 2, 60, "D02_20211013075959")])
+        store.add(rows)
+        self.assertEqual(len(store.query()), 3)
+
+        store.delete(2, 1, "D02_20211013075959.xlsx")
+        self.assertEqual(len(store.query()), 1)
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,273 @@
+"""
+Track metadata of all videos in one SQLite database, instead of one excel per video.
+Every track (camera, video segment, pid of a video) has its in/out frames and times, box statistics
+and number of crops, and can be queried by camera and time range. Segment numbers restart every
+day and pids every video, so tracks are keyed by the video name (e.g. D02_20211012075959) too,
+and adding a video again replaces all of its tracks. The excel of generate.ipynb
+(and the summary excel merge.ipynb reads) is exported from the database.
+
+    # tracks of a video from the FairMOT output, see also generate.py --track_db
+    python track_store.py --db tracks.db add --output_txt output/D02_20211012075959/mot_results/D02_20211012075959.txt \
+        --camera_id 2 --seq_id 1 --start_time 20211012080011
+    # existing excel files
+    python track_store.py --db tracks.db import --xlsx D02_20211012075959.xlsx --start_time 20211012080011
+    # summary excel of cameras 1 and 2 between 8:00 and 12:00
+    python track_store.py --db tracks.db export --xlsx D1D2.xlsx --cameras 1 2 --start 20211012080000 --end 20211012120000
+"""
+
+import argparse
+import datetime
+import os
+import sqlite3
+from collections import OrderedDict
+
+import openpyxl
+
+COLUMNS = ['camera_id', 'seq_id', 'pid', 'in_frame', 'out_frame', 'frame_rate', 'start_ts', 'end_ts',
+           'num_boxes', 'mean_area', 'max_area', 'mean_score', 'num_crops', 'video']
+
+XLSX_HEADER = ['人员ID', '进入时间', '离开时间', '进入帧号', '离开帧号', '摄像头ID', '视频片段序号']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    camera_id INTEGER NOT NULL,
+    seq_id INTEGER NOT NULL,
+    pid INTEGER NOT NULL,
+    in_frame INTEGER NOT NULL,
+    out_frame INTEGER NOT NULL,
+    frame_rate REAL NOT NULL,
+    start_ts REAL,
+    end_ts REAL,
+    num_boxes INTEGER,
+    mean_area REAL,
+    max_area REAL,
+    mean_score REAL,
+    num_crops INTEGER,
+    video TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (camera_id, seq_id, video, pid)
+);
+CREATE INDEX IF NOT EXISTS tracks_camera_time ON tracks (camera_id, start_ts);
+CREATE INDEX IF NOT EXISTS tracks_time ON tracks (start_ts, end_ts);
+"""
+
+
+def parse_time(value):
+    """'20211012080011' or a datetime to a unix timestamp."""
+    if isinstance(value, str):
+        value = datetime.datetime.strptime(value, "%Y%m%d%H%M%S")
+    return value.timestamp()
+
+
+def video_name(path):
+    """Name of a video in the store: its file name without extension, the same for the video,
+    its output.txt and its excel, e.g. D02_20211012075959."""
+    return os.path.splitext(os.path.basename(path))[0] if path else ''
+
+
+def video_time(frame, frame_rate):
+    # same as generate.ipynb: whole seconds since the start of the video
+    time = frame // frame_rate
+    return "%02d:%02d:%02d" % (time // 3600, time % 3600 // 60, time % 60)
+
+
+def tracks_from_output(output, camera_id=1, seq_id=1, start_time=None, detection_frame_rate=25.01,
+                       crop_counts=None, video=None):
+    """
+    Args:
+        output (list): [frame, pid, x, y, w, h, threshold] rows of output.txt, as generate.load_mot_output.
+        start_time (str): real start time of the video, e.g. "20211012080011", None if unknown.
+        crop_counts (dict): number of crops of every pid.
+        video (str): path of the video (or of its output.txt), see video_name().
+    Returns:
+        list[dict]: one row per pid, in order of first appearance.
+    """
+    stats = OrderedDict()
+    for frame, pid, x, y, w, h, threshold in output:
+        s = stats.get(pid)
+        if s is None:
+            s = stats[pid] = [frame, frame, 0, 0., 0., 0.]
+        s[1] = frame
+        s[2] += 1
+        s[3] += w * h
+        s[4] = max(s[4], w * h)
+        s[5] += threshold
+
+    start_ts = parse_time(start_time) if start_time else None
+    rows = []
+    for pid, (in_frame, out_frame, num_boxes, area, max_area, score) in stats.items():
+        rows.append({
+            'camera_id': camera_id,
+            'seq_id': seq_id,
+            'pid': pid,
+            'in_frame': in_frame,
+            'out_frame': out_frame,
+            'frame_rate': detection_frame_rate,
+            'start_ts': None if start_ts is None else start_ts + in_frame / detection_frame_rate,
+            'end_ts': None if start_ts is None else start_ts + out_frame / detection_frame_rate,
+            'num_boxes': num_boxes,
+            'mean_area': area / num_boxes,
+            'max_area': max_area,
+            'mean_score': score / num_boxes,
+            'num_crops': None if crop_counts is None else crop_counts.get(pid, 0),
+            'video': video_name(video),
+        })
+    return rows
+
+
+class TrackStore(object):
+    """
+    SQLite table of tracks keyed by (camera_id, seq_id, video, pid), indexed by camera and start time.
+    Adding the tracks of a video replaces the tracks it had, so a video can be processed again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def _insert(self, rows):
+        sql = "INSERT OR REPLACE INTO tracks ({}) VALUES ({})".format(
+            ", ".join(COLUMNS), ", ".join("?" * len(COLUMNS)))
+        self.conn.executemany(sql, ([row.get(c, '' if c == 'video' else None) for c in COLUMNS] for row in rows))
+
+    def add(self, rows):
+        """
+        Add a list of track dicts in one transaction. The tracks already stored for the
+        (camera_id, seq_id, video) of the rows are deleted first.
+        """
+        videos = {(row['camera_id'], row['seq_id'], row.get('video') or '') for row in rows}
+        with self.conn:
+            for camera_id, seq_id, video in videos:
+                self._delete(camera_id, seq_id, video)
+            self._insert(rows)
+        return len(rows)
+
+    def query(self, camera_ids=None, start=None, end=None, seq_ids=None, pids=None):
+        """
+        Tracks of `camera_ids` that are visible between `start` and `end` (timestamps, datetimes
+        or strings like "20211012080011"), sorted by start time.
+        Returns:
+            list[dict]
+        """
+        where, args = [], []
+        for column, values in [('camera_id', camera_ids), ('seq_id', seq_ids), ('pid', pids)]:
+            if values is not None:
+                values = list(values)
+                where.append("{} IN ({})".format(column, ", ".join("?" * len(values))))
+                args += values
+        if start is not None:
+            where.append("end_ts >= ?")
+            args.append(start if isinstance(start, (int, float)) else parse_time(start))
+        if end is not None:
+            where.append("start_ts <= ?")
+            args.append(end if isinstance(end, (int, float)) else parse_time(end))
+        sql = "SELECT * FROM tracks"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY start_ts, camera_id, seq_id, in_frame, pid"
+        return [dict(row) for row in self.conn.execute(sql, args)]
+
+    def _delete(self, camera_id, seq_id, video):
+        self.conn.execute("DELETE FROM tracks WHERE camera_id = ? AND seq_id = ? AND video = ?",
+                          (camera_id, seq_id, video))
+
+    def delete(self, camera_id, seq_id, video):
+        """Delete the tracks of a video, `video` as given to tracks_from_output() or its name."""
+        with self.conn:
+            self._delete(camera_id, seq_id, video_name(video))
+
+    def close(self):
+        self.conn.close()
+
+
+def export_xlsx(path, rows):
+    """Write tracks in the layout of the excel of generate.ipynb."""
+    wb = openpyxl.Workbook()
+    ws = wb['Sheet']
+    ws.append(XLSX_HEADER)
+    for row in rows:
+        ws.append([row['pid'], video_time(row['in_frame'], row['frame_rate']),
+                   video_time(row['out_frame'], row['frame_rate']), row['in_frame'], row['out_frame'],
+                   row['camera_id'], row['seq_id']])
+    wb.save(path)
+
+
+def import_xlsx(path, start_time=None, frame_rate=25.01):
+    """
+    Tracks of an excel written by generate.ipynb. Only frames, cameras and segments are in it,
+    `start_time` of the video is needed for the time queries. The excel is named after its
+    video, which gives the video name of the tracks.
+    """
+    wb = openpyxl.load_workbook(path, read_only=True)
+    ws = wb['Sheet']
+    start_ts = parse_time(start_time) if start_time else None
+    rows = []
+    for values in ws.iter_rows(min_row=2, values_only=True):
+        if values[0] is None:
+            continue
+        pid, in_time, out_time, in_frame, out_frame, camera_id, seq_id = values[:7]
+        rows.append({
+            'camera_id': int(camera_id),
+            'seq_id': int(seq_id),
+            'pid': int(pid),
+            'in_frame': int(in_frame),
+            'out_frame': int(out_frame),
+            'frame_rate': frame_rate,
+            'start_ts': None if start_ts is None else start_ts + int(in_frame) / frame_rate,
+            'end_ts': None if start_ts is None else start_ts + int(out_frame) / frame_rate,
+            'video': video_name(path),
+        })
+    wb.close()
+    return rows
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Track metadata store")
+    parser.add_argument("--db", default="tracks.db", help="SQLite database")
+    subparsers = parser.add_subparsers(dest="command")
+
+    add = subparsers.add_parser("add", help="add the tracks of a FairMOT output.txt")
+    add.add_argument("--output_txt", required=True)
+    add.add_argument("--camera_id", type=int, default=1)
+    add.add_argument("--seq_id", type=int, default=1)
+    add.add_argument("--start_time", default=None, help="real start time of the video, e.g. 20211012080011")
+    add.add_argument("--detection_frame_rate", type=float, default=25.01)
+    add.add_argument("--ignore_pids", type=int, nargs="*", default=[])
+    add.add_argument("--min_threshold", type=float, default=-1)
+    add.add_argument("--min_box_area", type=float, default=20000)
+
+    imp = subparsers.add_parser("import", help="import an excel written by generate.ipynb")
+    imp.add_argument("--xlsx", required=True)
+    imp.add_argument("--start_time", default=None, help="real start time of the video, e.g. 20211012080011")
+    imp.add_argument("--frame_rate", type=float, default=25.01)
+
+    exp = subparsers.add_parser("export", help="export tracks to an excel like generate.ipynb")
+    exp.add_argument("--xlsx", required=True)
+    exp.add_argument("--cameras", type=int, nargs="*", default=None)
+    exp.add_argument("--start", default=None, help="e.g. 20211012080000")
+    exp.add_argument("--end", default=None, help="e.g. 20211012120000")
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    store = TrackStore(args.db)
+    if args.command == "add":
+        from generate import load_mot_output
+        output = load_mot_output(args.output_txt, args.ignore_pids, args.min_threshold, args.min_box_area)
+        rows = tracks_from_output(output, args.camera_id, args.seq_id, args.start_time,
+                                  args.detection_frame_rate, video=args.output_txt)
+        print("{} tracks added to {}".format(store.add(rows), args.db))
+    elif args.command == "import":
+        rows = import_xlsx(args.xlsx, args.start_time, args.frame_rate)
+        print("{} tracks imported to {}".format(store.add(rows), args.db))
+    elif args.command == "export":
+        rows = store.query(args.cameras, args.start, args.end)
+        export_xlsx(args.xlsx, rows)
+        print("{} tracks exported to {}".format(len(rows), args.xlsx))
+    else:
+        get_parser().print_help()
+    store.close()
@@ -23,8 +23,12 @@ import paddle
 import numpy as np
 
 import time
-from threading import Thread
-from queue import Queue
+import pickle
+import datetime
+import itertools
+from collections import defaultdict
+from threading import Lock, Thread
+from queue import Full, Queue
 
 from paddle.vision.transforms import functional as F
 from deploy.python.preprocess import preprocess, Resize, NormalizeImage, Permute, PadStride, LetterBoxResize
@@ -33,6 +37,7 @@ from ppdet.core.workspace import create
 from ppdet.utils.checkpoint import load_weight, load_pretrain_weight
 from ppdet.modeling.mot.utils import Detection, get_crops, scale_coords, clip_box
 from ppdet.modeling.mot.utils import Timer, load_det_results
+from ppdet.modeling.mot.tracker.base_jde_tracker import BaseTrack
 from ppdet.modeling.mot import visualization as mot_vis
 
 from ppdet.metrics import Metric, MOTMetric, KITTIMOTMetric
@@ -46,41 +51,184 @@ logger = setup_logger(__name__)
 __all__ = ['Tracker']
 
 
+class StageProfiler(object):
+    """
+    Latency of every stage of the tracking pipeline, frame by frame, and the occupancy of its
+    queues, for benchmarks. Stages are recorded from the capture and renderer threads too.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.queue_sizes = defaultdict(list)
+        self.queue_capacity = {}
+        self._lock = Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def sample_queue(self, name, queue):
+        self.queue_capacity[name] = queue.maxsize
+        self.queue_sizes[name].append(queue.qsize())
+
+    def summary(self, num_frames=None, elapsed=None):
+        """
+        Returns:
+            dict: count, total seconds and mean/p50/p90/p99/max milliseconds of every stage,
+                mean/p50/p90/max size of every queue, and the end to end fps if given the
+                number of frames and the elapsed time.
+        """
+        result = {'stages': {}, 'queues': {}}
+        with self._lock:
+            samples = {k: np.asarray(v) for k, v in self.samples.items() if v}
+        for stage, v in sorted(samples.items()):
+            p50, p90, p99 = np.percentile(v, [50, 90, 99]) * 1000
+            result['stages'][stage] = {
+                'count': len(v), 'total_s': float(v.sum()), 'mean_ms': float(v.mean() * 1000),
+                'p50_ms': float(p50), 'p90_ms': float(p90), 'p99_ms': float(p99),
+                'max_ms': float(v.max() * 1000)}
+        for name, v in sorted(self.queue_sizes.items()):
+            v = np.asarray(v)
+            p50, p90 = np.percentile(v, [50, 90])
+            result['queues'][name] = {
+                'capacity': self.queue_capacity[name], 'mean': float(v.mean()),
+                'p50': float(p50), 'p90': float(p90), 'max': int(v.max())}
+        if num_frames is not None and elapsed:
+            result['frames'] = num_frames
+            result['elapsed_s'] = elapsed
+            result['fps'] = num_frames / elapsed
+        return result
+
+
 class VideoCaptureWidget(object):
-    def __init__(self, capture=None, buffer_size=20):
-        self.queue = Queue(maxsize=buffer_size)
+    """
+    Staged video input pipeline: one decoder thread reads frames from the capture and a
+    pool of preprocess workers turns them into model inputs. Each worker builds the
+    preprocess operators once and reuses its input buffer, and get_frame() returns the
+    frames in decoding order whatever worker finished first. The first `start_frame` frames
+    are skipped without decoding, to resume tracking from a checkpoint.
+    """
+    _END = object()
+
+    def __init__(self, capture=None, buffer_size=20, num_workers=2, preprocess_infos=None,
+                 start_frame=0, profiler=None):
         self.capture = capture
-        
-        self.thread = Thread(target=self.update, args=())
-        self.thread.daemon = True
-        self.thread.start()
+        self.start_frame = start_frame
+        self.profiler = profiler
+        self.buffer_size = buffer_size
+        self.num_workers = max(num_workers, 1)
+        self.decode_queue = Queue(maxsize=buffer_size)
+        self.queue = Queue(maxsize=buffer_size)
         self.video_end = False
-        
-        self.pred_config_preprocess_infos =  [{'target_size': [608, 1088], 'type': 'LetterBoxResize'}, 
-                            {'is_scale': True, 'mean': [0, 0, 0], 'std': [1, 1, 1], 'type': 'NormalizeImage'}, {'type': 'Permute'}]
+
+        self.pred_config_preprocess_infos = preprocess_infos or [
+            {'target_size': [608, 1088], 'type': 'LetterBoxResize'},
+            {'is_scale': True, 'mean': [0, 0, 0], 'std': [1, 1, 1], 'type': 'NormalizeImage'}, {'type': 'Permute'}]
+
+        # frames finished out of order, by frame index
+        self._pending = {}
+        self._next_idx = 0
+        self._workers_done = 0
+        # per stage: number of frames and seconds spent working on them
+        self._stats = {'decode': [0, 0.], 'preprocess': [0, 0.], 'wait': [0, 0.]}
+        self._stats_lock = Lock()
+        self._start_time = time.perf_counter()
+
+        self.threads = [Thread(target=self.update, args=())]
+        self.threads += [Thread(target=self.preprocess_worker, args=()) for _ in range(self.num_workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def build_preprocess_ops(self):
+        preprocess_ops = []
+        for op_info in self.pred_config_preprocess_infos:
+            new_op_info = op_info.copy()
+            op_type = new_op_info.pop('type')
+            preprocess_ops.append(eval(op_type)(**new_op_info))
+        return preprocess_ops
 
     def update(self):
-        # Read the next frame from the video in a different thread
-        while True:
-            if self.capture.isOpened() and not self.queue.full():
+        # Read the frames from the video in a different thread
+        idx = 0
+        try:
+            # grab() does not decode the skipped frames, and unlike seeking it is frame exact
+            for _ in range(self.start_frame):
+                if not self.capture.grab():
+                    break
+            while self.capture.isOpened():
+                tic = time.perf_counter()
                 status, frame = self.capture.read()
                 if not status:
-                    self.video_end = True
                     break
-                
-                data = self.preprocess([frame])
-                data['ori_image'] = paddle.unsqueeze(paddle.to_tensor(frame),axis=0)
-                for k in data:
-                    data[k] = paddle.to_tensor(data[k])
-                data = data
-                self.queue.put(data)
-                
-            time.sleep(.01)
+                self._add_stats('decode', time.perf_counter() - tic)
+                self.decode_queue.put((idx, frame))
+                idx += 1
+        finally:
+            # always release the workers, otherwise get_frame() would wait forever
+            for _ in range(self.num_workers):
+                self.decode_queue.put(self._END)
+
+    def preprocess_worker(self):
+        preprocess_ops = self.build_preprocess_ops()
+        buffers = {}
+        try:
+            while True:
+                item = self.decode_queue.get()
+                if item is self._END:
+                    break
+                idx, frame = item
+                tic = time.perf_counter()
+                im, im_info = self.preprocess_(frame, preprocess_ops)
+                # paddle.to_tensor copies, so the same numpy buffers can be filled for every frame
+                data = {}
+                for k, v in (('image', im), ('im_shape', im_info['im_shape']),
+                             ('scale_factor', im_info['scale_factor'])):
+                    v = np.asarray(v)
+                    if k not in buffers or buffers[k].shape[1:] != v.shape:
+                        buffers[k] = np.empty((1, ) + v.shape, dtype=np.float32)
+                    buffers[k][0] = v
+                    data[k] = paddle.to_tensor(buffers[k])
+                data['ori_image'] = paddle.unsqueeze(paddle.to_tensor(frame), axis=0)
+                self._add_stats('preprocess', time.perf_counter() - tic)
+                self.queue.put((idx, data))
+        finally:
+            self.queue.put(self._END)
+
+    def _add_stats(self, stage, seconds):
+        with self._stats_lock:
+            stats = self._stats[stage]
+            stats[0] += 1
+            stats[1] += seconds
+        if self.profiler is not None:
+            self.profiler.record(stage, seconds)
 
     def get_frame(self):
-        return None if self.queue.empty() and self.video_end else self.queue.get()
-    
-    
+        tic = time.perf_counter()
+        while self._next_idx not in self._pending:
+            if self._workers_done == self.num_workers:
+                self.video_end = True
+                return None
+            item = self.queue.get()
+            if item is self._END:
+                self._workers_done += 1
+            else:
+                self._pending[item[0]] = item[1]
+        self._add_stats('wait', time.perf_counter() - tic)
+        self._next_idx += 1
+        return self._pending.pop(self._next_idx - 1)
+
+    def report(self):
+        """Log the throughput of every stage: frames per second of busy time, the
+        preprocess workers are summed, and how long the consumer waited for frames."""
+        elapsed = time.perf_counter() - self._start_time
+        decode, preprocess, wait = (self._stats[k] for k in ('decode', 'preprocess', 'wait'))
+        logger.info('Capture pipeline after {:.1f}s: decode {:.2f} fps, preprocess {:.2f} fps '
+                    '({} workers), consumer waited {:.1f}s for {} frames'.format(
+                        elapsed, decode[0] / max(decode[1], 1e-5),
+                        preprocess[0] / max(preprocess[1], 1e-5) * self.num_workers,
+                        self.num_workers, wait[1], wait[0]))
+
     def decode_image(self, im_file, im_info):
         """read rgb image
         Args:
@@ -154,11 +302,7 @@ class VideoCaptureWidget(object):
         inputs['image'] = np.stack(padding_imgs, axis=0)
         return inputs
     def preprocess(self, image_list):
-        preprocess_ops = []
-        for op_info in self.pred_config_preprocess_infos:
-            new_op_info = op_info.copy()
-            op_type = new_op_info.pop('type')
-            preprocess_ops.append(eval(op_type)(**new_op_info))
+        preprocess_ops = self.build_preprocess_ops()
 
         input_im_lst = []
         input_im_info_lst = []
@@ -169,6 +313,312 @@ class VideoCaptureWidget(object):
         inputs = self.create_inputs(input_im_lst, input_im_info_lst)
         return inputs
 
+class ResultRenderer(object):
+    """
+    Background stage that draws the tracking results and writes them to the video writer
+    or save_dir, so the tracking loop does not wait for plotting and encoding.
+    `policy` decides what happens when the bounded queue is full: 'block' waits for room,
+    'drop' skips rendering that frame. Only every `render_every`-th frame is rendered; skipped
+    and dropped frames are filled with the next rendered one, in the video and as numbered
+    images in save_dir, so the duration is unchanged and the image sequence has no gaps.
+    close() renders everything still queued and repeats the last rendered frame up to the
+    last frame put. An error of the rendering thread is raised by the next put() or close().
+    """
+    _END = object()
+
+    def __init__(self, save_dir=None, writer=None, show_image=False, queue_size=64,
+                 policy='block', render_every=1, start_frame=0, profiler=None):
+        assert policy in ['block', 'drop'], "policy should be 'block' or 'drop'"
+        self.save_dir = save_dir
+        self.writer = writer
+        self.show_image = show_image
+        self.policy = policy
+        self.render_every = max(render_every, 1)
+        self.queue = Queue(maxsize=queue_size)
+        self.num_dropped = 0
+        self.profiler = profiler
+        self.error = None
+        self._last_written = start_frame - 1
+        self._last_frame = start_frame - 1
+
+        self.thread = Thread(target=self.update, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError('Result renderer failed') from self.error
+
+    def put(self, data, frame_id, online_ids, online_tlwhs, online_scores, average_time):
+        self._raise_error()
+        self._last_frame = frame_id
+        if frame_id % self.render_every != 0:
+            return
+        item = (data['ori_image'], frame_id, online_ids, online_tlwhs, online_scores, average_time)
+        if self.policy == 'block':
+            self.queue.put(item)
+        else:
+            try:
+                self.queue.put_nowait(item)
+            except Full:
+                self.num_dropped += 1
+
+    def _write(self, online_im, frame_id):
+        # frames since the last written one get a copy of this one
+        if frame_id <= self._last_written:
+            return
+        if self.writer is not None:
+            for _ in range(frame_id - self._last_written):
+                self.writer.write(online_im)
+        elif self.save_dir is not None:
+            ok, buf = cv2.imencode('.jpg', online_im)
+            assert ok, 'Failed to encode frame {}'.format(frame_id)
+            for i in range(self._last_written + 1, frame_id + 1):
+                with open(os.path.join(self.save_dir, '{:05d}.jpg'.format(i)), 'wb') as f:
+                    f.write(buf.tobytes())
+        self._last_written = frame_id
+
+    def update(self):
+        online_im = None
+        while True:
+            item = self.queue.get()
+            if item is self._END:
+                break
+            if self.error is not None:
+                # keep draining, so that put() and close() never wait on a dead thread
+                continue
+            try:
+                ori_image, frame_id, online_ids, online_tlwhs, online_scores, average_time = item
+                tic = time.perf_counter()
+                img0 = ori_image.numpy()[0]
+                online_im = mot_vis.plot_tracking(
+                    img0,
+                    online_tlwhs,
+                    online_ids,
+                    online_scores,
+                    frame_id=frame_id,
+                    fps=1. / average_time)
+                if self.show_image:
+                    cv2.imshow('online_im', online_im)
+                toc = time.perf_counter()
+
+                self._write(online_im, frame_id)
+                if self.profiler is not None:
+                    self.profiler.record('plot', toc - tic)
+                    self.profiler.record('video_write', time.perf_counter() - toc)
+            except Exception as e:
+                logger.exception('Result renderer failed at frame {}'.format(item[1]))
+                self.error = e
+
+        if self.error is None and online_im is not None:
+            try:
+                self._write(online_im, self._last_frame)
+            except Exception as e:
+                logger.exception('Result renderer failed to write the last frames')
+                self.error = e
+
+    def close(self):
+        self.queue.put(self._END)
+        self.thread.join()
+        if self.num_dropped > 0:
+            logger.info('Result renderer dropped {} frames'.format(self.num_dropped))
+        self._raise_error()
+
+
+class CropSink(object):
+    """
+    Cut the pedestrian crops of generate.ipynb while the frame is still in memory, instead of
+    decoding the video a second time from output.txt. The boxes are filtered by `ignore_pids`,
+    `min_box_area` and `min_threshold`, an id is cropped again only `crop_frame_interval`
+    frames after its last crop and the crops get the same names as in the notebook.
+    `num_writers` background threads encode and write them, to `save_dir` or appended to
+    `shard_writer` (a CropShardWriter of fast-reid-master/fastreid/utils/crop_shards.py).
+    """
+    _END = object()
+
+    def __init__(self, save_dir, camera_id=1, seq_id=1, start_time='20211012080011',
+                 video_frame_rate=25.01, detection_frame_rate=25.01, crop_frame_interval=10,
+                 ignore_pids=(), min_threshold=-1, min_box_area=20000, num_writers=2, queue_size=256,
+                 shard_writer=None):
+        if shard_writer is None and not os.path.exists(save_dir): os.makedirs(save_dir)
+        self.save_dir = save_dir
+        self.shard_writer = shard_writer
+        self.camera_id = camera_id
+        self.seq_id = seq_id
+        self.start_time = datetime.datetime.strptime(start_time, "%Y%m%d%H%M%S")
+        self.frame_ratio = video_frame_rate / detection_frame_rate
+        self.detection_frame_rate = detection_frame_rate
+        self.crop_frame_interval = crop_frame_interval
+        self.ignore_pids = set(ignore_pids)
+        self.min_threshold = min_threshold
+        self.min_box_area = min_box_area
+        self.last_crop_frame = {}
+        self.num_crops = 0
+        self.num_failed = 0
+        self._lock = Lock()
+        self.queue = Queue(maxsize=queue_size)
+
+        self.threads = [Thread(target=self.update, args=()) for _ in range(max(num_writers, 1))]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def put(self, frame, ori_image, online_tlwhs, online_scores, online_ids):
+        """
+        Args:
+            frame (int): frame number as in output.txt, from 1.
+            ori_image (Tensor): the frame, of shape [1, h, w, 3].
+        """
+        crops = []
+        for tlwh, score, pid in zip(online_tlwhs, online_scores, online_ids):
+            x, y, w, h = [float(v) for v in tlwh]
+            if pid < 0 or pid in self.ignore_pids or \
+                    (self.min_box_area != -1 and w * h < self.min_box_area) or \
+                    (self.min_threshold != -1 and score < self.min_threshold):
+                continue
+            if frame - self.last_crop_frame.get(pid, -self.crop_frame_interval) < self.crop_frame_interval:
+                continue
+            self.last_crop_frame[pid] = frame
+            if x * y * w * h <= 0:
+                continue
+            time = self.start_time + datetime.timedelta(seconds=round(frame / self.detection_frame_rate))
+            file_name = "%04d_c%02ds%02d_%04d_%s.jpg" % (pid, self.camera_id, self.seq_id,
+                                                         round(frame * self.frame_ratio),
+                                                         time.strftime("%Y%m%d%H%M%S"))
+            crops.append((file_name, (round(y), round(y + h), round(x), round(x + w))))
+        if not crops:
+            return
+        # the frame is only copied to numpy when something is cropped from it
+        img0 = ori_image.numpy()[0]
+        img_h, img_w = img0.shape[:2]
+        for file_name, (y0, y1, x0, x1) in crops:
+            # boxes partly outside the frame are clipped to it, empty crops are skipped
+            y0, x0 = max(y0, 0), max(x0, 0)
+            y1, x1 = min(y1, img_h), min(x1, img_w)
+            if y1 <= y0 or x1 <= x0:
+                continue
+            self.queue.put((file_name, img0[y0:y1, x0:x1].copy()))
+
+    def update(self):
+        while True:
+            item = self.queue.get()
+            if item is self._END:
+                self.queue.task_done()
+                break
+            file_name, crop = item
+            ret = False
+            try:
+                if self.shard_writer is not None:
+                    ret, buf = cv2.imencode('.jpg', crop)
+                    if ret:
+                        self.shard_writer.write(file_name, buf.tobytes())
+                else:
+                    ret = cv2.imwrite(os.path.join(self.save_dir, file_name), crop)
+            except Exception:
+                logger.exception('Failed to write crop {}'.format(file_name))
+                ret = False
+            finally:
+                # flush() waits on every item, written or not
+                with self._lock:
+                    if ret:
+                        self.num_crops += 1
+                    else:
+                        self.num_failed += 1
+                self.queue.task_done()
+
+    def flush(self):
+        # wait until every crop put so far is written
+        self.queue.join()
+
+    def state_dict(self):
+        return {'last_crop_frame': dict(self.last_crop_frame)}
+
+    def load_state_dict(self, state):
+        self.last_crop_frame = dict(state['last_crop_frame'])
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(self._END)
+        for thread in self.threads:
+            thread.join()
+        if self.shard_writer is not None:
+            logger.info('{} crops save in {}'.format(self.num_crops, self.shard_writer.root))
+        else:
+            logger.info('{} crops save in {}'.format(self.num_crops, self.save_dir))
+        if self.num_failed > 0:
+            logger.warning('{} crops could not be written'.format(self.num_failed))
+
+
+class MOTResultWriter(object):
+    """
+    Stream tracking results to `filename` instead of keeping them all in memory. Lines go to
+    `filename + '.part'` and are flushed to disk every `flush_every` frames (only on flush()
+    and close() if it is not positive), close() then renames the part file, so an existing
+    result file is always complete. To resume from a checkpoint, pass the `offset` flush()
+    returned when it was saved: the part file is cut back to it and appended to.
+    """
+
+    def __init__(self, filename, data_type='mot', flush_every=100, offset=None):
+        if data_type in ['mot', 'mcmot', 'lab']:
+            self.save_format = '{frame},{id},{x1},{y1},{w},{h},{score},-1,-1,-1\n'
+        elif data_type == 'kitti':
+            self.save_format = '{frame} {id} car 0 0 -10 {x1} {y1} {x2} {y2} -10 -10 -10 -1000 -1000 -1000 -10\n'
+        else:
+            raise ValueError(data_type)
+        self.filename = filename
+        self.part_filename = filename + '.part'
+        self.data_type = data_type
+        self.flush_every = flush_every
+        self._lines = []
+        self._num_pending = 0
+
+        if offset is None:
+            self.file = open(self.part_filename, 'w')
+        else:
+            os.truncate(self.part_filename, offset)
+            self.file = open(self.part_filename, 'a')
+
+    def write(self, frame_id, tlwhs, tscores, track_ids):
+        if self.data_type == 'kitti':
+            frame_id -= 1
+        for tlwh, score, track_id in zip(tlwhs, tscores, track_ids):
+            if track_id < 0:
+                continue
+            x1, y1, w, h = tlwh
+            x2, y2 = x1 + w, y1 + h
+            self._lines.append(self.save_format.format(
+                frame=frame_id,
+                id=track_id,
+                x1=x1,
+                y1=y1,
+                x2=x2,
+                y2=y2,
+                w=w,
+                h=h,
+                score=score))
+        self._num_pending += 1
+        if 0 < self.flush_every <= self._num_pending:
+            self.flush()
+
+    def flush(self):
+        """
+        Returns:
+            int: size of the part file, everything written so far is on disk.
+        """
+        self.file.write(''.join(self._lines))
+        self._lines = []
+        self._num_pending = 0
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        os.replace(self.part_filename, self.filename)
+        logger.info('MOT results save in {}'.format(self.filename))
+
+
 class Tracker(object):
     def __init__(self, cfg, mode='eval'):
         self.cfg = cfg
@@ -248,7 +698,19 @@ class Tracker(object):
                       frame_rate=30,
                       draw_threshold=0,
                       capture=None,
-                      writer=None):
+                      writer=None,
+                      batch_size=1,
+                      result_writer=None,
+                      checkpoint_file=None,
+                      start_frame=0,
+                      crop_sink=None,
+                      profiler=None):
+        """
+        Track the frames of `capture` (or `dataloader`). With a StageProfiler, the latency of
+        every stage and the size of every queue are recorded frame by frame.
+        """
+        assert checkpoint_file is None or result_writer is not None, \
+            "checkpoints need the results to be streamed by result_writer"
         if save_dir:
             if not os.path.exists(save_dir): os.makedirs(save_dir)
         tracker = self.model.tracker
@@ -256,34 +718,51 @@ class Tracker(object):
 
         timer = Timer()
         results = []
-        frame_id = 0
+        frame_id = start_frame
+        checkpoint_every = self.cfg.get('mot_checkpoint_every', 3000)
         self.status['mode'] = 'track'
         self.model.eval()
+        renderer = None
+        if show_image or save_dir is not None or writer is not None:
+            renderer = ResultRenderer(save_dir, writer, show_image,
+                                      queue_size=self.cfg.get('render_queue_size', 64),
+                                      policy=self.cfg.get('render_policy', 'block'),
+                                      render_every=self.cfg.get('render_every', 1),
+                                      start_frame=start_frame,
+                                      profiler=profiler)
         if capture is not None:
             # use cv2 capture
             video_len = capture.get(cv2.CAP_PROP_FRAME_COUNT)
             if video_len <= 0:
                 video_len = 200000
-            vcw = VideoCaptureWidget(capture, buffer_size=50)
+            vcw = VideoCaptureWidget(capture,
+                                     buffer_size=self.cfg.get('capture_queue_depth', 50),
+                                     num_workers=self.cfg.get('capture_num_workers', 2),
+                                     start_frame=start_frame,
+                                     profiler=profiler)
             logger.info("Length of the video: {} frames".format(video_len))
-            
-            dataloader = range(round(video_len))
-        for step_id, data in enumerate(dataloader):
-            # forward
-            if capture != None:
-                # ret, data = capture.read()
-                data = vcw.get_frame()
-                if data is None:
-                    logger.info("Processing video end.")
-                    break
+
+            # frames in decoding order, until the video ends
+            dataloader = itertools.islice(iter(vcw.get_frame, None), max(round(video_len) - start_frame, 0))
+        elif start_frame > 0:
+            dataloader = itertools.islice(dataloader, start_frame, None)
+        for step_id, (data, pred_dets, pred_embs, forward_time) in enumerate(
+                self._forward_jde(dataloader, batch_size)):
             self.status['step_id'] = step_id
             if frame_id % 2000 == 0:
                 logger.info('Processing frame {} ({:.2f} fps)'.format(
                     frame_id, 1. / max(1e-5, timer.average_time)))
+                if capture is not None:
+                    vcw.report()
                 
             timer.tic()
-            pred_dets, pred_embs = self.model(data)
+            # charge every frame its share of the (batched) forward
+            timer.start_time -= forward_time
+            tic = time.perf_counter()
             online_targets = self.model.tracker.update(pred_dets, pred_embs)
+            if profiler is not None:
+                profiler.record('forward', forward_time)
+                profiler.record('track', time.perf_counter() - tic)
 
             online_tlwhs, online_ids = [], []
             online_scores = []
@@ -299,17 +778,189 @@ class Tracker(object):
                     online_scores.append(tscore)
             timer.toc()
 
+            tic = time.perf_counter()
+            if crop_sink is not None:
+                crop_sink.put(frame_id + 1, data['ori_image'], online_tlwhs, online_scores, online_ids)
+            crop_toc = time.perf_counter()
             # save results
-            results.append(
-                (frame_id + 1, online_tlwhs, online_scores, online_ids))
+            if result_writer is not None:
+                result_writer.write(frame_id + 1, online_tlwhs, online_scores, online_ids)
+            else:
+                results.append(
+                    (frame_id + 1, online_tlwhs, online_scores, online_ids))
+            result_toc = time.perf_counter()
+            # with a renderer, the time the tracking loop waits for room in the render queue
             self.save_results(data, frame_id, online_ids, online_tlwhs,
                             online_scores, timer.average_time, show_image,
-                            save_dir, writer=writer)
+                            save_dir, writer=writer, renderer=renderer)
+            if profiler is not None:
+                profiler.record('crop_put', crop_toc - tic)
+                profiler.record('result_write', result_toc - crop_toc)
+                profiler.record('save_results', time.perf_counter() - result_toc)
+                if capture is not None:
+                    profiler.sample_queue('decode', vcw.decode_queue)
+                    profiler.sample_queue('preprocess', vcw.queue)
+                if renderer is not None:
+                    profiler.sample_queue('render', renderer.queue)
+                if crop_sink is not None:
+                    profiler.sample_queue('crops', crop_sink.queue)
             frame_id += 1
-            
-
+            if checkpoint_every > 0 and frame_id % checkpoint_every == 0:
+                self._prune_removed_stracks()
+                if checkpoint_file:
+                    if crop_sink is not None:
+                        crop_sink.flush()
+                    self.save_track_checkpoint(checkpoint_file, frame_id, result_writer.flush(), crop_sink)
+
+        if renderer is not None:
+            renderer.close()
+        if capture is not None:
+            logger.info("Processing video end.")
+            vcw.report()
         return results, frame_id, timer.average_time, timer.calls
 
+    # attributes of JDETracker that change while tracking
+    _TRACKER_STATE = ['frame_id', 'tracked_stracks', 'lost_stracks', 'removed_stracks']
+
+    def _prune_removed_stracks(self):
+        """
+        JDETracker keeps every removed track, but only uses them to drop their ids from the lost
+        tracks. A removed track that is neither tracked nor lost can never come back, so it is
+        dropped, which keeps the memory and the checkpoints bounded on long videos.
+        """
+        tracker = self.model.tracker
+        alive = set(t.track_id for t in tracker.tracked_stracks + tracker.lost_stracks)
+        tracker.removed_stracks = [t for t in tracker.removed_stracks if t.track_id in alive]
+
+    def save_track_checkpoint(self, filename, frame_id, result_offset, crop_sink=None):
+        """
+        Save the number of frames tracked so far, the size of the result part file at that
+        frame and the track table, so that tracking can resume from there.
+        """
+        tracker = self.model.tracker
+        state = {
+            'frame_id': frame_id,
+            'result_offset': result_offset,
+            # track ids come from a class level counter
+            'track_count': BaseTrack._count,
+            'tracker': {k: getattr(tracker, k) for k in self._TRACKER_STATE},
+            'crop_sink': crop_sink.state_dict() if crop_sink is not None else None,
+        }
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
+
+    def load_track_checkpoint(self, filename, crop_sink=None):
+        """
+        Restore the track table (and the state of the crop sink) saved by save_track_checkpoint().
+        Returns:
+            (int, int): the number of frames tracked and the size of the result part file.
+        """
+        with open(filename, 'rb') as f:
+            state = pickle.load(f)
+        for k, v in state['tracker'].items():
+            setattr(self.model.tracker, k, v)
+        BaseTrack._count = state['track_count']
+        if crop_sink is not None and state.get('crop_sink') is not None:
+            crop_sink.load_state_dict(state['crop_sink'])
+        return state['frame_id'], state['result_offset']
+
+    def _render_resumed_frames(self, video_file, result_filename, result_offset, start_frame,
+                               data_type, writer):
+        """
+        Write the first `start_frame` frames of a resumed video again, from the source video and
+        the results of the interrupted run, so the resumed run writes one continuous video: the
+        video of the interrupted run cannot be appended to and is unreadable after a crash.
+        """
+        results = defaultdict(lambda: ([], [], []))
+        with open(result_filename + '.part', 'rb') as f:
+            lines = f.read(result_offset).decode().splitlines()
+        for line in lines:
+            if data_type == 'kitti':
+                values = line.split(' ')
+                frame, track_id = int(values[0]) + 1, int(values[1])
+                x1, y1, x2, y2 = [float(v) for v in values[6:10]]
+                tlwh, score = (x1, y1, x2 - x1, y2 - y1), 1.
+            else:
+                values = line.split(',')
+                frame, track_id = int(values[0]), int(values[1])
+                tlwh, score = tuple(float(v) for v in values[2:6]), float(values[6])
+            tlwhs, scores, ids = results[frame]
+            tlwhs.append(tlwh)
+            scores.append(score)
+            ids.append(track_id)
+
+        logger.info('Rendering the {} frames tracked before resuming'.format(start_frame))
+        capture = cv2.VideoCapture(video_file)
+        try:
+            for frame_id in range(start_frame):
+                ret, img0 = capture.read()
+                if not ret:
+                    break
+                tlwhs, scores, ids = results.get(frame_id + 1, ([], [], []))
+                writer.write(mot_vis.plot_tracking(img0, tlwhs, ids, scores, frame_id=frame_id))
+        finally:
+            capture.release()
+
+    def _forward_jde(self, dataloader, batch_size=1):
+        """
+        Yield (data, pred_dets, pred_embs, forward_time) for every frame in order. With
+        batch_size > 1, FairMOT runs `batch_size` consecutive frames at once and forward_time
+        is the per-frame share of the batch.
+        """
+        if batch_size > 1 and type(self.model).__name__ != 'FairMOT':
+            logger.warning("Batched inference only supports FairMOT, falling back to batch size 1")
+            batch_size = 1
+
+        dataloader = iter(dataloader)
+        while True:
+            batch = list(itertools.islice(dataloader, max(batch_size, 1)))
+            if len(batch) == 0:
+                break
+            tic = time.time()
+            if batch_size > 1:
+                outputs = self._forward_batch_fairmot(batch)
+            else:
+                outputs = [self.model(batch[0])]
+            forward_time = (time.time() - tic) / len(batch)
+            for data, (pred_dets, pred_embs) in zip(batch, outputs):
+                yield data, pred_dets, pred_embs, forward_time
+
+    def _forward_batch_fairmot(self, batch):
+        """
+        Run FairMOT on several frames at once. Backbone, neck, detection head and reid head
+        see the whole batch, while CenterNetPostProcess, which only supports a batch size of 1,
+        and the embedding gather run per frame exactly as in FairMOT._forward.
+        """
+        model = self.model
+        detector = model.detector
+        inputs = {
+            k: paddle.concat([data[k] for data in batch], axis=0)
+            for k in ['image', 'im_shape', 'scale_factor']
+        }
+        if getattr(model, 'data_format', 'NCHW') == 'NHWC':
+            inputs['image'] = paddle.transpose(inputs['image'], [0, 2, 3, 1])
+
+        body_feats = detector.backbone(inputs)
+        neck_feat = detector.neck(body_feats)
+        head_out = detector.head(neck_feat, inputs)
+        embedding = model.reid(neck_feat, inputs)
+
+        outputs = []
+        for i, data in enumerate(batch):
+            pred_dets, bbox_inds = detector.post_process(
+                head_out['heatmap'][i:i + 1],
+                head_out['size'][i:i + 1],
+                head_out['offset'][i:i + 1],
+                im_shape=data['im_shape'],
+                scale_factor=data['scale_factor'])
+            frame_emb = paddle.transpose(embedding[i:i + 1], [0, 2, 3, 1])
+            frame_emb = paddle.reshape(frame_emb, [-1, paddle.shape(frame_emb)[-1]])
+            pred_embs = paddle.gather(frame_emb, bbox_inds)
+            outputs.append((pred_dets, pred_embs))
+        return outputs
+
     def _eval_seq_sde(self,
                       dataloader,
                       save_dir=None,
@@ -541,7 +1192,10 @@ class Tracker(object):
                     scaled=False,
                     det_results_dir='',
                     draw_threshold=0.5,
-                    use_capture=True):
+                    use_capture=True,
+                    batch_size=None,
+                    resume=True,
+                    crop_sink=None):
         assert video_file is not None or image_dir is not None, \
             "--video_file or --image_dir should be set."
         assert video_file is None or os.path.isfile(video_file), \
@@ -583,6 +1237,14 @@ class Tracker(object):
         
         dataloader = create('TestMOTReader')(self.dataset, 0) if use_capture is False else None
         result_filename = os.path.join(result_root, '{}.txt'.format(seq))
+        # JDE results are streamed to disk with periodic checkpoints of the tracks,
+        # an interrupted run starts again from the last one
+        checkpoint_file = result_filename + '.ckpt'
+        start_frame, result_offset = 0, None
+        if model_type in ['JDE', 'FairMOT'] and resume and os.path.exists(checkpoint_file) \
+                and os.path.exists(result_filename + '.part'):
+            start_frame, result_offset = self.load_track_checkpoint(checkpoint_file, crop_sink)
+            logger.info('Resuming {} from frame {}'.format(seq, start_frame))
         if frame_rate == -1:
             if self.capture:
                 frame_rate = self.capture.get(cv2.CAP_PROP_FPS)
@@ -597,9 +1259,15 @@ class Tracker(object):
             width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
             height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
             video_writer = cv2.VideoWriter(output_video_path, fourcc, frame_rate, (width, height))
+            if start_frame > 0:
+                self._render_resumed_frames(video_file, result_filename, result_offset, start_frame,
+                                            data_type, video_writer)
 
         with paddle.no_grad():
             if model_type in ['JDE', 'FairMOT']:
+                result_writer = MOTResultWriter(result_filename, data_type,
+                                                flush_every=self.cfg.get('mot_flush_every', 100),
+                                                offset=result_offset)
                 results, nf, ta, tc = self._eval_seq_jde(
                     dataloader,
                     save_dir=save_dir,
@@ -607,8 +1275,22 @@ class Tracker(object):
                     frame_rate=frame_rate,
                     draw_threshold=draw_threshold,
                     capture=self.capture,
-                    writer=video_writer)
+                    writer=video_writer,
+                    batch_size=batch_size or self.cfg.get('mot_batch_size', 1),
+                    result_writer=result_writer,
+                    checkpoint_file=checkpoint_file,
+                    start_frame=start_frame,
+                    crop_sink=crop_sink)
+                # the crops are on disk before the checkpoint is removed
+                if crop_sink is not None:
+                    crop_sink.close()
+                result_writer.close()
+                if os.path.exists(checkpoint_file):
+                    os.remove(checkpoint_file)
             elif model_type in ['DeepSORT']:
+                if crop_sink is not None:
+                    logger.warning('Crops are only cut while tracking with JDE and FairMOT')
+                    crop_sink.close()
                 results, nf, ta, tc = self._eval_seq_sde(
                     dataloader,
                     save_dir=save_dir,
@@ -618,10 +1300,12 @@ class Tracker(object):
                     det_file=os.path.join(det_results_dir,
                                           '{}.txt'.format(seq)),
                     draw_threshold=draw_threshold)
+                self.write_mot_results(result_filename, results, data_type)
             else:
                 raise ValueError(model_type)
 
-        self.write_mot_results(result_filename, results, data_type)
+        if video_writer is not None:
+            video_writer.release()
 
         if not use_capture and save_videos:
             output_video_path = os.path.join(save_dir, '..',
@@ -632,37 +1316,18 @@ class Tracker(object):
             logger.info('Save video in {}'.format(output_video_path))
 
     def write_mot_results(self, filename, results, data_type='mot'):
-        if data_type in ['mot', 'mcmot', 'lab']:
-            save_format = '{frame},{id},{x1},{y1},{w},{h},{score},-1,-1,-1\n'
-        elif data_type == 'kitti':
-            save_format = '{frame} {id} car 0 0 -10 {x1} {y1} {x2} {y2} -10 -10 -10 -1000 -1000 -1000 -10\n'
-        else:
-            raise ValueError(data_type)
-
-        with open(filename, 'w') as f:
-            for frame_id, tlwhs, tscores, track_ids in results:
-                if data_type == 'kitti':
-                    frame_id -= 1
-                for tlwh, score, track_id in zip(tlwhs, tscores, track_ids):
-                    if track_id < 0:
-                        continue
-                    x1, y1, w, h = tlwh
-                    x2, y2 = x1 + w, y1 + h
-                    line = save_format.format(
-                        frame=frame_id,
-                        id=track_id,
-                        x1=x1,
-                        y1=y1,
-                        x2=x2,
-                        y2=y2,
-                        w=w,
-                        h=h,
-                        score=score)
-                    f.write(line)
-        logger.info('MOT results save in {}'.format(filename))
+        result_writer = MOTResultWriter(filename, data_type, flush_every=0)
+        for frame_id, tlwhs, tscores, track_ids in results:
+            result_writer.write(frame_id, tlwhs, tscores, track_ids)
+        result_writer.close()
 
     def save_results(self, data, frame_id, online_ids, online_tlwhs,
-                     online_scores, average_time, show_image, save_dir, writer=None):
+                     online_scores, average_time, show_image, save_dir, writer=None,
+                     renderer=None):
+        if renderer is not None:
+            renderer.put(data, frame_id, online_ids, online_tlwhs,
+                         online_scores, average_time)
+            return
         if show_image or save_dir is not None:
             assert 'ori_image' in data
             img0 = data['ori_image'].numpy()[0]